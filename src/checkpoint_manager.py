@@ -0,0 +1,148 @@
+##checkpoint writing of the training loop
+###the state is copied to cpu memory in the training loop and written to disk by a background thread, the next epoch of training goes on during the write
+###files are written to a temporary name and renamed, a crash during the write never leaves a partial checkpoint
+###the best checkpoints (model_best.resnetode.tar, model_best_train.resnetode.tar) are hardlinks of the written file (copies if hardlinks are not supported), no extra write
+import os
+import re
+import shutil
+import threading
+import torch
+
+__all__=['state_to_cpu','checkpoint_manager']
+
+def state_to_cpu(state):
+    """
+    copy of the (nested dict/list/tuple) state with all tensors cloned to cpu, other values are kept
+    """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu',copy=True)
+    elif isinstance(state,dict):
+        return type(state)((key,state_to_cpu(value)) for key, value in state.items())
+    elif isinstance(state,(list,tuple)):
+        return type(state)(state_to_cpu(value) for value in state)
+
+    return state
+
+class checkpoint_manager(object):
+    """
+    asynchronous checkpoint writer
+    the checkpoint is written every save_interval epochs and in the epochs with a new best model
+    with keep_last>1 each epoch is written as checkpoint.resnetode.epochN.tar (the last keep_last are kept) and checkpoint.resnetode.tar links the latest
+
+     EX code:
+     manager=checkpoint_manager(keep_last=3,save_interval=5)
+     manager.save(state,epoch,is_best=True)
+     manager.close()
+    """
+    def __init__(self,filename='checkpoint.resnetode.tar',best_filename='model_best.resnetode.tar',best_train_filename='model_best_train.resnetode.tar',
+                 keep_last=1,save_interval=1,async_write=True,scan_existing=False):
+        """
+            filename: the latest checkpoint
+            best_filename: the checkpoint of the best validation loss
+            best_train_filename: the checkpoint of the best training loss
+            keep_last: number of epoch checkpoints kept. Default 1 (only filename)
+            save_interval: write every save_interval epochs (the best checkpoints are always written). Default 1
+            async_write: write in a background thread (True) or in the training loop (False). Default True
+            scan_existing: whether the epoch checkpoints already in the folder (e.g. of the run training continues from) count in keep_last. Default False
+        """
+        if keep_last<1 or save_interval<1:
+            raise ValueError('keep_last and save_interval need to be at least 1')
+
+        self.filename=filename
+        self.best_filename=best_filename
+        self.best_train_filename=best_train_filename
+        self.keep_last=keep_last
+        self.save_interval=save_interval
+        self.async_write=async_write
+        self.epochfiles=self._scan_epochfiles() if scan_existing and keep_last>1 else []
+        self._thread=None
+        self._error=None
+
+    def _epoch_filename(self,epoch):
+        if self.keep_last==1:
+            return self.filename
+
+        root,ext=os.path.splitext(self.filename)
+        return root+'.epoch'+str(epoch)+ext
+
+    def _scan_epochfiles(self):
+        ##epoch checkpoints of filename on disk, ordered by epoch
+        root,ext=os.path.splitext(self.filename)
+        pattern=re.compile(re.escape(os.path.basename(root))+r'\.epoch(\d+)'+re.escape(ext)+'$')
+        folder=os.path.dirname(self.filename)
+        epochfiles=[]
+        for name in os.listdir(folder if folder!='' else '.'):
+            match=pattern.match(name)
+            if match is not None:
+                epochfiles.append((int(match.group(1)),os.path.join(folder,name)))
+
+        return [path for _, path in sorted(epochfiles)]
+
+    def _link(self,src,dst):
+        ##dst replaced by a hardlink of src (a copy if hardlinks are not supported) by one rename
+        tmpname=dst+'.tmp'
+        if os.path.lexists(tmpname):
+            os.remove(tmpname)
+
+        try:
+            os.link(src,tmpname)
+        except OSError:
+            shutil.copyfile(src,tmpname)
+
+        os.replace(tmpname,dst)
+
+    def _write(self,state,epoch,is_best,is_best_train):
+        try:
+            path=self._epoch_filename(epoch)
+            torch.save(state,path+'.tmp')
+            os.replace(path+'.tmp',path)
+            if path!=self.filename:
+                self._link(path,self.filename)
+                if path in self.epochfiles:##rewritten epoch of a continued run
+                    self.epochfiles.remove(path)
+                self.epochfiles.append(path)
+                while len(self.epochfiles)>self.keep_last:
+                    os.remove(self.epochfiles.pop(0))
+
+            if is_best:
+                self._link(path,self.best_filename)
+            if is_best_train:
+                self._link(path,self.best_train_filename)
+        except Exception as e:
+            self._error=e
+
+    def save(self,state,epoch,is_best=False,is_best_train=False,force=False):
+        """
+        write the state of the epoch if it is a save epoch (or a best one, or force)
+        the tensors are copied to cpu before return, the state can be changed by training afterwards
+        return whether the checkpoint is written
+        """
+        if not (force or is_best or is_best_train or epoch%self.save_interval==0):
+            return False
+
+        snapshot=state_to_cpu(state)
+        self.wait()##one write at a time
+        if self.async_write:
+            self._thread=threading.Thread(target=self._write,args=(snapshot,epoch,is_best,is_best_train),daemon=True)
+            self._thread.start()
+        else:
+            self._write(snapshot,epoch,is_best,is_best_train)
+            self.wait()
+
+        return True
+
+    def wait(self):
+        """
+        wait for the running write, raise its error
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread=None
+
+        if self._error is not None:
+            error=self._error
+            self._error=None
+            raise error
+
+    def close(self):
+        self.wait()
@@ -0,0 +1,435 @@
+#data set structure used in training and testing
+# 1. lazy data set on the HDF5 (matlab v7.3) input file, read in blocks of whole time series instead of loading the full matrix in memory
+# 2. sampler of random blocks (whole time series), the batch index is computed by tensor operations. The distributed version shards the blocks across processes
+# 3. in memory batch loader, each batch is one index operation on the whole tensors instead of per sample collation
+# 4. whole time series data set for rnn, the rnn input is reshaped once
+# 5. reshape of the flat input rows to the rnn input
+# 6. run artifact store: split index, seed and normalization statistics in a small HDF5 file, the input data is referred by path and hash
+import os
+import hashlib
+import numpy as np
+import h5py
+import torch
+import torch.utils.data as utils
+from torch.utils.data.sampler import Sampler
+
+__all__=['dataset_h5_block','h5_column_stat','batch_sampler_block','batch_sampler_block_dist','batch_loader_tensor','dataset_rnn_seq','rnn_input_reshape','file_sha256','run_artifact_save','run_artifact_load']
+
+def h5_column_stat(filename,key,rowind,nreadrow=2**16):
+    """
+    column mean, std, min and max of the rows rowind in the matrix key of the matlab file, computed by streaming over the rows
+    the same value as Xvar[rowind,:].mean(axis=0), Xvar[rowind,:].std(axis=0) without loading the matrix
+        filename: the input file
+        key: the matrix name, e.g. 'inputstore'
+        rowind: row index (0 based, rows in the python orientation)
+        nreadrow: number of rows in each read
+    """
+    rowind=np.sort(np.asarray(rowind))
+    with h5py.File(filename,'r') as f:
+        dset=f[key]
+        ncol=dset.shape[0]
+        nrow=0
+        meanvec=np.zeros(ncol)
+        m2vec=np.zeros(ncol)
+        minvec=np.full(ncol,np.inf)
+        maxvec=np.full(ncol,-np.inf)
+        for readstart in range(0,len(rowind),nreadrow):
+            rows=rowind[readstart:(readstart+nreadrow)]
+            buf=dset[:,rows[0]:(rows[-1]+1)][:,rows-rows[0]]
+            ##merge the mean and sum of square of the block (Chan et al.)
+            nblock=buf.shape[1]
+            blockmean=buf.mean(axis=1)
+            blockm2=((buf-blockmean[:,None])**2).sum(axis=1)
+            delta=blockmean-meanvec
+            ntotal=nrow+nblock
+            meanvec=meanvec+delta*nblock/ntotal
+            m2vec=m2vec+blockm2+delta**2*nrow*nblock/ntotal
+            nrow=ntotal
+            minvec=np.minimum(minvec,buf.min(axis=1))
+            maxvec=np.maximum(maxvec,buf.max(axis=1))
+
+    return {"mean": meanvec, "std": np.sqrt(m2vec/nrow), "min": minvec, "max": maxvec}
+
+class dataset_h5_block(utils.Dataset):
+    """
+    data set reading inputstore/outputstore of the matlab file lazily
+    item i is the row rowind[i] of the (python orientation) matrix. The matrix is stored transposed (column major) in the file and
+    only the rows of a batch are read and transposed
+    a list/array of index returns the whole batch, contiguous rows (blocks of time series) are read together
+    use it with a batch sampler as DataLoader(dataset,batch_size=None,sampler=batch_sampler) to read one batch per step
+
+     EX code:
+     dataset=dataset_h5_block('../data/sparselinearode_new.small.stepwiseadd.mat',np.arange(0,42))
+     data,target=dataset[list(range(0,21))]
+    """
+    def __init__(self,filename,rowind,normstat=None,inputkey='inputstore',outputkey='outputstore',mergegap=None):
+        """
+            filename: the input file
+            rowind: row index (0 based) of the data set in the whole matrix
+            normstat: dict with "mean" and "std" of the input columns, if given the input is normalized as (X-mean)/std. Default None
+            inputkey: matrix name of input. Default 'inputstore'
+            outputkey: matrix name of response. Default 'outputstore'
+            mergegap: rows with gap smaller than mergegap are read in one read. Default the length of the time series
+        """
+        self.filename=filename
+        self.rowind=np.asarray(rowind).astype(int)
+        self.inputkey=inputkey
+        self.outputkey=outputkey
+        with h5py.File(self.filename,'r') as f:
+            self.ninput=f[self.inputkey].shape[0]
+            self.noutput=f[self.outputkey].shape[0]
+            if mergegap is None:
+                mergegap=int(np.array(f.get('ntime'))[0][0])
+
+        self.mergegap=mergegap
+        if normstat is not None:
+            self.meanvec=np.asarray(normstat["mean"])
+            self.stdvec=np.asarray(normstat["std"])
+        else:
+            self.meanvec=None
+            self.stdvec=None
+
+        self._file=None
+        self._pid=None
+
+    def _dset(self,key):
+        ##h5py file handle can not be shared by processes, each DataLoader worker open its own
+        if self._file is None or self._pid!=os.getpid():
+            self._file=h5py.File(self.filename,'r')
+            self._pid=os.getpid()
+
+        return self._file[key]
+
+    def _read_rows(self,key,rows):
+        dset=self._dset(key)
+        order=np.argsort(rows,kind='stable')
+        sortrows=rows[order]
+        breaks=np.flatnonzero(np.diff(sortrows)>self.mergegap)+1
+        starts=np.concatenate(([0],breaks))
+        ends=np.concatenate((breaks,[len(sortrows)]))
+        out=np.empty((len(rows),dset.shape[0]))
+        for start, end in zip(starts,ends):
+            rowstart=sortrows[start]
+            buf=dset[:,rowstart:(sortrows[end-1]+1)]
+            out[order[start:end],:]=buf[:,sortrows[start:end]-rowstart].T
+
+        return out
+
+    def __getitem__(self,index):
+        if torch.is_tensor(index):
+            index=index.numpy()
+
+        single=np.ndim(index)==0
+        rows=self.rowind[np.atleast_1d(index)]
+        data=self._read_rows(self.inputkey,rows)
+        target=self._read_rows(self.outputkey,rows)
+        if self.meanvec is not None:
+            data=(data-self.meanvec)/self.stdvec
+
+        data=torch.Tensor(data)
+        target=torch.Tensor(target)
+        if single:
+            return data[0], target[0]
+
+        return data, target
+
+    def __len__(self):
+        return len(self.rowind)
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state['_file']=None
+        state['_pid']=None
+        return state
+
+class batch_sampler_block(Sampler):
+    """
+    user defined sampler to make sure random sampling blocks
+    each batch is a LongTensor of index containing nblock random whole blocks
+    blocks are the contiguous runs of the same value in blocks and can have different length
+    default replacement=FALSE
+    default drop_last=FALSE
+    """
+    def __init__(self,datasource,blocks,nblock=1,drop_last=False):
+        """
+            datasource: data set
+            blocks: block list
+            nblocks: number of block for each batch
+            drop_last: whether drop the last batch with less than nblock blocks
+
+         EX code:
+         datasource=np.array([0,1,2,3,4,5,6,7,8,9])
+         blocks=np.array([0,0,1,1,2,2,3,3,4,4])
+         nblocks=2
+         list(batch_sampler_block(datasource,blocks,nblock=nblocks))
+        """
+        self.datasource=datasource
+        self.blocks=np.asarray(blocks)
+        self.nblock=nblock
+        self.drop_last=drop_last
+        blockbreak=np.flatnonzero(self.blocks[1:]!=self.blocks[:-1])+1
+        blockstart=np.concatenate(([0],blockbreak))
+        blocklen=np.diff(np.concatenate((blockstart,[len(self.blocks)])))
+        self.blockstart=torch.from_numpy(blockstart).long()
+        self.blocklen=torch.from_numpy(blocklen).long()
+        if (blocklen==blocklen[0]).all():
+            self.blocksize=int(blocklen[0])
+        else:
+            self.blocksize=None
+    
+    def _block_order(self):
+        return torch.randperm(len(self.blockstart))
+    
+    def __iter__(self):
+        indreorder=self._block_order()
+        n=len(indreorder)
+        for batchstart in range(0,n,self.nblock):
+            blockind=indreorder[batchstart:(batchstart+self.nblock)]
+            if self.drop_last and len(blockind)<self.nblock:
+                break
+            
+            starts=self.blockstart[blockind]
+            if self.blocksize is not None:##block offsets + within-block arange
+                yield (starts[:,None]+torch.arange(self.blocksize)[None,:]).view(-1)
+            else:
+                lens=self.blocklen[blockind]
+                shift=starts-(torch.cumsum(lens,0)-lens)
+                yield torch.repeat_interleave(shift,lens)+torch.arange(int(lens.sum()))
+    
+    def _nblock_total(self):
+        return len(self.blockstart)
+    
+    def __len__(self):
+        n=self._nblock_total()
+        if self.drop_last:
+            return n//self.nblock
+        
+        return (n+self.nblock-1)//self.nblock
+
+class batch_sampler_block_dist(batch_sampler_block):
+    """
+    distributed version of batch_sampler_block, the whole blocks are sharded across processes
+    all processes draw the same random block order (seed+epoch) and process rank takes every num_replicas-th block
+    the block order is padded by repeated blocks so every process has the same number of blocks (and batches)
+    call set_epoch(epoch) at the start of each epoch to change the order
+    individual sampling is the case of blocks of one row: blocks=np.arange(0,len(datasource))
+    """
+    def __init__(self,datasource,blocks,nblock=1,drop_last=False,num_replicas=None,rank=None,seed=0):
+        """
+            datasource: data set
+            blocks: block list
+            nblocks: number of block for each batch of each process
+            drop_last: whether drop the last batch with less than nblock blocks
+            num_replicas: number of processes. Default the world size of torch.distributed
+            rank: rank of the current process. Default the rank in torch.distributed
+            seed: seed of the block order, the same in all processes. Default 0
+
+         EX code:
+         blocks=np.array([0,0,1,1,2,2,3,3,4,4])
+         [list(batch_sampler_block_dist(blocks,blocks,nblock=2,num_replicas=2,rank=rank)) for rank in range(0,2)]
+        """
+        super(batch_sampler_block_dist,self).__init__(datasource,blocks,nblock=nblock,drop_last=drop_last)
+        if num_replicas is None:
+            num_replicas=torch.distributed.get_world_size()
+        
+        if rank is None:
+            rank=torch.distributed.get_rank()
+        
+        self.num_replicas=num_replicas
+        self.rank=rank
+        self.seed=seed
+        self.epoch=0
+    
+    def set_epoch(self,epoch):
+        self.epoch=epoch
+    
+    def _block_order(self):
+        gen=torch.Generator()
+        gen.manual_seed(self.seed+self.epoch)
+        n=len(self.blockstart)
+        indreorder=torch.randperm(n,generator=gen)
+        npad=self._nblock_total()*self.num_replicas-n
+        if npad>0:
+            indreorder=torch.cat((indreorder,indreorder.repeat(npad//n+1)[:npad]))
+        
+        return indreorder[self.rank::self.num_replicas]
+    
+    def _nblock_total(self):
+        n=len(self.blockstart)
+        return (n+self.num_replicas-1)//self.num_replicas
+
+class batch_loader_tensor(object):
+    """
+    in memory replacement of DataLoader for TensorDataset (or dataset_rnn_seq)
+    each batch is sliced from the whole tensors by one index, without per sample indexing and collation
+    the tensors can be moved to the training device once, so batches are built on the device
+    """
+    def __init__(self,dataset,batch_sampler=None,batch_size=1,shuffle=False,device=None):
+        """
+            dataset: TensorDataset or dataset_rnn_seq
+            batch_sampler: sampler that yields the index of each batch, e.g. batch_sampler_block. Default None
+            batch_size: batch size when batch_sampler is None. Default 1
+            shuffle: random order of samples when batch_sampler is None. Default False
+            device: device to store the tensors. Default None (not moved)
+
+         EX code:
+         dataset=utils.TensorDataset(torch.randn(10,3),torch.randn(10,2))
+         blocks=np.array([0,0,1,1,2,2,3,3,4,4])
+         loader=batch_loader_tensor(dataset,batch_sampler=batch_sampler_block(dataset,blocks,nblock=2))
+         [data.shape for data, target in loader]
+        """
+        self.dataset=dataset
+        self.batch_sampler=batch_sampler
+        self.batch_size=batch_size
+        self.shuffle=shuffle
+        self.device=device
+        if device is not None:
+            if isinstance(dataset,utils.TensorDataset):
+                self.dataset=utils.TensorDataset(*[tensor.to(device) for tensor in dataset.tensors])
+            else:
+                self.dataset=dataset.to(device)
+    
+    def __iter__(self):
+        if self.batch_sampler is not None:
+            batches=iter(self.batch_sampler)
+        else:
+            nsample=len(self.dataset)
+            if self.shuffle:
+                batches=torch.randperm(nsample).split(self.batch_size)
+            else:
+                batches=torch.arange(nsample).split(self.batch_size)
+        
+        for batchind in batches:
+            batchind=torch.as_tensor(batchind,dtype=torch.long)
+            if self.device is not None:
+                batchind=batchind.to(self.device)
+            
+            yield self.dataset[batchind]
+    
+    def __len__(self):
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)
+        
+        return (len(self.dataset)+self.batch_size-1)//self.batch_size
+
+class dataset_rnn_seq(utils.Dataset):
+    """
+    whole time series data set for rnn models, the rnn input is reshaped once when the data set is created
+    item i is the time series i: ((timevarinput[i],initialvec[i]),target[i])
+    a LongTensor index returns the batch with target of size (nindex*ntime)*nspec, as the rnn output
+    use blocks=np.arange(0,len(dataset)) in batch_sampler_block to sample whole time series
+    """
+    def __init__(self,timevarinput,initialvec,target):
+        """
+            timevarinput: nsample*ntime*(ntheta-nspec+1) [theta, t_k, delta t_k]
+            initialvec: nsample*(nspec+1) [Y(t_0) t_0]
+            target: nsample*ntime*nspec
+        """
+        self.timevarinput=timevarinput.contiguous()
+        self.initialvec=initialvec.contiguous()
+        self.target=target.contiguous()
+    
+    def __getitem__(self,index):
+        target=self.target[index]
+        if target.dim()==3:
+            target=target.view(-1,target.shape[2])
+        
+        return (self.timevarinput[index],self.initialvec[index]), target
+    
+    def __len__(self):
+        return self.timevarinput.shape[0]
+    
+    def to(self,device):
+        return dataset_rnn_seq(self.timevarinput.to(device),self.initialvec.to(device),self.target.to(device))
+
+def rnn_input_reshape(data,ntheta,nspec,ntime):
+    """
+    reshape the flat input (rows of whole time series blocks) to rnn input
+    timevarinput: nsample*ntime*(ntheta-nspec+1) [theta, t_k, delta t_k], theta and time
+    initialvec: nsample*(nspec+1) [Y(t_0) t_0], initial condition
+    """
+    sizes=data.shape
+    ntheta_real=ntheta-1-nspec
+    nsample_loc=int(sizes[0]/ntime)
+    fixinput_ind=torch.arange(ntheta_real,ntheta_real+nspec)
+    time_var_ind=torch.cat((torch.arange(0,ntheta_real),torch.arange(ntheta_real+nspec,ntheta)))
+    initialvec_theta=data[0:sizes[0]:ntime,:][:,fixinput_ind]
+    #nsample*(nspec+1)
+    initialvec=torch.cat((initialvec_theta,initialvec_theta.new_zeros(nsample_loc,1)),1)
+    timevec=data[:,-1]
+    deltimevec=torch.cat((timevec.new_zeros(1),timevec[1::]-timevec[0:-1]),0)
+    deltimevec[deltimevec<0]=0
+    timevarinput=torch.cat((data[:,time_var_ind],deltimevec.view(sizes[0],-1)),1)
+    #nsample*ntime*(ntheta-nspec+1)
+    timevarinput=timevarinput.view(nsample_loc,ntime,len(time_var_ind)+1)
+    return timevarinput, initialvec
+
+def file_sha256(filename,nreadbyte=2**24):
+    """
+    sha256 hash of the file content, read in pieces of nreadbyte
+    """
+    hashobj=hashlib.sha256()
+    with open(filename,'rb') as f1:
+        for buf in iter(lambda: f1.read(nreadbyte),b''):
+            hashobj.update(buf)
+
+    return hashobj.hexdigest()
+
+def run_artifact_save(filename,arrays,attrs):
+    """
+    store the run information in a HDF5 file
+    arrays are stored as contiguous uncompressed datasets (readable by offset or np.memmap), a dict of arrays becomes a group
+        filename: the output file, e.g. 'run_artifact.h5'
+        arrays: dict of arrays or dict of dict of arrays (e.g. split index). None values are not stored
+        attrs: dict of scalar or string values (e.g. seed, input file path and hash)
+
+     EX code:
+     run_artifact_save('run_artifact.h5',{'trainind': np.arange(0,10),'normstat': {'mean': np.zeros(3),'std': np.ones(3)}},{'seed': 1})
+     run_artifact_load('run_artifact.h5')['normstat']['std']
+    """
+    ##written to a temporary file and renamed, readers of the previous file (e.g. a resumed run) are not affected
+    with h5py.File(filename+'.tmp','w') as f:
+        for key, value in arrays.items():
+            if value is None:
+                continue
+            if isinstance(value,dict):
+                group=f.create_group(key)
+                for subkey, subvalue in value.items():
+                    group.create_dataset(subkey,data=np.asarray(subvalue))
+            else:
+                f.create_dataset(key,data=np.asarray(value))
+
+        for key, value in attrs.items():
+            f.attrs[key]=value
+
+    os.replace(filename+'.tmp',filename)
+
+def _artifact_array(dset,mmap):
+    offset=dset.id.get_offset()
+    if mmap and offset is not None and dset.size>0:
+        return np.memmap(dset.file.filename,dtype=dset.dtype,mode='r',offset=offset,shape=dset.shape)
+
+    return dset[()]
+
+def run_artifact_load(filename,mmap=False,checkinput=False):
+    """
+    load the run information stored by run_artifact_save
+    return dict of arrays (groups as dict) with the attributes under "attrs"
+        filename: the artifact file
+        mmap: return np.memmap of the arrays instead of reading them. Default False
+        checkinput: compare the hash of the input file (attribute inputpath) with the stored inputhash. Default False
+    """
+    store={}
+    with h5py.File(filename,'r') as f:
+        for key in f.keys():
+            if isinstance(f[key],h5py.Group):
+                store[key]={subkey: _artifact_array(f[key][subkey],mmap) for subkey in f[key].keys()}
+            else:
+                store[key]=_artifact_array(f[key],mmap)
+
+        store["attrs"]={key: (value.decode() if isinstance(value,bytes) else value) for key, value in f.attrs.items()}
+
+    if checkinput and file_sha256(store["attrs"]["inputpath"])!=store["attrs"]["inputhash"]:
+        raise ValueError('the input file '+store["attrs"]["inputpath"]+' is different from the one used in the run')
+
+    return store
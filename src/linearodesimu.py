@@ -0,0 +1,326 @@
+##python reimplementation of linearodesimu.sparse.shifted.m
+###simulate linear ODE dY/dt=HY with H a random sparse complex matrix, by the explicit eigen solution
+###samples are simulated in chunks by batched eigen decomposition (one (N,ndim,ndim) stack per chunk)
+###chunks are distributed over processes and written directly into a MATLAB v7.3 (HDF5) file of the same layout as the matlab script
+###the same solver is the reference (ground truth) of new inputs: H is rebuilt from the theta columns of inputstore by the sparse pattern (exisind)
+###and solved on any time grid by eigen decomposition or matrix exponential, with the scaling of outputstore
+import argparse
+import os
+import time
+import numpy as np
+import h5py
+from multiprocessing import Pool
+
+##default parameters (same as linearodesimu.sparse.shifted.m)
+args_internal_dict={
+    "nthetaset": (10000,int),#number of random theta sets to be generated
+    "timestart": (0.0,float),#time range start
+    "timeend": (10.0,float),#time range end
+    "stepsize": (0.1,float),#time step size
+    "seed": (1,int),#random seed
+    "ndim": (8,int),#the dimension of Y and H
+    "maxrandrag": (2,int),#the max number of random connection in each row of H (the diagonal is always connected)
+    "scalefactor": (1.01,float),#shift of the eigen value, make sure no near zero eigen value
+    "chunksize": (2000,int),#number of samples in each chunk (batched eigen decomposition)
+    "workers": (0,int),#number of processes, 0 for all cores
+    "compression": ("",str),#hdf5 compression of the matrices: "" (none, fastest), gzip (as matlab), lzf
+    "method": ("eig",str),#solver: eig (explicit eigen solution, as matlab) or expm (matrix exponential of each time step)
+    "outputfile": ("sparselinearode_new.stepwiseadd.mat",str)## the file name of output data
+}
+
+def sparse_pattern(ndim,maxrandrag,rng):
+    """
+    random connection pattern of H, each row has 1 to maxrandrag random connections and the diagonal is always connected
+    return the 0 based column major (matlab) linear index of the nonzero elements in H
+    """
+    nrandconnect=np.ceil(rng.random(ndim)*maxrandrag).astype(int)
+    preconnectmat=np.zeros((ndim,ndim))
+    for rowi in range(0,ndim):
+        preconnectmat[rowi,rng.choice(ndim,nrandconnect[rowi],replace=False)]=1##sample without replacement
+    preconnectmat=preconnectmat+np.eye(ndim)
+    return np.flatnonzero(preconnectmat.T>0)##same order as find() in matlab
+
+def theta_to_hmat(theta,exisind,ndim):
+    """
+    H matrices from the theta columns of inputstore [real(H[exisind]) imag(H[exisind])]
+        theta: N*(2*len(exisind)) or more columns (e.g. inputstore rows, the later columns are not used)
+        exisind: 0 based column major linear index of the nonzero elements in H (the stored exisind-1)
+        ndim: dimension of Y
+    return N*ndim*ndim complex
+
+     EX code:
+     hmat=theta_to_hmat(Xvar[::ntime,:],exisind,8)
+    """
+    theta=np.asarray(theta)
+    ntheta=len(exisind)
+    hmat=np.zeros((theta.shape[0],ndim,ndim),dtype=complex)
+    hmat[:,exisind%ndim,exisind//ndim]=theta[:,0:ntheta]+theta[:,ntheta:(ntheta*2)]*1j
+    return hmat
+
+def eig_solve(hmat,yini,timeseq,eigres=None):
+    """
+    explicit solution of dY/dt=HY, Y(t)=U*diag(exp(d*t))*V*Y(0) by batched eigen decomposition
+        hmat: N*ndim*ndim
+        yini: N*ndim, Y(0)
+        timeseq: time grid, ntime (shared) or N*ntime
+        eigres: (eigen values, eigen vectors) of hmat if they are already computed. Default None
+    return N*ntime*ndim complex
+    """
+    timeseq=np.asarray(timeseq)
+    dvec,umat=np.linalg.eig(hmat) if eigres is None else eigres
+    vmat=np.linalg.inv(umat)
+    avec=np.matmul(vmat,yini[:,:,None])
+    bmat=umat*np.swapaxes(avec,1,2)
+    emat=np.exp(dvec[:,:,None]*(timeseq[None,None,:] if timeseq.ndim==1 else timeseq[:,None,:]))
+    return np.swapaxes(np.matmul(bmat,emat),1,2)
+
+def expm_solve(hmat,yini,timeseq):
+    """
+    solution of dY/dt=HY by the matrix exponential of each time step, Y(t_k)=expm(H*(t_k-t_(k-1)))*Y(t_(k-1)) with t_(-1)=0
+    no eigen vectors are inverted, for H close to defective. One batched matrix exponential (torch) per time point
+        hmat, yini, timeseq: as eig_solve
+    return N*ntime*ndim complex
+    """
+    import torch
+    timeseq=np.asarray(timeseq,dtype=float)
+    if timeseq.ndim==1:
+        timeseq=np.broadcast_to(timeseq,(hmat.shape[0],len(timeseq)))
+    delt=np.diff(timeseq,axis=1,prepend=0.0)
+    hmat=torch.as_tensor(hmat,dtype=torch.complex128)
+    yvec=torch.as_tensor(yini,dtype=torch.complex128)[:,:,None]
+    ytmat=np.empty((hmat.shape[0],timeseq.shape[1],hmat.shape[1]),dtype=complex)
+    for timek in range(0,timeseq.shape[1]):
+        steptime=torch.as_tensor(delt[:,timek],dtype=torch.complex128)
+        yvec=torch.matmul(torch.linalg.matrix_exp(hmat*steptime[:,None,None]),yvec)
+        ytmat[:,timek,:]=yvec[:,:,0].numpy()
+    return ytmat
+
+def output_scale(ytmat,parastore=None):
+    """
+    scaling of outputstore: the real and imaginary part of each species are divided by the square root of their sum of squares through time (omega)
+        ytmat: N*ntime*ndim complex solution
+        parastore: N*(2*ndim) omega [real imag] to use (e.g. parastore of the simulated file for new time points). Default computed from ytmat
+    return outputstore (N*ntime*(2*ndim)), outputstorepre (not scaled) and parastore
+    """
+    real_y=ytmat.real
+    imag_y=ytmat.imag
+    ndim=ytmat.shape[2]
+    if parastore is None:
+        omega_y_real=np.sum(real_y**2,axis=1)
+        omega_y_imag=np.sum(imag_y**2,axis=1)
+    else:
+        omega_y_real=np.asarray(parastore)[:,0:ndim]
+        omega_y_imag=np.asarray(parastore)[:,ndim:(ndim*2)]
+    outputstorepre=np.concatenate((real_y,imag_y),axis=2)
+    real_y=real_y/np.sqrt(omega_y_real)[:,None,:]
+    imag_y=imag_y/np.sqrt(omega_y_imag)[:,None,:]
+    outputstore=np.concatenate((real_y,imag_y),axis=2)
+    return outputstore, outputstorepre, np.concatenate((omega_y_real,omega_y_imag),axis=1)
+
+def read_pattern(filename):
+    """
+    the sparse pattern of the simulated file, return exisind (0 based) and ndim
+    files of the matlab script do not store exisind
+    """
+    import h5py
+    with h5py.File(filename,'r') as f:
+        if 'exisind' not in f:
+            raise ValueError('no sparse pattern (exisind) in '+filename)
+        exisind=np.squeeze(np.array(f.get('exisind')).astype(int)-1,axis=1)
+        ndim=int(np.array(f.get('ndim'))[0][0])
+    return exisind, ndim
+
+def reference_solve(inputrows,exisind,ndim,ntime,method="eig",scale=True,parastore=None,chunksize=2000):
+    """
+    ground truth of inputstore rows [real(H[exisind]) imag(H[exisind]) real(Y(0)) imag(Y(0)) t]
+    rows are whole time series blocks of ntime rows, H and Y(0) are read from the first row of each block and t from each row (any time grid)
+        inputrows: nrow*(2*len(exisind)+2*ndim+1)
+        exisind, ndim: sparse pattern and dimension of H (read_pattern)
+        ntime: length of each time series block
+        method: "eig" (eig_solve) or "expm" (expm_solve). Default "eig"
+        scale: the output scaled as outputstore (True) or not as outputstorepre (False). Default True
+        parastore: nblock*(2*ndim) omega of the scaling. Default the sum of squares over the time grid of each block (as in the simulation)
+        chunksize: number of blocks solved together. Default 2000
+    return nrow*(2*ndim) in the layout of outputstore
+
+     EX code:
+     exisind,ndim=read_pattern('sparselinearode_new.stepwiseadd.mat')
+     ResponseVar=reference_solve(Xvar,exisind,ndim,101)
+    """
+    if method=="eig":
+        solver=eig_solve
+    elif method=="expm":
+        solver=expm_solve
+    else:
+        raise ValueError('unknown method '+method+', choices: eig, expm')
+
+    inputrows=np.asarray(inputrows)
+    ntheta=len(exisind)
+    nblock=inputrows.shape[0]//ntime
+    blockrows=inputrows[0:(nblock*ntime)].reshape(nblock,ntime,-1)
+    output=np.empty((nblock,ntime,ndim*2))
+    for blockstart in range(0,nblock,chunksize):
+        blockend=min(blockstart+chunksize,nblock)
+        firstrow=blockrows[blockstart:blockend,0,:]
+        hmat=theta_to_hmat(firstrow,exisind,ndim)
+        yini=firstrow[:,(ntheta*2):(ntheta*2+ndim)]+firstrow[:,(ntheta*2+ndim):(ntheta*2+ndim*2)]*1j
+        ytmat=solver(hmat,yini,blockrows[blockstart:blockend,:,-1])
+        outputstore,outputstorepre,_=output_scale(ytmat,parastore=(None if parastore is None else parastore[blockstart:blockend]))
+        output[blockstart:blockend]=outputstore if scale else outputstorepre
+
+    return output.reshape(nblock*ntime,ndim*2)
+
+def simu_chunk(exisind,ndim,nsample,timeseq,scalefactor,seed,method="eig"):
+    """
+    simulate one chunk of nsample H matrices and their ODE solution
+    return a dict of arrays in row major (python) layout, rows of one sample are contiguous
+        exisind: column major linear index of the nonzero elements in H
+        ndim: dimension of Y
+        nsample: number of samples in the chunk
+        timeseq: time grid
+        scalefactor: shift of the eigen value
+        seed: seed (or SeedSequence) of the chunk
+        method: solver, "eig" (eig_solve) or "expm" (expm_solve). Default "eig"
+    """
+    rng=np.random.default_rng(seed)
+    ntheta=len(exisind)
+    ntime=len(timeseq)
+    rowind=exisind%ndim
+    colind=exisind//ndim
+    ##random elements of H [-1 1]
+    hvec=(rng.random((nsample,ntheta))*2-1)+(rng.random((nsample,ntheta))*2-1)*1j
+    hmat=np.zeros((nsample,ndim,ndim),dtype=complex)
+    hmat[:,rowind,colind]=hvec
+    ##shift the diagonal to make the max real eigen value negative
+    deld=np.abs(np.linalg.eigvals(hmat).real.max(axis=1))
+    hnew=hmat-(scalefactor*deld)[:,None,None]*np.eye(ndim)
+    dvec,umat=np.linalg.eig(hnew)
+    hvecnew=hnew[:,rowind,colind]
+    ##initial condition
+    yini=(rng.random((nsample,ndim))*2-1)+(rng.random((nsample,ndim))*2-1)*1j
+    ##explicit solution Y(t)=U*diag(exp(d*t))*V*Y(0) (or by matrix exponential)
+    if method=="expm":
+        ytmat=expm_solve(hnew,yini,timeseq)
+    else:
+        ytmat=eig_solve(hnew,yini,timeseq,eigres=(dvec,umat))#nsample*ntime*ndim
+    ##rescaling y through time
+    outputstore,outputstorepre,parastore=output_scale(ytmat)
+    ##input vectors, repeated through time
+    timecol=np.broadcast_to(timeseq[None,:,None],(nsample,ntime,1))
+    theta=np.concatenate((hvecnew.real,hvecnew.imag,yini.real,yini.imag),axis=1)
+    inputstore=np.concatenate((np.broadcast_to(theta[:,None,:],(nsample,ntime,theta.shape[1])),timecol),axis=2)
+    eigenvec=np.concatenate((dvec.real,dvec.imag,yini.real,yini.imag),axis=1)
+    inputstore2=np.concatenate((np.broadcast_to(eigenvec[:,None,:],(nsample,ntime,eigenvec.shape[1])),timecol),axis=2)
+    ##step wise input: [theta Y(t_k) t_k+1-t_k] output: Y(t_k+1)
+    htheta=np.broadcast_to(theta[:,None,:ntheta*2],(nsample,ntime-1,ntheta*2))
+    deltime=np.broadcast_to((timeseq[1:]-timeseq[:-1])[None,:,None],(nsample,ntime-1,1))
+    inputstore_stepwise=np.concatenate((htheta,outputstore[:,:-1,:],deltime),axis=2)
+    outputstore_stepwise=outputstore[:,1:,:]
+    return {'inputstore': inputstore.reshape(nsample*ntime,-1),
+            'inputstore2': inputstore2.reshape(nsample*ntime,-1),
+            'inputstore_stepwise': inputstore_stepwise.reshape(nsample*(ntime-1),-1),
+            'outputstore': outputstore.reshape(nsample*ntime,-1),
+            'outputstore_stepwise': outputstore_stepwise.reshape(nsample*(ntime-1),-1),
+            'outputstorepre': outputstorepre.reshape(nsample*ntime,-1),
+            'parastore': parastore}
+
+def _simu_chunk_star(chunkargs):
+    return simu_chunk(*chunkargs)
+
+def _write_mat_header(filename):
+    ##matlab v7.3 file header in the 512 bytes user block, so that the file can also be load() in matlab
+    text='MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: '+time.strftime('%a %b %d %H:%M:%S %Y')+' HDF5 schema 1.00 .'
+    header=text.ljust(116).encode('ascii')+b'\x00'*8+b'\x00\x02'+b'IM'
+    with open(filename,'r+b') as f1:
+        f1.write(header)
+
+def simulate(filename,nthetaset=10000,timerang=(0.0,10.0),stepsize=0.1,seed=1,ndim=8,maxrandrag=2,scalefactor=1.01,chunksize=2000,workers=0,compression=None,method="eig"):
+    """
+    simulate nthetaset samples and write them to filename in the layout of linearodesimu.sparse.shifted.m
+    the matrices are stored transposed (column major as in matlab), read them by np.array(f.get('inputstore')).transpose()
+    the result only depend on seed and chunksize, not on the number of workers
+    exisind (1 based) and timeseq are stored in addition for reconstruction of H
+    compression: None, 'gzip' or 'lzf'. gzip gives matlab size files but dominates the run time
+    method: solver, "eig" or "expm"
+    """
+    timeseq=np.arange(0,int(round((timerang[1]-timerang[0])/stepsize))+1)*stepsize+timerang[0]
+    ntime=len(timeseq)
+    seedseq_pattern,seedseq_chunk=np.random.SeedSequence(seed).spawn(2)
+    exisind=sparse_pattern(ndim,maxrandrag,np.random.default_rng(seedseq_pattern))
+    ntheta=len(exisind)
+    nchunk=int(np.ceil(nthetaset/chunksize))
+    chunkseeds=seedseq_chunk.spawn(nchunk)
+    chunklen=[min(chunksize,nthetaset-chunki*chunksize) for chunki in range(0,nchunk)]
+    chunkargs=[(exisind,ndim,chunklen[chunki],timeseq,scalefactor,chunkseeds[chunki],method) for chunki in range(0,nchunk)]
+    ncolumn={'inputstore': ntheta*2+ndim*2+1,
+             'inputstore2': ndim*4+1,
+             'inputstore_stepwise': ntheta*2+ndim*2+1,
+             'outputstore': ndim*2,
+             'outputstore_stepwise': ndim*2,
+             'outputstorepre': ndim*2,
+             'parastore': ndim*2}
+    nrow={'inputstore': nthetaset*ntime,
+          'inputstore2': nthetaset*ntime,
+          'inputstore_stepwise': nthetaset*(ntime-1),
+          'outputstore': nthetaset*ntime,
+          'outputstore_stepwise': nthetaset*(ntime-1),
+          'outputstorepre': nthetaset*ntime,
+          'parastore': nthetaset}
+    rowunit={key: nrow[key]//nthetaset for key in nrow.keys()}#rows for each sample
+    if workers==0:
+        workers=os.cpu_count()
+
+    with h5py.File(filename,'w',userblock_size=512) as f:
+        dsets={}
+        for key in ncolumn.keys():
+            ##column major, hdf5 chunk aligned with whole time series and with the simulation chunks (~1MB)
+            nblockchunk=min(chunksize,nthetaset)
+            ndivide=int(np.ceil(nblockchunk*ncolumn[key]*rowunit[key]/2**17))
+            while nblockchunk%ndivide!=0:
+                ndivide=ndivide+1
+            nblockchunk=nblockchunk//ndivide
+            dsets[key]=f.create_dataset(key,(ncolumn[key],nrow[key]),dtype='f8',chunks=(ncolumn[key],rowunit[key]*nblockchunk),compression=compression)
+
+        ##one process is enough for one chunk
+        if workers>1 and nchunk>1:
+            pool=Pool(min(workers,nchunk))
+            chunkres=pool.imap(_simu_chunk_star,chunkargs)
+        else:
+            pool=None
+            chunkres=map(_simu_chunk_star,chunkargs)
+        sampstart=0
+        for chunki, res in enumerate(chunkres):
+            for key in dsets.keys():
+                dsets[key][:,(sampstart*rowunit[key]):((sampstart+chunklen[chunki])*rowunit[key])]=np.ascontiguousarray(res[key].T)
+            sampstart=sampstart+chunklen[chunki]
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+        ##1 based block index
+        f.create_dataset('samplevec',data=np.repeat(np.arange(1,nthetaset+1),ntime).astype(float)[:,None])
+        f.create_dataset('samplevec_stepwise',data=np.repeat(np.arange(1,nthetaset+1),ntime-1).astype(float)[:,None])
+        for key, val in {'nthetaset': nthetaset,'ntime': ntime,'ntheta': ntheta,'ndim': ndim}.items():
+            f.create_dataset(key,data=np.array([[float(val)]]))
+        f.create_dataset('exisind',data=(exisind+1).astype(float)[:,None])
+        f.create_dataset('timeseq',data=timeseq[:,None])
+        for key in f.keys():
+            f[key].attrs['MATLAB_class']=np.bytes_('double')
+
+    _write_mat_header(filename)
+    return filename
+
+def main():
+    parser=argparse.ArgumentParser(description='linear ODE simulation')
+    for key in args_internal_dict.keys():
+        defaulval=args_internal_dict[key][0]
+        parser.add_argument('--'+key.replace("_","-"),type=args_internal_dict[key][1],default=defaulval,
+                            help='input '+str(key)+' for simulation (default: '+str(defaulval)+')')
+
+    args=parser.parse_args()
+    simulate(args.outputfile,nthetaset=args.nthetaset,timerang=(args.timestart,args.timeend),stepsize=args.stepsize,
+             seed=args.seed,ndim=args.ndim,maxrandrag=args.maxrandrag,scalefactor=args.scalefactor,
+             chunksize=args.chunksize,workers=args.workers,compression=(args.compression if args.compression!='' else None),method=args.method)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+##structured metrics of training runs
+###the training script append one csv row for each logged train batch, each epoch and each evaluation (metrics.csv in the run folder)
+###the reader collects the metrics of many runs and summarizes them by epoch, instead of parsing the printed output
+###  python metrics_log.py result/1 result/2
+import os
+import sys
+import csv
+import time
+import pandas as pd
+
+__all__=['metrics_writer','metrics_trim','metrics_read','metrics_epoch']
+
+##columns of the metrics file
+###phase: train (logged batch), train_epoch (whole epoch), validate, test
+###batch: index of the logged batch for train, number of batches for the other phases
+###loss: loss per sample (mse*ntime) as printed. For train it is the loss of the logged batch, for train_epoch the mean of the epoch
+###nsample, samples_per_s, data_time, compute_time: over the batches since the previous train row (or the whole epoch/evaluation)
+metrics_columns=['phase','epoch','batch','loss','lr','wall_time','nsample','samples_per_s','data_time','compute_time']
+
+class metrics_writer(object):
+    """
+    csv writer of the training metrics, each row is flushed when written. The header is written when the file is new
+
+     EX code:
+     metrics=metrics_writer('metrics.csv')
+     metrics.write(phase='validate',epoch=1,loss=0.5)
+     metrics.close()
+    """
+    def __init__(self,filename,mode='w',starttime=None,last_epoch=None):
+        """
+            filename: the csv file
+            mode: 'w' new file, 'a' append to the rows of the file (e.g. continued training)
+            starttime: the time (time.time()) wall_time is measured from. Default now
+            last_epoch: with mode 'a', the rows of later epochs are removed before appending (e.g. epochs after the checkpoint training continues from). Default None (all rows kept)
+        """
+        newfile=mode=='w' or not os.path.exists(filename) or os.path.getsize(filename)==0
+        if not newfile and last_epoch is not None:
+            metrics_trim(filename,last_epoch)
+
+        self.filename=filename
+        self.file=open(filename,mode,newline='')
+        self.writer=csv.DictWriter(self.file,fieldnames=metrics_columns)
+        if newfile:
+            self.writer.writeheader()
+
+        self.starttime=time.time() if starttime is None else starttime
+
+    def write(self,**fields):
+        ##wall_time: seconds from starttime
+        fields.setdefault('wall_time',time.time()-self.starttime)
+        self.writer.writerow(fields)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def metrics_trim(filename,last_epoch):
+    """
+    remove the rows of epochs after last_epoch from the metrics file, the file is replaced by one rename
+    """
+    with open(filename,newline='') as f1:
+        reader=csv.DictReader(f1)
+        fieldnames=reader.fieldnames
+        rows=[row for row in reader if row['epoch']=='' or int(row['epoch'])<=last_epoch]
+
+    with open(filename+'.tmp','w',newline='') as f1:
+        writer=csv.DictWriter(f1,fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    os.replace(filename+'.tmp',filename)
+
+def metrics_read(runs):
+    """
+    read the metrics of runs into one table with the column names
+        runs: dict of name: run folder (or csv file), or a list of them (the folder as name)
+    """
+    if not isinstance(runs,dict):
+        runs={str(run): run for run in runs}
+
+    tablist=[]
+    for name, path in runs.items():
+        if os.path.isdir(path):
+            path=os.path.join(path,'metrics.csv')
+
+        tab=pd.read_csv(path)
+        tab.insert(0,'names',name)
+        tablist.append(tab)
+
+    return pd.concat(tablist,ignore_index=True)
+
+def metrics_epoch(tab):
+    """
+    summary of each run and epoch: train (first logged batch, as plot.mse.epoch.small.r), train_mean, validate,
+    samples_per_s, data_time and compute_time of the epoch
+        tab: result of metrics_read
+    """
+    keys=['names','epoch']
+    trainfirst=tab[tab['phase']=='train'].groupby(keys,sort=False)['loss'].first().rename('train')
+    epochtab=tab[tab['phase']=='train_epoch'].set_index(keys)[['loss','samples_per_s','data_time','compute_time']].rename(columns={'loss': 'train_mean'})
+    validate=tab[tab['phase']=='validate'].set_index(keys)['loss'].rename('validate')
+    return pd.concat([trainfirst,epochtab,validate],axis=1).reset_index()
+
+def main():
+    epochtab=metrics_epoch(metrics_read(sys.argv[1:]))
+    print(epochtab.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
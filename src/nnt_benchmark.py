@@ -0,0 +1,198 @@
+##throughput benchmark of the model structures in nnt_struc on cpu
+###samples/s of a training step (forward, backward and adam step) and of inference, for each model over a grid of input size, hidden layer scale, batch size and thread number
+###the results are written as json with the commit and the environment, two result files (e.g. of two commits) are compared by --compare, e.g.
+###  python nnt_benchmark.py --models resnet18_mlp,gru_rnn --batch-size 1024,8192 --threads 1,4 --output bench.json --compare bench_prev.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+
+import nnt_struc as models
+from nnt_predict import build_model
+from data_struc import rnn_input_reshape
+
+__all__=['model_names','benchmark_model','benchmark_grid','benchmark_compare']
+
+##all model factories (functions) of nnt_struc
+model_names=sorted(name for name in models.__dict__
+    if (name.endswith("_mlp") or name.endswith("_rnn") or name=="mlp_mod") and callable(models.__dict__[name]) and not isinstance(models.__dict__[name],type))
+##default parameters, the grid parameters are comma separated lists
+args_internal_dict={
+    "models": ("all",str),#model structures, "all" for every factory in nnt_struc
+    "ninput": ("11",str),#number of input columns (ntheta)
+    "ncellscale": ("1.0",str),#hidden layer size as a ratio of the input size (layersize_ratio)
+    "batch_size": ("1024",str),#number of input rows in each batch (rnn: whole time series of ntime rows)
+    "threads": ("1",str),#torch threads, 0 for the default of torch
+    "phase": ("train,inference",str),#train (training step) and/or inference
+    "nspec": (4,int),#number of response columns
+    "ntime": (21,int),#length of the time series of rnn models
+    "num_layer": (2,int),#num_layer of mlp_mod and the rnn cells
+    "warmup": (3,int),#untimed batches before the measurement (TorchScript cells are optimized in the first runs)
+    "repeat": (5,int),#timed batches, the median time is used
+    "seed": (1,int),
+    "output": ("benchmark.json",str),#result file
+    "compare": ("",str)#result file to compare with (e.g. of the previous commit). "" for no comparison
+}
+result_keys=['model','phase','ninput','ncellscale','batch_size','threads']
+
+def _model_args(name,ninput,nspec,ncellscale,num_layer,ntime):
+    ##training arguments of build_model
+    return argparse.Namespace(net_struct=name,rnn_struct=int(name.endswith("_rnn")),num_layer=num_layer,p=0.0,layersize_ratio=ncellscale,
+                              batchnorm_flag='Y',ntheta=ninput,nspec=nspec,timetrainlen=ntime)
+
+def benchmark_model(name,ninput=11,ncellscale=1.0,batch_size=1024,phase="train",nspec=4,ntime=21,num_layer=2,warmup=3,repeat=5):
+    """
+    throughput of one model structure with the current torch threads
+        name: model factory in nnt_struc
+        ninput, nspec: number of input and response columns
+        ncellscale: hidden layer size as a ratio of the input size
+        batch_size: number of rows in each batch, rnn batches are batch_size//ntime time series
+        phase: "train" (forward, backward and adam step) or "inference"
+        warmup, repeat: untimed and timed batches
+    return dict of samples_per_s (rows/s), the median and min time of a batch, and the number of parameters
+
+     EX code:
+     benchmark_model('resnet18_mlp',batch_size=4096,phase='inference')
+    """
+    args=_model_args(name,ninput,nspec,ncellscale,num_layer,ntime)
+    model=build_model(args,ninput,nspec)
+    if args.rnn_struct==1:
+        nrow=max(1,batch_size//ntime)*ntime
+        modelinput=rnn_input_reshape(torch.randn(nrow,ninput),ninput,nspec,ntime)
+    else:
+        nrow=batch_size
+        modelinput=(torch.randn(nrow,ninput),)
+    target=torch.randn(nrow,nspec)
+    if phase=="train":
+        model.train()
+        optimizer=torch.optim.Adam(model.parameters(),lr=1e-4)
+        def step():
+            loss=F.mse_loss(model(*modelinput),target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    elif phase=="inference":
+        model.eval()
+        def step():
+            with torch.no_grad():
+                model(*modelinput)
+    else:
+        raise ValueError('unknown phase '+phase+', choices: train, inference')
+
+    for _ in range(warmup):
+        step()
+    timelist=[]
+    for _ in range(repeat):
+        timestart=time.perf_counter()
+        step()
+        timelist.append(time.perf_counter()-timestart)
+    timemedian=float(np.median(timelist))
+    res={"samples_per_s": nrow/timemedian,
+        "time_median": timemedian,
+        "time_min": min(timelist),
+        "nrow": nrow,
+        "nparam": sum(param.numel() for param in model.parameters())
+    }
+    return res
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError,subprocess.CalledProcessError):
+        return ""
+
+def benchmark_grid(names=None,ninput=(11,),ncellscale=(1.0,),batch_size=(1024,),threads=(1,),phase=("train","inference"),seed=1,verbose=True,**kwargs):
+    """
+    benchmark_model over the grid of models*ninput*ncellscale*batch_size*threads*phase
+    a failed setting (e.g. out of memory) is recorded with its error instead of samples_per_s
+        names: model factories. Default all (model_names)
+        threads: torch threads, 0 for the default of torch
+        kwargs: other arguments of benchmark_model (nspec, ntime, num_layer, warmup, repeat)
+    return dict of meta (commit and environment) and results (list of dict)
+    """
+    if names is None:
+        names=model_names
+    threadsdefault=torch.get_num_threads()
+    meta={"commit": _git_commit(),
+        "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "settings": kwargs
+    }
+    results=[]
+    try:
+        for nthread in threads:
+            torch.set_num_threads(nthread if nthread>0 else threadsdefault)
+            for name in names:
+                for ninputele in ninput:
+                    for ncellscaleele in ncellscale:
+                        for batchele in batch_size:
+                            for phaseele in phase:
+                                torch.manual_seed(seed)
+                                row={"model": name,"phase": phaseele,"ninput": ninputele,"ncellscale": ncellscaleele,"batch_size": batchele,"threads": torch.get_num_threads()}
+                                try:
+                                    row.update(benchmark_model(name,ninput=ninputele,ncellscale=ncellscaleele,batch_size=batchele,phase=phaseele,**kwargs))
+                                except Exception as e:
+                                    row["error"]=repr(e)
+                                results.append(row)
+                                if verbose:
+                                    print('{model} {phase} ninput {ninput} ncellscale {ncellscale} batch {batch_size} threads {threads}: '.format(**row)+
+                                          ('{:.1f} samples/s'.format(row["samples_per_s"]) if "error" not in row else row["error"]),flush=True)
+    finally:
+        torch.set_num_threads(threadsdefault)
+
+    return {"meta": meta, "results": results}
+
+def benchmark_compare(old,new):
+    """
+    samples/s of two benchmark results (dict or json file) on their common settings, ratio is new/old
+    """
+    tabs=[]
+    for res in (old,new):
+        if not isinstance(res,dict):
+            with open(res) as f1:
+                res=json.load(f1)
+        tab=pd.DataFrame(res["results"])
+        if "samples_per_s" not in tab:
+            tab["samples_per_s"]=np.nan
+        tabs.append(tab[result_keys+["samples_per_s"]])
+    comptab=tabs[0].merge(tabs[1],on=result_keys,suffixes=('_old','_new'))
+    comptab["ratio"]=comptab["samples_per_s_new"]/comptab["samples_per_s_old"]
+    return comptab
+
+def _parse_list(text,typedef):
+    return [typedef(ele) for ele in text.split(',') if ele!='']
+
+def main():
+    import train_mlp_full_modified as trainer
+    parser=argparse.ArgumentParser(description='model throughput benchmark')
+    for key in args_internal_dict.keys():
+        parser=trainer.parse_func_wrap(parser,key,args_internal_dict)
+
+    args=parser.parse_args()
+    names=model_names if args.models=="all" else _parse_list(args.models,str)
+    unknown=[name for name in names if name not in model_names]
+    if len(unknown)>0:
+        raise ValueError('unknown models '+','.join(unknown)+', choices: '+','.join(model_names))
+
+    res=benchmark_grid(names,ninput=_parse_list(args.ninput,int),ncellscale=_parse_list(args.ncellscale,float),
+                       batch_size=_parse_list(args.batch_size,int),threads=_parse_list(args.threads,int),phase=_parse_list(args.phase,str),
+                       seed=args.seed,nspec=args.nspec,ntime=args.ntime,num_layer=args.num_layer,warmup=args.warmup,repeat=args.repeat)
+    with open(args.output,'w') as f1:
+        json.dump(res,f1,indent=1)
+    print('results: '+args.output)
+    if args.compare!="":
+        print(benchmark_compare(args.compare,res).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#evaluation of trained models on whole data sets
+# 1. the predictions are streamed batch by batch into preallocated arrays (input rows in memory, in a h5py file or read by dataset_h5_block)
+# 2. residue statistics by time point and species (mean, rms, quantiles) are computed by one grouped reduction
+# 3. the evaluation of a split in training streams its whole time series once and accumulates exact sums of the squared error
+#    per species, time index (training and extrapolation window) and trajectory, the summary of each epoch is appended to eval_summary.h5
+import numpy as np
+import h5py
+import torch
+import torch.distributed as dist
+
+__all__=['predict_residue','group_stat','residue_time_stat','trajectory_batches','eval_accumulator','eval_summary_writer','eval_summary_load']
+
+def predict_residue(predictor,data,target=None,ntime=None,nrowbatch=2**16,dtype=np.float32):
+    """
+    residue (target-output) and time of all rows, predicted batch by batch into preallocated arrays
+        predictor: nnt_predictor of the model
+        data: nrow*ntheta input rows (numpy array or h5py dataset), or a data set returning (input, target) of an index array (e.g. dataset_h5_block)
+        target: nrow*nspec response. Not used if data is a data set
+        ntime: length of the time series for rnn models, batches contain whole time series. Default args.timetrainlen
+        nrowbatch: number of rows in each batch. Default 2**16
+        dtype: type of the result arrays. Default np.float32
+    return residue (nrow*nspec) and time (nrow)
+
+     EX code:
+     residue,timevec=predict_residue(predictor,Xvar,ResponseVar)
+    """
+    if ntime is None:
+        ntime=predictor.args.timetrainlen
+
+    if predictor.rnn_flag:
+        nrowbatch=max(1,nrowbatch//ntime)*ntime
+
+    nrow=len(data)
+    residue=np.empty((nrow,predictor.nspec),dtype=dtype)
+    timevec=np.empty(nrow,dtype=dtype)
+    for rowstart in range(0,nrow,nrowbatch):
+        rowend=min(rowstart+nrowbatch,nrow)
+        if target is None:
+            databatch,targetbatch=data[np.arange(rowstart,rowend)]
+        else:
+            databatch,targetbatch=data[rowstart:rowend],target[rowstart:rowend]
+
+        databatch=torch.as_tensor(np.asarray(databatch),dtype=torch.float32)
+        output=predictor.predict_rows(databatch,ntime=ntime)
+        residue[rowstart:rowend]=np.asarray(targetbatch)-output.numpy()
+        timevec[rowstart:rowend]=databatch[:,-1].numpy()
+
+    return residue, timevec
+
+def group_stat(values,groups,quantiles=(0.05,0.5,0.95)):
+    """
+    statistics of the rows of values in each group, by one sort of the rows (no loop of search over the groups)
+        values: nrow*ncol (or nrow) values
+        groups: nrow group labels (e.g. time point)
+        quantiles: the quantiles computed. Default (0.05,0.5,0.95)
+    return dict of group (sorted unique labels), count, mean, rms (ngroup*ncol) and quantile (nquantile*ngroup*ncol)
+
+     EX code:
+     stat=group_stat(residue,timevec)
+     stat["mean"]# mean residue of each time point and species
+    """
+    values=np.asarray(values)
+    if values.ndim==1:
+        values=values[:,None]
+
+    groupval,inverse,count=np.unique(groups,return_inverse=True,return_counts=True)
+    order=np.argsort(inverse.ravel(),kind='stable')
+    sortval=values[order].astype(np.float64)
+    starts=np.concatenate(([0],np.cumsum(count)[:-1]))
+    ##sums of the rows of each group in float64
+    mean=np.add.reduceat(sortval,starts,axis=0)/count[:,None]
+    rms=np.sqrt(np.add.reduceat(sortval**2,starts,axis=0)/count[:,None])
+    if np.all(count==count[0]):##the same number of rows in each group (e.g. every trajectory on the same time grid)
+        quantile=np.quantile(sortval.reshape(groupval.size,count[0],-1),quantiles,axis=1)
+    else:
+        quantile=np.stack([np.quantile(sortval[start:(start+ncount)],quantiles,axis=0) for start, ncount in zip(starts,count)],1)
+
+    stat={"group": (groupval),
+        "count": (count),
+        "mean": (mean),
+        "rms": (rms),
+        "quantile": (quantile)
+    }
+    return stat
+
+def residue_time_stat(predictor,data,target=None,ntime=None,quantiles=(0.05,0.5,0.95),nrowbatch=2**16):
+    """
+    residue statistics by time point and species of the whole data set (see predict_residue and group_stat)
+    return dict of group_stat with the time points as "time"
+    """
+    residue,timevec=predict_residue(predictor,data,target=target,ntime=ntime,nrowbatch=nrowbatch)
+    stat=group_stat(residue,timevec,quantiles=quantiles)
+    stat["time"]=stat.pop("group")
+    return stat
+
+def trajectory_batches(ntraj,ntimetotal,nblock,rank=0,num_replicas=1):
+    """
+    batches of whole time series in the stored order, for the evaluation of a split with ntraj time series of ntimetotal rows each
+    process rank takes every num_replicas-th time series (no padding, the sums are reduced over processes)
+    yield the trajectory index and the row index (LongTensor) of each batch
+
+     EX code:
+     list(trajectory_batches(5,3,2))
+    """
+    trajall=torch.arange(rank,ntraj,num_replicas)
+    for batchstart in range(0,len(trajall),nblock):
+        trajind=trajall[batchstart:(batchstart+nblock)]
+        yield trajind, (trajind[:,None]*ntimetotal+torch.arange(ntimetotal)[None,:]).view(-1)
+
+class eval_accumulator(object):
+    """
+    exact running sums of the squared error of whole time series, the first ntime time points are the training window and the rest the extrapolation window
+    the sums are kept in float64 on the device of the output, no synchronization in update
+
+     EX code:
+     accum=eval_accumulator(ntraj,ntimetotal,nspec,ntime=ntime)
+     for trajind, rowind in trajectory_batches(ntraj,ntimetotal,nblock):
+         accum.update(output,target,trajind)
+     summary=accum.summary()
+    """
+    def __init__(self,ntraj,ntimetotal,nspec,ntime=None,device=None):
+        """
+            ntraj: number of time series in the split
+            ntimetotal: length of each time series
+            nspec: number of species
+            ntime: length of the training window. Default ntimetotal (no extrapolation window)
+            device: device of the sums. Default cpu
+        """
+        self.ntraj=ntraj
+        self.ntimetotal=ntimetotal
+        self.nspec=nspec
+        self.ntime=ntimetotal if ntime is None else ntime
+        self.sse=torch.zeros(ntimetotal,nspec,dtype=torch.float64,device=device)##time index*species
+        self.sse_traj=torch.zeros(ntraj,2,dtype=torch.float64,device=device)##trajectory*[training window, extrapolation window]
+        self.ntrajseen=torch.zeros(1,dtype=torch.float64,device=device)
+
+    def update(self,output,target,trajind):
+        """
+            output, target: (ntrajbatch*ntimetotal)*nspec, rows of whole time series
+            trajind: index of the time series in the batch
+        """
+        err=(output.double()-target.double()).view(-1,self.ntimetotal,self.nspec)**2
+        if self.sse.device!=err.device:
+            self.sse=self.sse.to(err.device)
+            self.sse_traj=self.sse_traj.to(err.device)
+            self.ntrajseen=self.ntrajseen.to(err.device)
+
+        self.sse+=err.sum(0)
+        errtraj=err.sum(2)
+        trajind=torch.as_tensor(trajind,device=err.device)
+        self.sse_traj[trajind,0]+=errtraj[:,:self.ntime].sum(1)
+        self.sse_traj[trajind,1]+=errtraj[:,self.ntime:].sum(1)
+        self.ntrajseen+=err.shape[0]
+
+    def all_reduce(self):
+        ##sums over the processes of distributed evaluation
+        for tensor in (self.sse,self.sse_traj,self.ntrajseen):
+            tensorcpu=tensor.cpu()
+            dist.all_reduce(tensorcpu)
+            tensor.copy_(tensorcpu)
+
+    def summary(self):
+        """
+        mean squared error (per value) of the training window (mse, mse_spec, mse_traj), the extrapolation window (mse_extr, mse_extr_spec, mse_extr_traj, nan if empty)
+        and each time index (mse_time, both windows), loss is mse*ntime (per sample, as the training loss)
+        return dict of float64 arrays
+        """
+        sse=self.sse.cpu().numpy()
+        sse_traj=self.sse_traj.cpu().numpy()
+        ntraj=self.ntrajseen.item()
+        nextr=self.ntimetotal-self.ntime
+        with np.errstate(invalid='ignore',divide='ignore'):
+            sse_in=sse[:self.ntime].sum(0)
+            sse_extr=sse[self.ntime:].sum(0)
+            summary={"loss": (sse_in.sum()/(ntraj*self.nspec)),
+                "mse": (sse_in.sum()/(ntraj*self.ntime*self.nspec)),
+                "mse_spec": (sse_in/(ntraj*self.ntime)),
+                "mse_time": (sse.sum(1)/(ntraj*self.nspec)),
+                "mse_traj": (sse_traj[:,0]/(self.ntime*self.nspec)),
+                "mse_extr": (sse_extr.sum()/(ntraj*nextr*self.nspec) if nextr>0 else np.nan),
+                "mse_extr_spec": (sse_extr/(ntraj*nextr) if nextr>0 else np.full(self.nspec,np.nan)),
+                "mse_extr_traj": (sse_traj[:,1]/(nextr*self.nspec) if nextr>0 else np.full(self.ntraj,np.nan)),
+                "ntraj": (ntraj)
+            }
+        return summary
+
+class eval_summary_writer(object):
+    """
+    append the evaluation summary (eval_accumulator.summary) of each epoch and phase to a HDF5 file
+    each phase is a group with one row per evaluation (datasets epoch, loss, mse, mse_extr, mse_spec, mse_extr_spec, mse_time, mse_traj, mse_extr_traj, float32)
+    and traj, the block index of the trajectories (columns of mse_traj)
+
+     EX code:
+     writer=eval_summary_writer('eval_summary.h5')
+     writer.write('validate',1,summary,traj=blockvec)
+     writer.close()
+     eval_summary_load('eval_summary.h5')['validate']['mse_time']
+    """
+    keys=['loss','mse','mse_extr','mse_spec','mse_extr_spec','mse_time','mse_traj','mse_extr_traj']
+    def __init__(self,filename,mode='w',last_epoch=None):
+        """
+            filename: the HDF5 file
+            mode: 'w' new file, 'a' append to the rows of the file (e.g. continued training)
+            last_epoch: with mode 'a', the rows of later epochs are removed before appending (e.g. epochs after the checkpoint training continues from). Default None (all rows kept)
+        """
+        self.filename=filename
+        self.file=h5py.File(filename,mode)
+        if mode=='a' and last_epoch is not None:
+            self.trim(last_epoch)
+
+    def trim(self,last_epoch):
+        ##remove the rows of epochs after last_epoch in each phase
+        for phase in self.file.keys():
+            group=self.file[phase]
+            keep=np.flatnonzero(group['epoch'][()]<=last_epoch)
+            if len(keep)==group['epoch'].shape[0]:
+                continue
+            for key in ['epoch']+self.keys:
+                value=group[key][()][keep]
+                group[key].resize(len(keep),axis=0)
+                group[key][...]=value
+
+        self.file.flush()
+
+    def write(self,phase,epoch,summary,traj=None):
+        if phase not in self.file:
+            group=self.file.create_group(phase)
+            group.create_dataset('epoch',shape=(0,),maxshape=(None,),dtype='i8')
+            for key in self.keys:
+                shape=np.shape(summary[key])
+                group.create_dataset(key,shape=(0,)+shape,maxshape=(None,)+shape,dtype='f4',chunks=(1,)+shape if len(shape)>0 else True)
+            if traj is not None:
+                group.create_dataset('traj',data=np.asarray(traj))
+
+        group=self.file[phase]
+        nrow=group['epoch'].shape[0]
+        for key in ['epoch']+self.keys:
+            value=epoch if key=='epoch' else summary[key]
+            group[key].resize(nrow+1,axis=0)
+            group[key][nrow]=value
+
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def eval_summary_load(filename):
+    """
+    read the file of eval_summary_writer
+    return dict of phase: dict of arrays
+    """
+    with h5py.File(filename,'r') as f:
+        return {phase: {key: f[phase][key][()] for key in f[phase].keys()} for phase in f.keys()}
@@ -0,0 +1,308 @@
+#inference with trained models
+# 1. the model is created from the arguments stored in the checkpoint (args_input) and loaded once
+# 2. trajectories of (theta, initial condition, time grid) are predicted in large batches, without per trajectory loaders
+# 3. mlp and resnet models (with the input normalization) can be exported to a torch.export or TorchScript file used without this code
+import re
+import warnings
+import numpy as np
+import torch
+
+import nnt_struc as models
+from data_struc import rnn_input_reshape
+
+__all__=['build_model','example_input','load_state_dict_strip','nnt_predictor','input_norm_wrap','export_model','load_exported']
+
+def build_model(args,ntheta,nspec):
+    """
+    create the model of args.net_struct as in training
+        args: training arguments (args_input in the checkpoint)
+        ntheta: number of input columns
+        nspec: number of response columns
+    """
+    if bool(re.search("[rR]es[Nn]et",args.net_struct)):
+        model=models.__dict__[args.net_struct](ninput=ntheta,num_response=nspec,p=args.p,ncellscale=args.layersize_ratio)
+    elif args.rnn_struct==1:
+        model=models.__dict__[args.net_struct](ntheta=ntheta,nspec=nspec,num_layer=args.num_layer,ncellscale=args.layersize_ratio,p=args.p)
+    else:
+        model=models.__dict__[args.net_struct](ninput=ntheta,num_response=nspec,nlayer=args.num_layer,p=args.p,ncellscale=args.layersize_ratio,batchnorm_flag=(args.batchnorm_flag=='Y'))
+
+    return model
+
+def example_input(args,ntheta,nspec,ntime=None,nsample=2,device=None):
+    """
+    model input of nsample rows of zeros (nsample time series of ntime rows for rnn models), e.g. for the trial run of compile_model
+        ntime: length of the time series of rnn models. Default args.timetrainlen
+    return tuple of the model input
+    """
+    if ntime is None:
+        ntime=args.timetrainlen
+
+    if getattr(args,'rnn_struct',0)==1:
+        timevarinput,initialvec=rnn_input_reshape(torch.zeros(nsample*ntime,ntheta,device=device),ntheta,nspec,ntime)
+        return (timevarinput,initialvec)
+
+    return (torch.zeros(nsample,ntheta,device=device),)
+
+def load_state_dict_strip(model,state_dict):
+    """
+    load the state_dict saved from a DataParallel model (keys start with 'module.') into the bare model
+    """
+    state_dict={re.sub(r'^module\.','',key): value for key, value in state_dict.items()}
+    model.load_state_dict(state_dict)
+    return model
+
+class nnt_predictor(object):
+    """
+    predictor of a trained checkpoint
+    the model is rebuilt and loaded once, the input is normalized by the stored statistics and trajectories are predicted in batches of about batch_size rows
+    the input follows the column layout of inputstore [theta, Y(t_0), t]
+
+     EX code:
+     predictor=nnt_predictor('model_best.resnetode.tar')
+     output=predictor.predict(theta,initialvec,np.arange(0,21)*0.1)# ntraj*ntime*nspec
+    """
+    def __init__(self,checkpoint,device=None,normstat=None,batch_size=2**16,compile=False,fuse=False):
+        """
+            checkpoint: the checkpoint file (e.g. model_best.resnetode.tar) or the loaded dict
+            device: the device for inference. Default cpu
+            normstat: dict with "mean" and "std" of the input columns. Default the statistics stored in the checkpoint
+            batch_size: number of input rows in each forward pass. Default 2**16
+            compile: whether run the model compiled by torch.compile. Default False
+            fuse: whether fold the batch normalization into the linear layers and remove dropout (mlp and resnet models). Default False
+        """
+        if device is None:
+            device=torch.device('cpu')
+
+        self.device=torch.device(device)
+        if isinstance(checkpoint,dict):
+            loaddic=checkpoint
+        else:
+            loaddic=torch.load(checkpoint,map_location=self.device,weights_only=False)
+
+        self.args=loaddic["args_input"]
+        self.ntheta=self.args.ntheta
+        self.nspec=self.args.nspec
+        self.ntheta_real=self.ntheta-1-self.nspec
+        self.rnn_flag=getattr(self.args,'rnn_struct',0)==1
+        self.batch_size=batch_size
+        model=build_model(self.args,self.ntheta,self.nspec)
+        self.model=load_state_dict_strip(model,loaddic['state_dict'])
+        self.model.to(self.device)
+        self.model.eval()
+        if fuse and not self.rnn_flag:
+            self.model=models.fuse_for_inference(self.model)
+        
+        if compile:
+            with torch.no_grad():
+                self.model=models.compile_model(self.model,example_input=example_input(self.args,self.ntheta,self.nspec,device=self.device))
+        
+        if normstat is None:
+            normstat=loaddic.get('normstat')
+
+        if normstat is not None:
+            self.meanvec=torch.as_tensor(np.asarray(normstat["mean"]),dtype=torch.float32,device=self.device)
+            self.stdvec=torch.as_tensor(np.asarray(normstat["std"]),dtype=torch.float32,device=self.device)
+        else:
+            self.meanvec=None
+            self.stdvec=None
+            if getattr(self.args,'normalize_flag','N')=='Y':
+                warnings.warn('no normalization statistics in the checkpoint, the input need to be normalized before prediction')
+
+    def _forward(self,rows,ntime,normalize):
+        ##rows: whole time series of ntime rows each, on the device
+        if normalize and self.meanvec is not None:
+            rows=(rows-self.meanvec)/self.stdvec
+
+        if self.rnn_flag:
+            timevarinput,initialvec=rnn_input_reshape(rows,self.ntheta,self.nspec,ntime)
+            return self.model(timevarinput,initialvec)
+
+        return self.model(rows)
+
+    @torch.no_grad()
+    def predict(self,theta,initialvec,timeseq,normalize=True):
+        """
+        predict trajectories
+            theta: ntraj*ntheta_real, parameters of each trajectory
+            initialvec: ntraj*nspec, Y(t_0) of each trajectory
+            timeseq: time grid, ntime (shared) or ntraj*ntime
+            normalize: whether normalize the input by the stored statistics. Default True
+        return ntraj*ntime*nspec tensor on cpu
+        """
+        theta=torch.as_tensor(theta,dtype=torch.float32)
+        initialvec=torch.as_tensor(initialvec,dtype=torch.float32)
+        timeseq=torch.as_tensor(timeseq,dtype=torch.float32)
+        ntraj=theta.shape[0]
+        if timeseq.dim()==1:
+            timeseq=timeseq.expand(ntraj,-1)
+
+        ntime=timeseq.shape[1]
+        ntrajbatch=max(1,self.batch_size//ntime)
+        output=torch.empty(ntraj,ntime,self.nspec)
+        for trajstart in range(0,ntraj,ntrajbatch):
+            trajend=min(trajstart+ntrajbatch,ntraj)
+            nbatch=trajend-trajstart
+            thetabatch=theta[trajstart:trajend].to(self.device)
+            inibatch=initialvec[trajstart:trajend].to(self.device)
+            timebatch=timeseq[trajstart:trajend].to(self.device)
+            ##rows [theta, Y(t_0), t] of whole time series
+            rows=torch.cat((thetabatch[:,None,:].expand(-1,ntime,-1),inibatch[:,None,:].expand(-1,ntime,-1),timebatch[:,:,None]),2)
+            rows=rows.view(nbatch*ntime,self.ntheta)
+            outbatch=self._forward(rows,ntime,normalize)
+            output[trajstart:trajend]=outbatch.view(nbatch,ntime,self.nspec).cpu()
+
+        return output
+
+    @torch.no_grad()
+    def predict_rows(self,data,ntime=None,normalize=True):
+        """
+        predict rows in the layout of inputstore
+            data: nrow*ntheta. For rnn models, rows are whole time series of ntime rows each
+            ntime: length of the time series, only used by rnn models. Default args.timetrainlen
+            normalize: whether normalize the input by the stored statistics. Default True
+        return nrow*nspec tensor on cpu
+        """
+        data=torch.as_tensor(data,dtype=torch.float32)
+        if ntime is None:
+            ntime=self.args.timetrainlen
+
+        nrow=data.shape[0]
+        nrowbatch=max(1,self.batch_size//ntime)*ntime if self.rnn_flag else self.batch_size
+        output=torch.empty(nrow,self.nspec)
+        for rowstart in range(0,nrow,nrowbatch):
+            rowend=min(rowstart+nrowbatch,nrow)
+            output[rowstart:rowend]=self._forward(data[rowstart:rowend].to(self.device),ntime,normalize).cpu()
+
+        return output
+
+    @torch.no_grad()
+    def extrapolate(self,theta,initialvec,timeseq,ntime=None,horizonvec=None,normalize=True):
+        """
+        predict trajectories beyond the training time range, batched over all trajectories
+        the first ntime points of timeseq are predicted as in predict, the later points are rolled forward from the training horizon t_(ntime-1):
+        mlp: point k is predicted from the row [theta, Y(t_(k-1)), t_k-t_(k-1)+t_0], the prediction of the previous point is the initial condition
+            (the layout of inputstore_stepwise for t_0=0, and of the time shift transform in training)
+        rnn: the hidden state at the training horizon is continued through the later points
+            theta: ntraj*ntheta_real, parameters of each trajectory
+            initialvec: ntraj*nspec, Y(t_0) of each trajectory
+            timeseq: time grid including the extrapolation points, ntimetotal (shared) or ntraj*ntimetotal
+            ntime: number of points in the training time range. Default args.timetrainlen
+            horizonvec: ntraj*nspec, Y(t_(ntime-1)) that starts the chain of mlp models (e.g. the observed values). Default the prediction
+            normalize: whether normalize the input by the stored statistics. Default True
+        return ntraj*ntimetotal*nspec tensor on cpu
+
+         EX code:
+         output=predictor.extrapolate(theta,initialvec,np.arange(0,201)*0.1,ntime=101)# ntraj*201*nspec
+        """
+        theta=torch.as_tensor(theta,dtype=torch.float32)
+        initialvec=torch.as_tensor(initialvec,dtype=torch.float32)
+        timeseq=torch.as_tensor(timeseq,dtype=torch.float32)
+        ntraj=theta.shape[0]
+        if timeseq.dim()==1:
+            timeseq=timeseq.expand(ntraj,-1)
+
+        ntimetotal=timeseq.shape[1]
+        if ntime is None:
+            ntime=min(self.args.timetrainlen,ntimetotal)
+
+        if horizonvec is not None:
+            horizonvec=torch.as_tensor(horizonvec,dtype=torch.float32)
+
+        ntrajbatch=max(1,self.batch_size//ntimetotal)
+        output=torch.empty(ntraj,ntimetotal,self.nspec)
+        for trajstart in range(0,ntraj,ntrajbatch):
+            trajend=min(trajstart+ntrajbatch,ntraj)
+            nbatch=trajend-trajstart
+            thetabatch=theta[trajstart:trajend].to(self.device)
+            inibatch=initialvec[trajstart:trajend].to(self.device)
+            timebatch=timeseq[trajstart:trajend].to(self.device)
+            if self.rnn_flag:
+                rows=torch.cat((thetabatch[:,None,:].expand(-1,ntimetotal,-1),inibatch[:,None,:].expand(-1,ntimetotal,-1),timebatch[:,:,None]),2)
+                rows=rows.view(nbatch*ntimetotal,self.ntheta)
+                if normalize and self.meanvec is not None:
+                    rows=(rows-self.meanvec)/self.stdvec
+
+                timevarinput,rnninitial=rnn_input_reshape(rows,self.ntheta,self.nspec,ntimetotal)
+                outbatch,hidden=self.model.forward_state(timevarinput[:,:ntime],initialvec=rnninitial)
+                output[trajstart:trajend,:ntime]=outbatch.view(nbatch,ntime,self.nspec).cpu()
+                if ntimetotal>ntime:
+                    outbatch,_=self.model.forward_state(timevarinput[:,ntime:],hidden=hidden)
+                    output[trajstart:trajend,ntime:]=outbatch.view(nbatch,ntimetotal-ntime,self.nspec).cpu()
+            else:
+                rows=torch.cat((thetabatch[:,None,:].expand(-1,ntime,-1),inibatch[:,None,:].expand(-1,ntime,-1),timebatch[:,:ntime,None]),2)
+                outbatch=self._forward(rows.view(nbatch*ntime,self.ntheta),ntime,normalize).view(nbatch,ntime,self.nspec)
+                output[trajstart:trajend,:ntime]=outbatch.cpu()
+                prevout=outbatch[:,-1,:] if horizonvec is None else horizonvec[trajstart:trajend].to(self.device)
+                ##one row per trajectory in each step
+                for timek in range(ntime,ntimetotal):
+                    steptime=timebatch[:,timek]-timebatch[:,timek-1]+timebatch[:,0]
+                    prevout=self._forward(torch.cat((thetabatch,prevout,steptime[:,None]),1),1,normalize)
+                    output[trajstart:trajend,timek]=prevout.cpu()
+
+        return output
+
+class input_norm_wrap(torch.nn.Module):
+    ##the model with the input normalization (X-mean)/std, rows in the layout of inputstore
+    def __init__(self,model,meanvec,stdvec):
+        super(input_norm_wrap,self).__init__()
+        self.model=model
+        self.register_buffer('meanvec',meanvec)
+        self.register_buffer('stdvec',stdvec)
+
+    def forward(self,rows):
+        return self.model((rows-self.meanvec)/self.stdvec)
+
+def export_model(checkpoint,filename,method="auto",example_rows=None):
+    """
+    export the model of a checkpoint (mlp and resnet) with the input normalization, the file is loaded by load_exported and predict un-normalized rows [theta, Y(t_0), t]
+        checkpoint: the checkpoint file, the loaded dict or a nnt_predictor (e.g. with fuse=True)
+        filename: the exported file
+        method: "export" (torch.export), "script" (TorchScript) or "auto" (torch.export, TorchScript if it fails)
+        example_rows: example input rows for torch.export. Default zeros of 8 rows
+    return the method used
+
+     EX code:
+     export_model('model_best.resnetode.tar','model_best.pt2')
+     model=load_exported('model_best.pt2')
+     output=model(torch.Tensor(Xvar))
+    """
+    predictor=checkpoint if isinstance(checkpoint,nnt_predictor) else nnt_predictor(checkpoint)
+    if predictor.rnn_flag:
+        raise ValueError('only mlp and resnet models can be exported')
+    
+    model=getattr(predictor.model,'_orig_mod',predictor.model)
+    if predictor.meanvec is not None:
+        meanvec,stdvec=predictor.meanvec,predictor.stdvec
+    else:
+        meanvec,stdvec=torch.zeros(predictor.ntheta,device=predictor.device),torch.ones(predictor.ntheta,device=predictor.device)
+    
+    wrapmodel=input_norm_wrap(model,meanvec.clone(),stdvec.clone()).eval()
+    if example_rows is None:
+        example_rows=torch.zeros(8,predictor.ntheta,device=predictor.device)
+    
+    methods=["export","script"] if method=="auto" else [method]
+    for methodi in methods:
+        try:
+            if methodi=="export":
+                exported=torch.export.export(wrapmodel,(example_rows,),dynamic_shapes=({0: torch.export.Dim("batch")},))
+                torch.export.save(exported,filename)
+            elif methodi=="script":
+                torch.jit.save(torch.jit.script(wrapmodel),filename)
+            else:
+                raise ValueError('unknown export method '+methodi)
+            
+            return methodi
+        except Exception as e:
+            if methodi==methods[-1]:
+                raise
+            
+            warnings.warn('export by '+methodi+' failed, try the next method: '+str(e))
+
+def load_exported(filename,device=None):
+    """
+    load the file of export_model, return a callable module of the input rows
+    """
+    try:
+        return torch.jit.load(filename,map_location=device)
+    except RuntimeError:
+        return torch.export.load(filename).module()
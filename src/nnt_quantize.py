@@ -0,0 +1,197 @@
+##post training int8 quantization of trained mlp and resnet models for cpu inference
+###dynamic: int8 weights of the Linear layers, the activations are quantized on the fly
+###static: int8 weights and activations, the activation ranges are calibrated on a sample of training trajectories
+###the model is fused (fuse_for_inference) before quantization and saved with the input normalization as TorchScript (read by nnt_predict.load_exported)
+###the mse on the test split and the throughput are reported for the float and the quantized model, run in the run folder, e.g.
+###  python nnt_quantize.py --checkpoint model_best.resnetode.tar --mode static --output model_best.int8.pt
+import argparse
+import copy
+import time
+import warnings
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.ao.quantization as quantization
+
+from data_struc import dataset_h5_block, run_artifact_load
+from nnt_predict import nnt_predictor, input_norm_wrap
+
+__all__=['quantize_model','quantize_report','quantize_run']
+
+##default parameters
+args_internal_dict={
+    "checkpoint": ("model_best.resnetode.tar",str),#the checkpoint to quantize
+    "mode": ("dynamic",str),#dynamic or static
+    "output": ("",str),#file of the quantized model. Default the checkpoint name with .int8.pt
+    "artifact": ("run_artifact.h5",str),#run information of the checkpoint (test split and input file)
+    "inputpath": ("",str),#the input file. Default the file recorded in the run information
+    "ncalib": (64,int),#number of training trajectories for the calibration of static quantization
+    "backend": ("",str),#quantized engine (x86, fbgemm, qnnpack). Default the current engine of torch
+    "threads": (0,int),#torch threads in the throughput measurement, 0 for the default
+    "seed": (1,int)
+}
+
+class _quant_stub_wrap(nn.Module):
+    ##quantize the input and dequantize the output of a statically quantized model
+    def __init__(self,model):
+        super(_quant_stub_wrap,self).__init__()
+        self.quant=quantization.QuantStub()
+        self.model=model
+        self.dequant=quantization.DeQuantStub()
+
+    def forward(self,x):
+        return self.dequant(self.model(self.quant(x)))
+
+def _fuse_linear_relu(module):
+    ##fuse each Linear followed by ReLU in the Sequential containers into one LinearReLU
+    for child in list(module.modules()):
+        if isinstance(child,nn.Sequential):
+            names=list(child._modules.keys())
+            pairs=[[names[i],names[i+1]] for i in range(len(names)-1)
+                   if isinstance(child._modules[names[i]],nn.Linear) and isinstance(child._modules[names[i+1]],nn.ReLU)]
+            if len(pairs)>0:
+                quantization.fuse_modules(child,pairs,inplace=True)
+
+def _norm_vec(predictor):
+    ##normalization statistics of the predictor on cpu, identity if the input is not normalized
+    if predictor.meanvec is not None:
+        return predictor.meanvec.cpu(), predictor.stdvec.cpu()
+
+    return torch.zeros(predictor.ntheta), torch.ones(predictor.ntheta)
+
+def quantize_model(predictor,mode="dynamic",calib_rows=None,backend=None):
+    """
+    int8 model of a fused mlp/resnet predictor. The result takes un-normalized rows [theta, Y(t_0), t] as nnt_predictor.predict_rows
+        predictor: nnt_predictor with fuse=True
+        mode: "dynamic" (int8 Linear weights) or "static" (int8 weights and activations, calibrated on calib_rows)
+        calib_rows: un-normalized input rows for the calibration of static quantization
+        backend: quantized engine. Default the current engine of torch
+    return the quantized module (cpu, eval mode)
+
+     EX code:
+     predictor=nnt_predictor('model_best.resnetode.tar',fuse=True)
+     quantmodel=quantize_model(predictor,mode="static",calib_rows=Xtrain)
+    """
+    if not isinstance(predictor.model,nn.Sequential):
+        raise ValueError('the predictor need to be fused (nnt_predictor(fuse=True)) before quantization')
+
+    if backend is not None:
+        torch.backends.quantized.engine=backend
+
+    backend=torch.backends.quantized.engine
+    model=copy.deepcopy(predictor.model).to('cpu')
+    meanvec,stdvec=_norm_vec(predictor)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',DeprecationWarning)
+        if mode=="dynamic":
+            quantmodel=quantization.quantize_dynamic(model,{nn.Linear},dtype=torch.qint8)
+        elif mode=="static":
+            if calib_rows is None:
+                raise ValueError('static quantization need calibration rows')
+
+            quantmodel=_quant_stub_wrap(model).eval()
+            _fuse_linear_relu(quantmodel)
+            quantmodel.qconfig=quantization.get_default_qconfig(backend)
+            quantization.prepare(quantmodel,inplace=True)
+            calibwrap=input_norm_wrap(quantmodel,meanvec,stdvec)
+            calib_rows=torch.as_tensor(calib_rows,dtype=torch.float32)
+            with torch.no_grad():
+                for rowstart in range(0,calib_rows.shape[0],predictor.batch_size):
+                    calibwrap(calib_rows[rowstart:(rowstart+predictor.batch_size)])
+            quantization.convert(quantmodel,inplace=True)
+        else:
+            raise ValueError('unknown quantization mode '+mode+', choices: dynamic, static')
+
+    return input_norm_wrap(quantmodel,meanvec.clone(),stdvec.clone()).eval()
+
+def _time_forward(model,data,batch_size,nrep):
+    ##minimal time of nrep passes over data in batches, and the output of the last pass
+    timelist=[]
+    with torch.inference_mode():
+        for _ in range(nrep):
+            timestart=time.time()
+            output=torch.cat([model(data[rowstart:(rowstart+batch_size)]) for rowstart in range(0,data.shape[0],batch_size)],0)
+            timelist.append(time.time()-timestart)
+
+    return min(timelist), output
+
+def quantize_report(predictor,quantmodel,data,target,ntime=1,nrep=3):
+    """
+    mse (per sample, mse*ntime as the training output) and throughput (rows/s) of the float and the quantized model
+        predictor: nnt_predictor of the float model
+        quantmodel: result of quantize_model
+        data, target: un-normalized input rows and the response
+        ntime: length of the time series, scale of the mse as in training
+        nrep: the throughput is measured by the fastest of nrep passes
+    return dict of mse_float, mse_quant, mse_ratio, rows_per_s_float, rows_per_s_quant, speedup
+    """
+    data=torch.as_tensor(data,dtype=torch.float32)
+    target=torch.as_tensor(target,dtype=torch.float32)
+    floatmodel=input_norm_wrap(predictor.model,*_norm_vec(predictor)).eval()
+    timefloat,outfloat=_time_forward(floatmodel,data,predictor.batch_size,nrep)
+    timequant,outquant=_time_forward(quantmodel,data,predictor.batch_size,nrep)
+    msefloat=torch.nn.functional.mse_loss(outfloat,target).item()*ntime
+    msequant=torch.nn.functional.mse_loss(outquant,target).item()*ntime
+    report={"mse_float": msefloat,
+        "mse_quant": msequant,
+        "mse_ratio": (msequant/msefloat if msefloat>0 else float("inf")),
+        "rows_per_s_float": data.shape[0]/timefloat,
+        "rows_per_s_quant": data.shape[0]/timequant,
+        "speedup": timefloat/timequant
+    }
+    return report
+
+def quantize_run(checkpoint="model_best.resnetode.tar",mode="dynamic",output="",artifact="run_artifact.h5",inputpath="",ncalib=64,backend="",seed=1):
+    """
+    quantize the checkpoint of a run, save the quantized model and return the report (quantize_report) on the test split
+    the split and the input file are read from the run information (run_artifact.h5) of the run folder
+    """
+    runstore=run_artifact_load(artifact)
+    if inputpath=="":
+        inputpath=runstore["attrs"]["inputpath"]
+
+    predictor=nnt_predictor(checkpoint,fuse=True)
+    if predictor.rnn_flag:
+        raise ValueError('only mlp and resnet models can be quantized')
+
+    ntime=predictor.args.timetrainlen
+    time_in_ind=runstore["time_in_ind"]
+    data,target=dataset_h5_block(inputpath,time_in_ind["test"])[np.arange(0,len(time_in_ind["test"]))]
+    calib_rows=None
+    if mode=="static":
+        ##whole time series of ncalib training trajectories
+        rng=np.random.default_rng(seed)
+        trainblock=runstore["samplevec_separa"]["train"]
+        calibblock=rng.choice(np.unique(trainblock),min(ncalib,np.unique(trainblock).size),replace=False)
+        calibind=np.flatnonzero(np.isin(trainblock,calibblock))
+        calib_rows,_=dataset_h5_block(inputpath,time_in_ind["train"][calibind])[np.arange(0,len(calibind))]
+
+    quantmodel=quantize_model(predictor,mode=mode,calib_rows=calib_rows,backend=(backend if backend!="" else None))
+    if output=="":
+        output=checkpoint+'.int8.pt'
+
+    torch.jit.save(torch.jit.script(quantmodel),output)
+    report=quantize_report(predictor,quantmodel,data,target,ntime=ntime)
+    report["mode"]=mode
+    report["output"]=output
+    return report
+
+def main():
+    import train_mlp_full_modified as trainer
+    parser=argparse.ArgumentParser(description='post training quantization')
+    for key in args_internal_dict.keys():
+        parser=trainer.parse_func_wrap(parser,key,args_internal_dict)
+
+    args=parser.parse_args()
+    if args.threads>0:
+        torch.set_num_threads(args.threads)
+
+    report=quantize_run(checkpoint=args.checkpoint,mode=args.mode,output=args.output,artifact=args.artifact,inputpath=args.inputpath,
+                        ncalib=args.ncalib,backend=args.backend,seed=args.seed)
+    print('quantized ({}) model: {}'.format(report["mode"],report["output"]))
+    print('test mse (per sample) float: {:.6f} int8: {:.6f} ratio: {:.4f}'.format(report["mse_float"],report["mse_quant"],report["mse_ratio"]))
+    print('throughput (rows/s) float: {:.1f} int8: {:.1f} speedup: {:.2f}'.format(report["rows_per_s_float"],report["rows_per_s_quant"],report["speedup"]))
+
+if __name__ == '__main__':
+    main()
@@ -7,9 +7,11 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import math
+import warnings
+import copy
 # from .utils import load_state_dict_from_url
 
-__all__=['ResNet_mlp','resnet10_mlp','resnet14_mlp','resnet18_mlp', 'resnet34_mlp', 'resnet50_mlp', 'resnet101_mlp','resnet152_mlp','resnet2x_mlp','wide_resnet50_2_mlp', 'wide_resnet101_2_mlp' 'mlp_mod' 'gru_mlp_rnn' 'gru_rnn' 'diffaddcell_rnn'] #'resnext50_32x4d', 'resnext101_32x8d',
+__all__=['ResNet_mlp','resnet10_mlp','resnet14_mlp','resnet18_mlp', 'resnet34_mlp', 'resnet50_mlp', 'resnet101_mlp','resnet152_mlp','resnet2x_mlp','wide_resnet50_2_mlp', 'wide_resnet101_2_mlp','mlp_mod','gru_mlp_rnn','gru_rnn','diffaddcell_rnn','compile_model','fuse_for_inference'] #'resnext50_32x4d', 'resnext101_32x8d',
 
 ##currently no convolution layers
 # def conv3x3(in_planes, out_planes, stride=1, groups=1, dilation=1):
@@ -217,8 +219,24 @@ class ResNet_mlp(nn.Module):
         # print("dataparallel checker")
         return x
 
+##base of the rnn cells, the recurrent loop through time
+class _seq_cell(nn.Module):
+    @torch.jit.export
+    def forward_seq(self,x,hidden):
+        ##the recurrent loop through time, compiled together with the cell when scripted
+        ##return hidden states nsample*ntime*hidden_size
+        outs=[]
+        for seq in range(x.size(1)):
+            hidden=self.forward(x[:,seq,:],hidden)
+            outs.append(hidden)
+        return torch.stack(outs,1)
+
+##the original gru cell in pytorch with the recurrent loop (same parameter names as nn.GRUCell)
+class gru_cell(nn.GRUCell,_seq_cell):
+    pass
+
 ## a gru network with controled
-class gru_mlp_cell(nn.Module):
+class gru_mlp_cell(_seq_cell):
     def __init__(self,input_size,hidden_size,numlayer=0,bias=True,p=0.0):
         super(gru_mlp_cell,self).__init__()
         self.input_size=input_size
@@ -249,7 +267,7 @@ class gru_mlp_cell(nn.Module):
         hy=newh+updategate*(hidden-newh)
         # print('resetgate{} updategate{} hidden{}'.format(resetgate.shape,updategate.shape,hidden.shape))
         return hy
-        
+    
     def _make_layer(self,hidden_size,numlayer=0,p=0.0):
         layers=[]
         ##block will pass the arguments to the two block types
@@ -260,7 +278,7 @@ class gru_mlp_cell(nn.Module):
         return nn.Sequential(*layers)
 
 ## a new deigned rnn cell
-class diffadd_cell(nn.Module):
+class diffadd_cell(_seq_cell):
     def __init__(self,input_size,hidden_size,numlayer=0,bias=True,p=0.0):
         super(diffadd_cell,self).__init__()
         self.input_size=input_size
@@ -284,7 +302,7 @@ class diffadd_cell(nn.Module):
         # print('hidden {} hidden_d {} delt{}'.format(hidden.shape,hidden_d.shape,delt.shape))
         hy=hidden+hidden_d*delt
         return hy
-        
+    
     def _make_layer(self,hidden_size,numlayer=0,p=0.0):
         layers=[]
         ##block will pass the arguments to the two block types
@@ -302,40 +320,44 @@ class RNN_Model(nn.Module):
         self.hidden_dim=hidden_dim
         # print('{}\n'.format(type))
         if type=='gru':
-            self.rnncell=nn.GRUCell(input_dim,hidden_dim,bias=True)
+            self.rnncell=gru_cell(input_dim,hidden_dim,bias=True)
         elif type=='gru_mlp':
             self.rnncell=gru_mlp_cell(input_dim,hidden_dim,numlayer,p=p)
         elif type=='diffaddcell':
             self.rnncell=diffadd_cell(input_dim,hidden_dim,numlayer,p=p)
         
+        self.type=type
         self.inputlay=line1dbias(input_dim_0,hidden_dim)
         self.outputlay=line1dbias(hidden_dim,output_dim)
         for m in self.modules():
             if isinstance(m, nn.Linear):
                 nn.init.kaiming_normal_(m.weight,mode='fan_out')
         
+        ##the recurrent loop of the cells is compiled by TorchScript (same parameter names as the python cell)
+        ##the scripted cell can not run under torch.inference_mode after a run with autograd in the process, use torch.no_grad for inference
+        self.rnncell=torch.jit.script(self.rnncell)
+        
     def forward(self,x,initialvec):
         ##initialvec: input1 [Y(t_0) t_0], initial condition
         ##x: input2  [theta, t_k, delta t_k], theta and time
         hiddeninput0=initialvec
         self.hiddeninput0=hiddeninput0
         h0=self.inputlay(self.hiddeninput0)
-        outs=[]
-        hn=h0
-        for seq in range(x.size(1)):#time direction
-        
-            # a=x[:,seq,:]
-            # print('{} {}'.format(a.shape,hn.shape))
-            
-            hn=self.rnncell(x[:,seq,:],hn)
-            outs.append(self.outputlay(hn))
-        # print('outs{}'.format(outs))
-        # outtensor=torch.cat(outs)
-        outtensor=torch.stack(outs)
-        outtensor=torch.transpose(outtensor,0,1).contiguous()
+        hiddens=self.rnncell.forward_seq(x,h0)
+        # time direction is dim 1, the output layer is applied once on all hidden states
+        outtensor=self.outputlay(hiddens)
         size3d=outtensor.shape
-        outtensor=outtensor.view(size3d[0]*size3d[1],-1)
+        outtensor=outtensor.reshape(size3d[0]*size3d[1],-1)
         return outtensor
+    
+    def forward_state(self,x,initialvec=None,hidden=None):
+        ##forward that continues from the hidden state of a previous call (e.g. beyond the training time range), initialvec is used when hidden is None
+        ##return the output (as forward) and the hidden state at the last time point
+        if hidden is None:
+            hidden=self.inputlay(initialvec)
+        hiddens=self.rnncell.forward_seq(x,hidden)
+        outtensor=self.outputlay(hiddens)
+        return outtensor.reshape(hiddens.shape[0]*hiddens.shape[1],-1), hiddens[:,-1,:]
 
 ### MLP sturcture with control on number of layer and existence of batchnormalization
 ###the whole residule network structure
@@ -576,3 +598,97 @@ def diffaddcell_rnn(ntheta,nspec,num_layer,p=0.0,ncellscale=1.0,**kwargs):
     kwargs['p']=p
     type='diffaddcell'
     return _rnnnet(ntheta,nspec,num_layer,ncellscale,type,**kwargs)
+
+def compile_model(model,mode=None,example_input=None):
+    r"""compile the forward of the model by torch.compile
+    torch.compile is lazy, a separate compiled wrapper of the model is run once on example_input to compile it. On success the model is compiled in place
+    (it reuses the graphs of the trial run, the state_dict keys are not changed), on failure (or if torch.compile is not available) the model is returned in eager mode
+    the trial run keeps the buffers (e.g. running statistics of batch normalization) and the random state
+    mode: mode of torch.compile, e.g. "reduce-overhead" Default None
+    example_input: tuple of the model input (e.g. a small batch on the device of the model). Default None (no trial run, errors surface at the first call)
+    """
+    if not hasattr(torch,'compile') or not hasattr(model,'compile'):
+        warnings.warn('torch.compile is not available, the model runs in eager mode')
+        return model
+    
+    if example_input is not None:
+        buffers=[buf.detach().clone() for buf in model.buffers()]
+        cudadevices=sorted(set(param.device.index for param in model.parameters() if param.device.type=='cuda'))
+        try:
+            with torch.random.fork_rng(devices=cudadevices):
+                torch.compile(model,mode=mode)(*example_input)
+        except Exception as e:
+            warnings.warn('the model can not be compiled, run in eager mode: '+str(e))
+            return model
+        finally:
+            with torch.no_grad():
+                for buf, value in zip(model.buffers(),buffers):
+                    buf.copy_(value)
+    
+    model.compile(mode=mode)
+    return model
+
+##inference only structures, made by fuse_for_inference
+def _fold_linear_bn(fc,bn):
+    ##Linear layer equivalent to fc followed by bn (eval mode, running statistics)
+    fused=nn.Linear(fc.in_features,fc.out_features,bias=True).to(device=fc.weight.device,dtype=fc.weight.dtype)
+    bias=fc.bias.detach() if fc.bias is not None else torch.zeros_like(fc.weight[:,0])
+    with torch.no_grad():
+        if bn is None:
+            fused.weight.copy_(fc.weight)
+            fused.bias.copy_(bias)
+        else:
+            scale=torch.rsqrt(bn.running_var+bn.eps)
+            shift=-bn.running_mean*scale
+            if bn.weight is not None:
+                scale=scale*bn.weight
+                shift=shift*bn.weight+bn.bias
+            fused.weight.copy_(fc.weight*scale[:,None])
+            fused.bias.copy_(bias*scale+shift)
+    return fused
+
+class _fused_residual_block(nn.Module):
+    ##residual block of folded Linear layers with relu in between, the identity is added before the last relu
+    ##the addition is a FloatFunctional to be quantized in static quantization
+    def __init__(self,layers,downsample=None):
+        super(_fused_residual_block,self).__init__()
+        body=[]
+        for layer in layers[:-1]:
+            body+=[layer,nn.ReLU(inplace=True)]
+        body.append(layers[-1])
+        self.body=nn.Sequential(*body)
+        self.downsample=downsample if downsample is not None else nn.Identity()
+        self.skip_add=nn.quantized.FloatFunctional()
+
+    def forward(self,x):
+        out=self.body(x)
+        return self.skip_add.add_relu(out,self.downsample(x))
+
+def fuse_for_inference(model):
+    r"""inference only copy of a ResNet_mlp or _mlp_mod model
+    each BatchNorm1d is folded into the preceding Linear layer (with bias) and dropout is removed, the result is a nn.Sequential
+    of Linear, ReLU and residual blocks equivalent to model in eval mode. The original model is not changed
+    model: ResNet_mlp or _mlp_mod model, also wrapped by DataParallel
+    """
+    model=getattr(model,'module',model)
+    if not isinstance(model,(ResNet_mlp,_mlp_mod)):
+        raise ValueError('only ResNet_mlp and _mlp_mod models can be fused, not '+type(model).__name__)
+    
+    bn=model.bn1 if isinstance(model,ResNet_mlp) else model.bn
+    layers=[_fold_linear_bn(model.fc1,bn),nn.ReLU(inplace=True)]
+    for block in model.layer1:
+        if isinstance(block,BasicBlock):
+            layers.append(_fused_residual_block([_fold_linear_bn(block.fc1,block.bn1),_fold_linear_bn(block.fc2,block.bn2)],
+                                                copy.deepcopy(block.downsample)))
+        elif isinstance(block,Bottleneck):
+            layers.append(_fused_residual_block([_fold_linear_bn(block.fc1,block.bn1),_fold_linear_bn(block.fc2,block.bn2),
+                                                 _fold_linear_bn(block.fc3,block.bn3)],copy.deepcopy(block.downsample)))
+        elif isinstance(block,BasicBlock_mlp):
+            layers+=[_fold_linear_bn(block.fc,block.bn),nn.ReLU(inplace=True)]
+        else:
+            raise ValueError('unknown block '+type(block).__name__)
+    
+    layers+=[nn.Flatten(1),copy.deepcopy(model.fcf)]
+    fused=nn.Sequential(*layers)
+    fused.eval()
+    return fused
@@ -1,6 +1,7 @@
 # plot mse through epoch
 # train mse based on the first value among all the mse for trianing set
 # test mse based on average value
+# the values are read from metrics.csv of each run folder
 rm(list=ls())
 options(warn=1)
 options(stringsAsFactors=FALSE)
@@ -26,29 +27,14 @@ dirlist=1:1#c(1,2,3,4,8)#1:9#1:6
 mselist=list(epoch=c(),train=c(),test=c(),names=c())
 for(dir in dirlist){
   locdir=paste0(dirres,dir,"/")
-  files=list.files(locdir)
-  filesoutput=files[str_which(string=files,pattern="testmodel\\.\\d+\\.out")]##might use testmodel\\..+\\.out for different filename (user should ensure)
-  lines=readLines(paste0(locdir,filesoutput))
-  train_ind=str_which(string=lines,pattern="Train Epoch:")
-  test_ind=str_which(string=lines,pattern="Test set:")
-  epoch_ind=sapply(seq(length(test_ind)),function(xi){
-    if(xi>1){
-      range=c(test_ind[xi-1],test_ind[xi])
-    }else{
-      range=c(0,test_ind[xi])
-    }
-    train_ind[train_ind<range[2]&train_ind>range[1]][1]
-  })
-  # trainrecord_ind=epoch_ind[seq(length(epoch_ind))%%2==0]
-  lines[epoch_ind] %>% str_extract(string=.,pattern="Train Epoch:\\s+\\w+") %>%
-              str_replace_all(string=,pattern="Train Epoch:\\s+",replacement="") %>%
-              as.numeric(.) -> epoch_num
-  lines[epoch_ind] %>% str_extract(string=.,pattern="Loss\\(per sample\\):\\s+[\\w\\.]+") %>%
-              str_replace_all(string=,pattern="Loss\\(per sample\\):\\s+",replacement="") %>%
-              as.numeric(.) -> losstrain
-  lines[test_ind] %>% str_extract(string=.,pattern="Average loss \\(per sample\\):\\s+[\\w\\.]+") %>%
-              str_replace_all(string=,pattern="Average loss \\(per sample\\):\\s+",replacement="") %>%
-              as.numeric(.) -> losstest
+  ##metrics written by the training script (see metrics_log.py), train loss of the first logged batch and the validation loss of each epoch
+  metricstab=read.csv(paste0(locdir,"metrics.csv"),header=TRUE)
+  traintab=metricstab[metricstab[,"phase"]=="train",]
+  traintab=traintab[!duplicated(traintab[,"epoch"]),]
+  testtab=metricstab[metricstab[,"phase"]=="validate",]
+  epoch_num=traintab[,"epoch"]
+  losstrain=traintab[,"loss"]
+  losstest=testtab[match(epoch_num,testtab[,"epoch"]),"loss"]
   mselist[["epoch"]]=c(mselist[["epoch"]],epoch_num)
   mselist[["train"]]=c(mselist[["train"]],losstrain)
   mselist[["test"]]=c(mselist[["test"]],losstest)
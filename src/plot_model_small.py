@@ -28,13 +28,14 @@ import torch.optim as optim
 import torch.nn.functional as F
 # sys.path.insert(1,'/Users/yuewu/Dropbox (Edison_Lab@UGA)/Projects/Bioinformatics_modeling/nc_model/nnt/model_training/')
 import nnt_struc as models
+from nnt_predict import nnt_predictor
+from data_struc import run_artifact_load
+from nnt_evaluate import residue_time_stat
 
-# import the model from model script
 random.seed(1)
 torch.manual_seed(1)
 inputdir="./"
 os.chdir(inputdir)
-from train_mlp_full_modified import train, test, parse_func_wrap, batch_sampler_block
 ##load information table
 infortab=pd.read_csv(inputdir+'submitlist.tab',sep="\t",header=0)
 infortab=infortab.astype({"batch_size": int,"test_batch_size": int})
@@ -53,6 +54,8 @@ separation=['train','validate','test']
 f=h5py.File(inputdir+"data/sparselinearode_new.small.stepwiseadd.mat",'r')
 data=f.get('inputstore')
 Xvar=np.array(data).transpose()
+data=f.get('outputstore')
+ResponseVar=np.array(data).transpose()
 plotcollect={}
 rowiseq=range(1,2)# +1 than number of folders
 ##plot time trajectory
@@ -61,14 +64,13 @@ for rowi in rowiseq:
     with open(inputdir+"result/"+str(rowi)+"/pickle_dimdata.dat","rb") as f1:
         dimdict=pickle.load(f1)
     
-    with open(inputdir+"result/"+str(rowi)+"/pickle_inputwrap.dat","rb") as f1:
-        inputwrap=pickle.load(f1)
+    ##split index of the run, the data are from the input file
+    inputwrap=run_artifact_load(inputdir+"result/"+str(rowi)+"/run_artifact.h5")
     
     device=torch.device('cpu')
-    loaddic=torch.load(inputdir+"result/"+str(rowi)+"/model_best.resnetode.tar",map_location=device)
-    args=loaddic["args_input"]
-    Xvarnorm=inputwrap["Xvarnorm"]
-    ResponseVar=inputwrap["ResponseVar"]
+    ##model loaded once for all trajectories of the run
+    predictor=nnt_predictor(inputdir+"result/"+str(rowi)+"/model_best.resnetode.tar",device=device)
+    args=predictor.args
     samplevec=inputwrap["samplevec"]
     # train_in_ind=inputwrap["train_in_ind"]
     # test_in_ind=inputwrap["test_in_ind"]
@@ -81,32 +83,22 @@ for rowi in rowiseq:
     labels=[]
     for x in separation:
         testselec=np.append(testselec,np.unique(samplevec_separa[x])[sampsele_ind_ind[x]])
-        labels=labels+x*len(sampsele_ind_ind[x])
+        labels=labels+[x]*len(sampsele_ind_ind[x])
     
+    ##all selected trajectories are estimated together (rows of each block are in time order)
+    showele_list=[np.sort(np.where(np.isin(samplevec,elesampe))[0]) for elesampe in testselec]
+    showele_all=np.concatenate(showele_list)
+    output_all=predictor.predict_rows(Xvar[showele_all,:],ntime=len(showele_list[0]))##normalized by the training statistics in the checkpoint
+    target_all=torch.Tensor(ResponseVar[showele_all,:])
+    output_list=torch.split(output_all,[len(showele) for showele in showele_list])
+    target_list=torch.split(target_all,[len(showele) for showele in showele_list])
     fig,ax=plt.subplots()
     for eleind, elesampe in enumerate(testselec):
         label=labels[eleind]
-        showele=np.sort(np.where(np.isin(samplevec,elesampe))[0])## for each block time is in order
-        Xtensortest=torch.Tensor(Xvarnorm[list(showele),:])
+        showele=showele_list[eleind]
         Xvartest=torch.Tensor(Xvar[list(showele),:])##only for real time value used later
-        Resptensortest=torch.Tensor(ResponseVar[list(showele),:])
-        testdataset=utils.TensorDataset(Xtensortest,Resptensortest)
-        train_sampler=None
-        curr_batch_size=len(showele)#as in plotting, each time trajectory are estimated togethter(as one batch), the mini batch size is the data length
-        testdataloader=utils.DataLoader(testdataset,batch_size=curr_batch_size,shuffle=False,num_workers=args.workers,pin_memory=True)
-        ninnersize=int(args.layersize_ratio*dimdict["ntheta"][0])
-        if bool(re.search("[rR]es[Nn]et",args.net_struct)):
-            model=models.__dict__[args.net_struct](ninput=dimdict["ntheta"][0],num_response=dimdict["nspec"][0],p=args.p,ncellscale=args.layersize_ratio)
-        else:
-            model=models.__dict__[args.net_struct](ninput=dimdict["ntheta"][0],num_response=dimdict["nspec"][0],nlayer=args.num_layer,p=args.p,ncellscale=args.layersize_ratio,batchnorm_flag=(args.batchnorm_flag is 'Y'))
-        
-        model=torch.nn.DataParallel(model)
-        model.load_state_dict(loaddic['state_dict'])
-        model.eval()
-        [data,target]=next(iter(testdataloader))
-        torch.no_grad()
-        output=model(data)
-        output=output.detach()
+        output=output_list[eleind]
+        target=target_list[eleind]
         residue=output-target
         time=np.array(Xvartest[:,-1])
         # timeind=np.argsort(time,kind='mergesort')
@@ -143,51 +135,16 @@ for rowi in rowiseq:
     with open(inputdir+"result/"+str(rowi)+"/pickle_dimdata.dat","rb") as f1:
         dimdict=pickle.load(f1)
     
-    with open(inputdir+"result/"+str(rowi)+"/pickle_inputwrap.dat","rb") as f1:
-        inputwrap=pickle.load(f1)
+    ##split index of the run, the data are from the input file
+    inputwrap=run_artifact_load(inputdir+"result/"+str(rowi)+"/run_artifact.h5")
     
-    loaddic=torch.load(inputdir+"result/"+str(rowi)+"/model_best.resnetode.tar",map_location=device)
-    args=loaddic["args_input"]
-    Xvarnorm=inputwrap["Xvarnorm"]
-    ResponseVar=inputwrap["ResponseVar"]
+    predictor=nnt_predictor(inputdir+"result/"+str(rowi)+"/model_best.resnetode.tar",device=device)
+    args=predictor.args
     samplevec=inputwrap["samplevec"]
-    Xtensortest=torch.Tensor(Xvarnorm)
-    Resptensortest=torch.Tensor(ResponseVar)
-    testdataset=utils.TensorDataset(Xtensortest,Resptensortest)
-    # train_sampler=None
-    test_sampler=batch_sampler_block(testdataset,samplevec,nblock=samplelen["train"])
-    testdataloader=utils.DataLoader(testdataset,shuffle=False,num_workers=args.workers,pin_memory=True,batch_sampler=test_sampler)
-    ninnersize=int(args.layersize_ratio*dimdict["ntheta"][0])
-    if bool(re.search("[rR]es[Nn]et",args.net_struct)):
-        model=models.__dict__[args.net_struct](ninput=dimdict["ntheta"][0],num_response=dimdict["nspec"][0],p=args.p,ncellscale=args.layersize_ratio)
-    else:
-        model=models.__dict__[args.net_struct](ninput=dimdict["ntheta"][0],num_response=dimdict["nspec"][0],nlayer=args.num_layer,p=args.p,ncellscale=args.layersize_ratio,batchnorm_flag=(args.batchnorm_flag is 'Y'))
-    model=torch.nn.DataParallel(model)
-    model.load_state_dict(loaddic['state_dict'])
-    model.eval()
-    targetvec=np.empty([0,dimdict["nspec"][0]])
-    outputvec=np.empty([0,dimdict["nspec"][0]])
-    timevec=[]
-    torch.no_grad()
-    for data, target in testdataloader:
-        output=model(data)
-        output=output.detach()
-        timevec=timevec+data[:,-1].tolist()
-        targetvec=np.concatenate([targetvec,np.array(target)])
-        outputvec=np.concatenate([outputvec,np.array(output)])
-        # targetvec=targetvec+target.tolist()[0]
-        # outputvec=outputvec+output.tolist()[0]
-    
-    # targetvec=np.array(targetvec)
-    # outputvec=np.array(outputvec)
-    residuevec=targetvec-outputvec
-    timevec=np.array(timevec)
-    residuemean=np.zeros(ntime)
-    for indmean, timepoint in enumerate(np.sort(np.unique(timevec),kind='mergesort')):
-        ind=np.where(timevec==timepoint)
-        residuemean[indmean]=np.mean(residuevec[ind])
-    
-    line,=ax.plot(range(0,ntime),residuemean,label='residue')
+    ##whole data set predicted in batches, residue statistics of each time point and species
+    residuestat=residue_time_stat(predictor,Xvar,ResponseVar,ntime=int(len(samplevec)/np.unique(samplevec).size))
+    residuemean=residuestat["mean"].mean(axis=1)
+    line,=ax.plot(range(0,residuemean.size),residuemean,label='residue')
     ax.legend()
     pdfname="test"+name+"residue"
     plt.savefig(inputdir+"result/"+pdfname+".pdf")
@@ -201,3 +158,18 @@ for rowi in rowiseq:
 # with open("datatemp.dat","wb") as f1:
 #     pickle.dump(tmpsave,f1,protocol=4)
 ##extrapolation
+###the test trajectories of each run are rolled forward from the end of the training time range (timetrainlen) to the end of the simulated time range
+for rowi in rowiseq:
+    name=infortab.iloc[rowi-1,0]
+    inputwrap=run_artifact_load(inputdir+"result/"+str(rowi)+"/run_artifact.h5")
+    predictor=nnt_predictor(inputdir+"result/"+str(rowi)+"/model_best.resnetode.tar",device=device)
+    samplevec=inputwrap["samplevec"]
+    ntimetotal=int(len(samplevec)/np.unique(samplevec).size)
+    ntimetrain=min(predictor.args.timetrainlen,ntimetotal)
+    testrows=np.sort(inputwrap["ind_separa"]["test"]).reshape(-1,ntimetotal)
+    Xvartest=Xvar[testrows[:,0],:]
+    output=predictor.extrapolate(Xvartest[:,0:predictor.ntheta_real],Xvartest[:,predictor.ntheta_real:(predictor.ntheta-1)],Xvar[testrows,-1],ntime=ntimetrain)
+    target=ResponseVar[testrows,:]
+    msetime=((np.array(output)-target)**2).mean(axis=(0,2))
+    print('run {} mse of the training time range {:.6f} and the extrapolation {}'.format(name,msetime[:ntimetrain].mean(),
+          ('{:.6f}'.format(msetime[ntimetrain:].mean()) if ntimetotal>ntimetrain else 'none')))
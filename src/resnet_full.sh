@@ -21,4 +21,9 @@ date
 #load pytorch
 conda activate /home/mikeaalv/method/pytorch
 
-time python3 train_mlp_full.py --batch-size 50000 --test-batch-size 50000 --epochs 100 --learning-rate 0.01 --seed 1 --net-struct 'resnet18_mlp'
+##a requeued (preempted) job continues from the last checkpoint of the run folder
+resumearg=""
+if [ -f checkpoint.resnetode.tar ]; then
+  resumearg="--resume checkpoint.resnetode.tar"
+fi
+time python3 train_mlp_full_modified.py --batch-size 50000 --test-batch-size 50000 --epochs 100 --learning-rate 0.01 --seed 1 --net-struct 'resnet18_mlp' $resumearg
@@ -0,0 +1,225 @@
+##in process hyperparameter sweep over the rows of submitlist.tab (replace parameter_sampler.R and one submitted job per run folder)
+###the input file is read once, the separation and normalization are done once for each (input file, seed, normalization, time length) and shared with the runs by shared memory
+###runs are trained concurrently in a process pool, each run in the folder RESULTDIR/ROW/ with the same output files as a single run (stdout in testmodel.ROW.out)
+###run in the code folder (input file in ../data/ as train_mlp_full_modified.py), unknown arguments are passed to all runs, e.g.
+###  python sweep_runner.py --tabfile submitlist.tab --rows 1-21 --workers 4 --timetrainlen 101 --gpu-use 0
+import argparse
+import os
+import sys
+import re
+import copy
+import time
+import random
+import contextlib
+import numpy as np
+import pandas as pd
+import torch
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import train_mlp_full_modified as trainer
+
+##default parameters
+args_internal_dict={
+    "tabfile": ("submitlist.tab",str),#the table of runs, one row for each run
+    "rows": ("",str),#rows to run (1 based, also the run folder name), e.g. "1,3,5-8". Default all rows
+    "workers": (1,int),#number of runs trained at the same time
+    "threads": (0,int),#torch threads of each run, 0 for number of cores/workers
+    "resultdir": ("result",str)#folder of the run folders
+}
+
+def parse_rows(rowstr,nrow):
+    """
+    row string "1,3,5-8" to the list of 1 based rows
+    """
+    if rowstr=="":
+        return list(range(1,nrow+1))
+
+    rows=[]
+    for part in rowstr.split(","):
+        if "-" in part:
+            rowstart,rowend=part.split("-")
+            rows=rows+list(range(int(rowstart),int(rowend)+1))
+        else:
+            rows.append(int(part))
+
+    return rows
+
+def row_args(infor,baseargs):
+    """
+    training arguments of one row of the table, as the command line made by parameter_sampler.R
+        infor: the row (pandas Series)
+        baseargs: the default arguments of train_mlp_full_modified.py
+    """
+    args=copy.deepcopy(baseargs)
+    args.batch_size=int(infor["batch_size"])
+    args.test_batch_size=int(infor["test_batch_size"])
+    args.epochs=int(infor["epochs"])
+    args.learning_rate=float(infor["learning_rate"])
+    args.seed=int(infor["random_seed"] if "random_seed" in infor.index else infor["seed"])
+    args.net_struct=str(infor["net_struct"])
+    args.layersize_ratio=float(infor["layersize_ratio"])
+    args.optimizer=str(infor["optimizer"])
+    args.num_layer=int(infor["nlayer"])
+    args.inputfile=str(infor["inputfile"])
+    args.lr_print=1
+    addon=infor["addon"] if "addon" in infor.index and isinstance(infor["addon"],str) else ""
+    if re.search("No_input_normalization",addon):
+        args.normalize_flag="N"
+    if re.search("No_batch_normliaztion",addon):
+        args.batchnorm_flag="N"
+    if re.search("^dp",addon):
+        args.p=float(re.sub(r"\s+.+$","",re.sub("^dp","",addon)))
+    if re.search("^scheduler",addon):
+        args.scheduler=re.sub(r"\s+.+$","",re.sub(r"^scheduler\_","",addon))
+    if re.search("randomsamp",addon):
+        args.sampler="individual"
+    if re.search(r"\_rnn",args.net_struct):
+        args.rnn_struct=1
+    if "timeshift_p" in infor.index:
+        args.timeshift_transformp=float(infor["timeshift_p"])
+    if "lincomb_p" in infor.index:
+        args.linearcomb_transformp=float(infor["lincomb_p"])
+    ##shared in memory data, one process for each run (pool processes can not start DataLoader workers)
+    args.lazy_load=0
+    args.workers=0
+    args.distributed=0
+    args.rank=0
+    args.world_size=1
+    args.local_rank=0
+    return args
+
+def _share_array(array,shmlist):
+    ##copy the array into a new shared memory block, return the description to attach it
+    shm=shared_memory.SharedMemory(create=True,size=max(1,array.nbytes))
+    sharray=np.ndarray(array.shape,dtype=array.dtype,buffer=shm.buf)
+    sharray[...]=array
+    shmlist.append(shm)
+    return ("shared_array",shm.name,array.shape,array.dtype.str)
+
+def _share_dict(datawrap,shmlist,shared):
+    ##numpy arrays (also in dict values) replaced by shared memory description
+    ##shared: id: (array, description) of the shared arrays, arrays used by more than one separation (e.g. ResponseVar) are shared once
+    sharedict={}
+    for key, value in datawrap.items():
+        if isinstance(value,dict):
+            sharedict[key]=_share_dict(value,shmlist,shared)
+        elif isinstance(value,np.ndarray):
+            if id(value) not in shared:
+                shared[id(value)]=(value,_share_array(value,shmlist))
+            sharedict[key]=shared[id(value)][1]
+        else:
+            sharedict[key]=value
+
+    return sharedict
+
+def _attach_dict(sharedict,shmlist):
+    datawrap={}
+    for key, value in sharedict.items():
+        if isinstance(value,dict):
+            datawrap[key]=_attach_dict(value,shmlist)
+        elif isinstance(value,tuple) and len(value)==4 and value[0]=="shared_array":
+            shm=shared_memory.SharedMemory(name=value[1])
+            shmlist.append(shm)
+            datawrap[key]=np.ndarray(value[2],dtype=np.dtype(value[3]),buffer=shm.buf)
+        else:
+            datawrap[key]=value
+
+    return datawrap
+
+def _worker_init(threads):
+    torch.set_num_threads(threads)
+
+def sweep_run(task):
+    """
+    train one run in its folder on the shared data, return (row, final test mse, run time)
+    """
+    rowname,args,sharedict,rundir=task
+    shmlist=[]
+    datawrap=_attach_dict(sharedict,shmlist)
+    os.makedirs(rundir,exist_ok=True)
+    prevdir=os.getcwd()
+    os.chdir(rundir)
+    timestart=time.time()
+    try:
+        with open("testmodel."+rowname+".out","w") as f1, contextlib.redirect_stdout(f1):
+            random.seed(args.seed)
+            torch.manual_seed(args.seed)
+            acctest=trainer.train_run(args,datawrap,torch.cuda.device_count())
+    finally:
+        os.chdir(prevdir)
+        del(datawrap)
+        for shm in shmlist:
+            shm.close()
+
+    return rowname, acctest, time.time()-timestart
+
+def sweep(tabfile,rows=None,workers=1,threads=0,resultdir="result",trainargv=[]):
+    """
+    run the rows of tabfile
+        tabfile: the table of runs (columns as submitlist.tab)
+        rows: 1 based rows to run. Default all rows
+        workers: number of runs trained at the same time
+        threads: torch threads of each run, 0 for number of cores/workers
+        resultdir: folder of the run folders
+        trainargv: command line arguments of train_mlp_full_modified.py used for all runs
+    return dict of row: final test mse
+    """
+    infortab=pd.read_csv(tabfile,sep="\t",header=0)
+    if rows is None:
+        rows=list(range(1,infortab.shape[0]+1))
+
+    baseargs=trainer.args_parser().parse_args(trainargv)
+    runargs={str(rowi): row_args(infortab.iloc[rowi-1],baseargs) for rowi in rows}
+    shmlist=[]
+    tasks=[]
+    try:
+        ##the input file is read once and each separation is done once
+        datadict={}
+        sharedata={}
+        shared={}
+        for rowname, args in runargs.items():
+            if args.inputfile not in datadict:
+                datadict[args.inputfile]=trainer.data_load(args)
+            groupkey=(args.inputfile,args.seed,args.normalize_flag,args.timetrainlen,args.test_validate_ratio)
+            if groupkey not in sharedata:
+                rawdata=datadict[args.inputfile]
+                random.seed(args.seed)
+                out=np.empty(rawdata["Xvar"].shape)
+                datawrap=trainer.data_separation(args,rawdata,out=out)
+                sharedata[groupkey]=(_share_dict(datawrap,shmlist,shared),args.mintime)
+                del(datawrap,out)
+            args.mintime=sharedata[groupkey][1]
+            tasks.append((rowname,args,sharedata[groupkey][0],os.path.abspath(os.path.join(resultdir,rowname))))
+
+        del(datadict,shared)
+        if threads==0:
+            threads=max(1,os.cpu_count()//workers)
+
+        pool=mp.get_context("spawn").Pool(workers,initializer=_worker_init,initargs=(threads,))
+        res={}
+        for rowname, acctest, runtime in pool.imap_unordered(sweep_run,tasks):
+            print('run {} test mse {:.6f} time {:.1f}s'.format(rowname,acctest,runtime))
+            sys.stdout.flush()
+            res[rowname]=acctest
+        pool.close()
+        pool.join()
+    finally:
+        for shm in shmlist:
+            shm.close()
+            shm.unlink()
+
+    return res
+
+def main():
+    parser=argparse.ArgumentParser(description='hyperparameter sweep')
+    for key in args_internal_dict.keys():
+        parser=trainer.parse_func_wrap(parser,key,args_internal_dict)
+
+    args,trainargv=parser.parse_known_args()
+    infortab=pd.read_csv(args.tabfile,sep="\t",header=0)
+    rows=parse_rows(args.rows,infortab.shape[0])
+    sweep(args.tabfile,rows=rows,workers=args.workers,threads=args.threads,resultdir=args.resultdir,trainargv=trainargv)
+
+if __name__ == '__main__':
+    main()
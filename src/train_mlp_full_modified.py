@@ -1,38 +1,38 @@
 ##this training script support
 ###training mlp version of resnet on one gpu node (multiple gpu might be involved)
-###multiple node is not supported yet
+###multiple gpu and multiple node training by DistributedDataParallel (--distributed 1), launched by torchrun, e.g. on each node:
+###  torchrun --nnodes 2 --nproc_per_node 2 --rdzv_backend c10d --rdzv_endpoint HOST:PORT train_mlp_full_modified.py --distributed 1 ...
 ###separation of training vs testing, and got minibatching is intended to be in blocks of each whole time-series
 import argparse
 import os
 import random
-import shutil
 import time
 import warnings
 import pickle
 import numpy as np
 import math
 import sys
-import copy
 import h5py
-from nltk import flatten
 import re
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
-from itertools import permutations
 
 import torch
 import torch.nn.parallel
 import torch.utils.data as utils
 import torch.backends.cudnn as cudnn
 import torch.distributed as dist
-import torch.multiprocessing as mp
 import torch.optim as optim
 from torch.optim import lr_scheduler
 import torch.nn.functional as F
-from torch.utils.data.sampler import Sampler
 
 # sys.path.insert(1,'PATH')
 import nnt_struc as models
+from data_struc import dataset_h5_block, h5_column_stat, batch_sampler_block, batch_sampler_block_dist, batch_loader_tensor, dataset_rnn_seq, rnn_input_reshape, file_sha256, run_artifact_save, run_artifact_load
+from nnt_predict import build_model, example_input
+from metrics_log import metrics_writer
+from checkpoint_manager import checkpoint_manager
+from nnt_evaluate import trajectory_batches, eval_accumulator, eval_summary_writer
 
 model_names=sorted(name for name in models.__dict__
     if (name.endswith("_mlp") or name.endswith("_rnn")) and callable(models.__dict__[name]))
@@ -62,7 +62,18 @@ args_internal_dict={
      "rnn_struct": (0,int),#whether use rnn structure
      "sampler": ("block",str),##sampler to use. "block" sampler or "individual" sampler
      "timeshift_transformp": (0.0,float),##transformation input data by shift initial condition and time. This is the probability that such transform is performed
-     "linearcomb_transformp": (0.0,float)##transform input data by random combine two samples. This is the probability that such transform is performed
+     "linearcomb_transformp": (0.0,float),##transform input data by random combine two samples. This is the probability that such transform is performed
+     "lazy_load": (0,int),##read the input file lazily in blocks of time series during training (1) or load the whole matrix in memory (0)
+     "fast_loader": (0,int),##in memory batches by one index of the whole tensors on the training device (1) or torch DataLoader (0). Not used with lazy_load
+     "distributed": (0,int),##DistributedDataParallel training over the processes started by torchrun (1) or DataParallel in one process (0). batch_size is the total over processes
+     "precision": ("fp32",str),##fp32, fp16 (autocast with gradient scaling, cuda) or bf16 (autocast, cpu and cuda). The parameters are kept in float32
+     "compile": (0,int),##run the model compiled by torch.compile (1, eager mode if compile is not available) or in eager mode (0)
+     "resume": ("",str),##checkpoint (e.g. checkpoint.resnetode.tar) to continue training from, the split is read from run_artifact.h5 in its folder. "" for a new run
+     "save_interval": (1,int),##write checkpoint.resnetode.tar every save_interval epochs, the best checkpoints and the last epoch are always written
+     "keep_checkpoint": (1,int),##number of epoch checkpoints kept (checkpoint.resnetode.epochN.tar if more than 1)
+     "async_checkpoint": (1,int),##write checkpoints in a background thread (1) or in the training loop (0)
+     "metrics_file": ("metrics.csv",str),##csv file of the loss, learning rate and throughput of logged batches, epochs and evaluations (read by metrics_log.py). "" for no file
+     "eval_summary_file": ("eval_summary.h5",str)##HDF5 file of the mse per species, time index, trajectory and of the extrapolation window in each evaluation (read by nnt_evaluate.eval_summary_load). "" for no file
 }
 ###fixed parameters: for communication related parameter within one node
 fix_para_dict={#"world_size": (1,int),
@@ -70,13 +81,21 @@ fix_para_dict={#"world_size": (1,int),
                # "dist_url": ("env://",str),#"tcp://127.0.0.1:FREEPORT"
                "gpu": (None,int),
                # "multiprocessing_distributed": (False,bool),
-               # "dist_backend": ("nccl",str), ##the preferred way approach of parallel gpu
+               "dist_backend": ("gloo",str), ##gloo works on cpu and gpu, nccl is the preferred way approach of parallel gpu
                "workers": (1,int)
 }
 inputdir="../data/"
-def train(args,model,train_loader,optimizer,epoch,device,ntime,scheduler):
+def train(args,model,train_loader,optimizer,epoch,device,ntime,scheduler,metrics=None,scaler=None):
     model.train()
+    ampdtype=autocast_dtype(args,device)
+    if scaler is None:
+        scaler=torch.amp.GradScaler(device.type,enabled=False)
+    
     trainloss=[]
+    ##timing: data (waiting for the loader, transform and transfer) and compute (forward, backward and step) of the batches since the last logged batch
+    intervalstat=[0,0.0,0.0]#nsample, data time, compute time
+    epochstat=[0,0.0,0.0]
+    timeprev=time.time()
     for batch_idx, (data, target) in enumerate(train_loader):
         # print("checkerstart")
         # if args.gpu is not None:
@@ -93,98 +112,149 @@ def train(args,model,train_loader,optimizer,epoch,device,ntime,scheduler):
                 
         if args.rnn_struct==0:
             data,target=data.to(device),target.to(device)
-            output=model(data)
+            modelinput=(data,)
         else:
-            #reshape data for rnn intput
-            sizes=data.shape
-            ntheta_real=args.ntheta-1-args.nspec
-            nsample_loc=int(sizes[0]/ntime)
-            timeseq=range(0,sizes[0]-ntime+1,ntime)
-            fixinput_ind=range(ntheta_real,ntheta_real+args.nspec)
-            allind=set(range(0,args.ntheta))
-            time_var_ind=list(allind.difference(set(fixinput_ind)))
-            initialvec_theta=(data[timeseq,:])[:,fixinput_ind]
-            #nsample*(nspec+1)
-            zerotime=np.repeat(0.0,nsample_loc).reshape(nsample_loc,-1)
-            initialvec=torch.tensor(np.concatenate((initialvec_theta,zerotime),axis=1)).float()
-            timevarinput=data[:,time_var_ind]
-            timevec=timevarinput[:,-1]
-            deltimevec=timevec[1::]-timevec[0:-1]
-            deltimevec=torch.cat((torch.tensor([0.0]),deltimevec),0)
-            deltimevec[deltimevec<0]=0
-            timevarinput=torch.cat((timevarinput,deltimevec.view(sizes[0],-1)),1)
-            #nsample*ntime*(ntheta-1-nspec)
-            timevarinput=timevarinput.view(nsample_loc,ntime,len(time_var_ind)+1)
-            # print('timevarinput{} initialvec{}'.format(timevarinput.shape,initialvec.shape))
-            timevarinput,initialvec,target=timevarinput.to(device),initialvec.to(device),target.to(device)
-            output=model(timevarinput,initialvec)
+            if torch.is_tensor(data):#reshape data for rnn intput
+                timevarinput,initialvec=rnn_input_reshape(data,args.ntheta,args.nspec,ntime)
+            else:#whole time series precomputed by dataset_rnn_seq
+                timevarinput,initialvec=data
             
-        # loss=F.nll_loss(output,target)
-        # print('output{} target{}'.format(output.shape,target.shape))
-        loss=F.mse_loss(output,target,reduction='mean')
+            target=target.reshape(-1,args.nspec)
+            timevarinput,initialvec,target=timevarinput.to(device),initialvec.to(device),target.to(device)
+            modelinput=(timevarinput,initialvec)
+        
+        timedata=time.time()
+        with torch.autocast(device_type=device.type,dtype=ampdtype,enabled=ampdtype is not None):
+            output=model(*modelinput)
+            # loss=F.nll_loss(output,target)
+            # print('output{} target{}'.format(output.shape,target.shape))
+            loss=F.mse_loss(output.float(),target,reduction='mean')
+        
         optimizer.zero_grad()
-        loss.backward()
+        scaler.scale(loss).backward()
         # plot_grad_flow(model.named_parameters())
-        optimizer.step()
+        scaler.step(optimizer)
+        scaler.update()
+        lossval=loss.item()
+        timeend=time.time()
+        for stat in (intervalstat,epochstat):
+            stat[0]+=len(target)
+            stat[1]+=timedata-timeprev
+            stat[2]+=timeend-timedata
+        
+        timeprev=timeend
         
-        if batch_idx % args.log_interval==0:
+        if batch_idx % args.log_interval==0 and args.rank==0:
             if args.lr_print==1:
                 lrstr=' lr: '+str(get_lr(optimizer))
             else:
                 lrstr=''
                 
+            ndatarow=len(train_loader.dataset) if torch.is_tensor(data) else len(train_loader.dataset)*ntime#items are whole time series in dataset_rnn_seq
             print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss(per sample): {:.6f}{}'.format(
-                epoch,batch_idx*len(data),len(train_loader.dataset),
-                100. * batch_idx*len(data)/len(train_loader.dataset),loss.item()*ntime,lrstr))
+                epoch,batch_idx*len(target),ndatarow,
+                100. * batch_idx*len(target)/ndatarow,lossval*ntime,lrstr))
+            if metrics is not None:
+                metrics_row(metrics,'train',epoch,batch_idx,lossval*ntime,get_lr(optimizer),intervalstat)
+                intervalstat=[0,0.0,0.0]
         
         if args.scheduler=='cyclelr':#clclicLR need to make steps for each mini-batch
             scheduler.step()
         
-        trainloss.append(loss.item())
+        trainloss.append(lossval)
     
-    return (sum(trainloss)/len(trainloss))*ntime
+    trainloss_mean=loss_mean(trainloss,args)*ntime
+    if metrics is not None:
+        metrics_row(metrics,'train_epoch',epoch,len(trainloss),trainloss_mean,get_lr(optimizer),epochstat)
+    
+    return trainloss_mean
 
-def test(args,model,test_loader,device,ntime):
+def evaluate(args,model,evalset,device,ntime,ntimetotal,metrics=None,phase='validate',epoch=None,summary_writer=None,traj=None):
+    """
+    one pass over the whole time series (training and extrapolation window) of a split, with exact sums of the squared error (eval_accumulator)
+    the split is sharded by time series over the processes of distributed training and the sums are reduced
+        evalset: data set of the rows of the split (ntraj*ntimetotal rows, time series in blocks), indexed by a LongTensor
+        ntimetotal: length of the time series, the first ntime points are the training window
+        summary_writer: eval_summary_writer of the summary. Default None
+        traj: block index of the time series, stored with the summary
+    return the loss (per sample) of the training window and the summary dict
+    """
     model.eval()
-    test_loss=[]
+    evalmodel=model.module if args.distributed==1 else model##no collective communication in the forward pass of the shards
+    ampdtype=autocast_dtype(args,device)
+    ntraj=len(evalset)//ntimetotal
+    nblock=max(1,args.test_batch_size//ntimetotal)
+    accum=eval_accumulator(ntraj,ntimetotal,args.nspec,ntime=ntime,device=device)
+    nbatch=0
+    teststat=[0,0.0,0.0]
+    timeprev=time.time()
     with torch.no_grad():
-        for data, target in test_loader:
-            # if args.gpu is not None:
-            #     data=data.cuda(args.gpu,non_blocking=True)
-            # target=target.cuda(args.gpu,non_blocking=True)
+        for trajind, rowind in trajectory_batches(ntraj,ntimetotal,nblock,rank=args.rank,num_replicas=args.world_size):
+            data,target=evalset[rowind]
             if args.rnn_struct==0:
                 data,target=data.to(device),target.to(device)
-                output=model(data)
-            else:
-                #reshape data for rnn intput
-                sizes=data.shape
-                ntheta_real=args.ntheta-1-args.nspec
-                nsample_loc=int(sizes[0]/ntime)
-                timeseq=range(0,sizes[0]-ntime+1,ntime)
-                fixinput_ind=range(ntheta_real,ntheta_real+args.nspec)
-                allind=set(range(0,args.ntheta))
-                time_var_ind=list(allind.difference(set(fixinput_ind)))
-                initialvec_theta=(data[timeseq,:])[:,fixinput_ind]
-                #nsample*(nspec+1)
-                zerotime=np.repeat(0.0,nsample_loc).reshape(nsample_loc,-1)
-                initialvec=torch.tensor(np.concatenate((initialvec_theta,zerotime),axis=1)).float()
-                timevarinput=data[:,time_var_ind]
-                timevec=timevarinput[:,-1]
-                deltimevec=timevec[1::]-timevec[0:-1]
-                deltimevec=torch.cat((torch.tensor([0.0]),deltimevec),0)
-                deltimevec[deltimevec<0]=0
-                timevarinput=torch.cat((timevarinput,deltimevec.view(sizes[0],-1)),1)
-                #nsample*ntime*(ntheta-1-nspec)
-                timevarinput=timevarinput.view(nsample_loc,ntime,len(time_var_ind)+1)
-                # print('timevarinput{} initialvec{}'.format(timevarinput.shape,initialvec.shape))
+                modelinput=(data,)
+            else:##the hidden state runs through the extrapolation window
+                timevarinput,initialvec=rnn_input_reshape(data,args.ntheta,args.nspec,ntimetotal)
                 timevarinput,initialvec,target=timevarinput.to(device),initialvec.to(device),target.to(device)
-                output=model(timevarinput,initialvec)
+                modelinput=(timevarinput,initialvec)
+            
+            timedata=time.time()
+            with torch.autocast(device_type=device.type,dtype=ampdtype,enabled=ampdtype is not None):
+                output=evalmodel(*modelinput)
+            accum.update(output,target,trajind)
+            nbatch+=1
+            timeend=time.time()
+            teststat[0]+=len(target)
+            teststat[1]+=timedata-timeprev
+            teststat[2]+=timeend-timedata
+            timeprev=timeend
+    
+    if args.distributed==1:
+        accum.all_reduce()
+    
+    summary=accum.summary()
+    if args.rank==0:
+        print('\nTest set: Average loss (per sample): {:.4f}\n'.format(summary["loss"]))
+        if ntimetotal>ntime:
+            print('Extrapolation window: Average mse: {:.6f}\n'.format(summary["mse_extr"]))
+    
+    if metrics is not None:
+        metrics_row(metrics,phase,epoch,nbatch,summary["loss"],'',teststat)
+    
+    if summary_writer is not None:
+        summary_writer.write(phase,epoch,summary,traj=traj)
+    
+    return summary["loss"], summary
+
+def autocast_dtype(args,device):
+    ##low precision type of autocast for args.precision, None for float32
+    precision=getattr(args,'precision','fp32')
+    if precision=='fp32':
+        return None
+    elif precision=='bf16':
+        return torch.bfloat16
+    elif precision=='fp16':
+        if device.type!='cuda':
+            raise ValueError('fp16 precision needs a cuda device, use bf16 on cpu')
+        return torch.float16
+    
+    raise ValueError('unknown precision '+precision+', choices: fp32, fp16, bf16')
 
-            # test_loss += F.nll_loss(output,target,reduction='sum').item() # sum up batch loss
-            test_loss.append(F.mse_loss(output,target,reduction='mean').item()) # sum
-    test_loss_mean=sum(test_loss)/len(test_loss)
-    print('\nTest set: Average loss (per sample): {:.4f}\n'.format(test_loss_mean*ntime))
-    return test_loss_mean*ntime
+def metrics_row(metrics,phase,epoch,batch,loss,lr,stat):
+    ##one row of the metrics file, stat: [nsample, data time, compute time] of the batches in the row
+    runtime=stat[1]+stat[2]
+    metrics.write(phase=phase,epoch=epoch,batch=batch,loss=loss,lr=lr,nsample=stat[0],
+        samples_per_s=(stat[0]/runtime if runtime>0 else ''),data_time=stat[1],compute_time=stat[2])
+
+def loss_mean(losslist,args):
+    ##mean of the batch losses, over the batches of all processes in distributed training
+    if args.distributed==1:
+        losssum=torch.tensor([sum(losslist),len(losslist)],dtype=torch.float64)
+        dist.all_reduce(losssum)
+        return (losssum[0]/losssum[1]).item()
+    
+    return sum(losslist)/len(losslist)
 
 def parse_func_wrap(parser,termname,args_internal_dict):
     commandstring='--'+termname.replace("_","-")
@@ -195,54 +265,21 @@ def parse_func_wrap(parser,termname,args_internal_dict):
     
     return(parser)
 
-def save_checkpoint(state,is_best,is_best_train,filename='checkpoint.resnetode.tar'):
-    torch.save(state,filename)
-    if is_best:
-        shutil.copyfile(filename,'model_best.resnetode.tar')
-    
-    if is_best_train:
-        shutil.copyfile(filename,'model_best_train.resnetode.tar')
-
-class batch_sampler_block(Sampler):
-    """
-    user defined sampler to make sure random sampling blocks
-    default replacement=FALSE
-    default drop_last=FALSE
-    """
-    def __init__(self,datasource,blocks,nblock=1):
-        """
-            datasource: data set
-            blocks: block list
-            nblocks: number of block for each batch
+def rng_state_get():
+    ##python, numpy and torch (cpu and cuda) random states of the process
+    rngstate={"python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": (torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [])
+    }
+    return rngstate
 
-         EX code:
-         datasource=np.array([0,1,2,3,4,5,6,7,8,9])
-         blocks=np.array([0,0,1,1,2,2,3,3,4,4])
-         nblocks=2
-         list(batch_sampler_block(datasource,blocks,nblock=nblocks))
-        """
-        self.datasource=datasource
-        self.blocks=blocks
-        self.nblock=nblock
-        self.uniblocks=np.unique(self.blocks)
-        self.blocksize=int(len(self.datasource)/len(self.uniblocks))
-    
-    def __iter__(self):
-        n=len(self.uniblocks)
-        indreorder=torch.randperm(n).tolist()
-        batch=[]
-        for idx in indreorder:
-            indnew=list(range(idx*self.blocksize,(idx+1)*self.blocksize))
-            batch.append(indnew)
-            if len(batch)==self.nblock: ##number of block in each minibatch
-                yield flatten(batch)
-                batch=[]
-        
-        if len(batch) > 0:
-            yield flatten(batch)
-    
-    def __len__(self):
-        return self.nblock*self.blocksize
+def rng_state_set(rngstate):
+    random.setstate(rngstate["python"])
+    np.random.set_state(rngstate["numpy"])
+    torch.set_rng_state(rngstate["torch"])
+    if torch.cuda.is_available() and len(rngstate["cuda"])>0:
+        torch.cuda.set_rng_state_all(rngstate["cuda"])
 
 def get_lr(optimizer):#output the lr as scheduler is used
     for param_group in optimizer.param_groups:
@@ -289,57 +326,69 @@ def trans_lin_comb(data,target,args,ntime):
     """
     Data augmentation: produce new training sample
     doesn't follow the format of transformer as the function takes two sample and produce one sample
+    samples at the same time point form a group. in a group of k samples, floor(k*p) pairs (a,b) a!=b are drawn and sample b is replaced by
+    the random convex combination of a and b on theta and response
+    the batch is sorted by time once and the pairs of all groups are drawn and combined together by tensor operations (all pairs read the data before combination)
     """
     ntheta_real=args.ntheta-1-args.nspec
-    theta_ind=list(range(0,ntheta_real))
     timevec=data[:,-1]
-    unique_time,counts=np.unique(timevec,return_counts=True)
-    time_duplicated=unique_time[counts>1]
-    # nsamp=math.floor(time_duplicated.__len__()*args.linearcomb_transformp)
-    # seletimes=random.sample(range(0,len(time_duplicated)),nsamp)
-    for seletime_ind in range(0,len(time_duplicated)):
-        seletime=time_duplicated[seletime_ind]
-        dupmask=np.equal(np.array(timevec),np.array(seletime))
-        duploc=list(np.squeeze(np.where(dupmask)))
-        perm=list(permutations(set(range(0,len(duploc))),2))##pair permutations
-        nsamp_eachtime=math.floor(len(duploc)*args.linearcomb_transformp)##p percent of the number of time duplicated samples
-        seletperms=random.sample(range(0,len(perm)),nsamp_eachtime)
-        for permind in seletperms:
-            permpair=perm[permind]
-            duplocpair=[duploc[x] for x in list(permpair)]
-            a_ratio=random.uniform(0,1)
-            data[duplocpair[1],theta_ind]=data[duplocpair[0],theta_ind]*a_ratio+data[duplocpair[1],theta_ind]*(1.0-a_ratio)
-            target[duplocpair[1],:]=target[duplocpair[0],:]*a_ratio+target[duplocpair[1],:]*(1.0-a_ratio)
+    sorttime,timeorder=torch.sort(timevec)
+    unique_time,counts=torch.unique_consecutive(sorttime,return_counts=True)
+    groupstart=torch.cumsum(counts,0)-counts
+    nsamp_eachtime=torch.floor(counts.double()*args.linearcomb_transformp).long()##p percent of the number of time duplicated samples
+    nsamp_eachtime[counts<2]=0
+    groupind=torch.repeat_interleave(torch.arange(0,len(counts)),nsamp_eachtime)
+    npair=len(groupind)
+    if npair==0:
+        return data, target
     
+    ##pair (a,b) a!=b within the group
+    groupsize=counts[groupind]
+    firstind=torch.min((torch.rand(npair)*groupsize.float()).long(),groupsize-1)
+    secondind=torch.min((torch.rand(npair)*(groupsize-1).float()).long(),groupsize-2)
+    secondind=secondind+(secondind>=firstind).long()
+    firstrow=timeorder[groupstart[groupind]+firstind]
+    secondrow=timeorder[groupstart[groupind]+secondind]
+    a_ratio=torch.rand(npair,1)
+    data[secondrow,0:ntheta_real]=data[firstrow,0:ntheta_real]*a_ratio+data[secondrow,0:ntheta_real]*(1.0-a_ratio)
+    target[secondrow,:]=target[firstrow,:]*a_ratio+target[secondrow,:]*(1.0-a_ratio)
     return data, target
 
 def trans_time_shift(data,target,args,ntime):
     """
     Data augmentation: produce time shift sample
     doesn't follow the format of transformer
+    in each block (time series) floor(ntime*p) distinct pairs of time points are drawn, the later one in each pair is shifted to start from the earlier one:
+    time becomes the time difference (+mintime) and the initial condition becomes the response at the earlier time point
+    pairs of all blocks are drawn and applied together by tensor operations (all pairs read the data before shift)
     """
     inputsize=data.shape
     outputsize=target.shape
     nsample=inputsize[0]
     niteration=math.floor(nsample/ntime)
     nblocksamp=math.floor(ntime*args.timeshift_transformp)##for each block
-    ini_ind=list(range(inputsize[1]-1-outputsize[1],inputsize[1]-1))
-    for iteration in range(0,niteration):
-        blockinds=list(range(iteration*ntime,(iteration+1)*ntime))
-        perm=list(permutations(set(range(0,ntime)),2))##pair permutations
-        seleseq=random.sample(range(0,len(perm)),nblocksamp)
-        for seleele in seleseq:
-            currpair=perm[seleele]
-            currpairind=[blockinds[x] for x in currpair]
-            timevec=[data[x,-1] for x in currpairind]
-            ind_order=[0, 1]##[small big]
-            if timevec[0]>timevec[1]:
-                ind_order=[1, 0]
-            data[currpairind[ind_order[1]],-1]=timevec[ind_order[1]]-timevec[ind_order[0]]+args.mintime
-            data[currpairind[ind_order[1]],ini_ind]=target[currpairind[ind_order[0]],:]
+    if niteration==0 or nblocksamp==0:
+        return data, target
+    
+    ini_ind=torch.arange(inputsize[1]-1-outputsize[1],inputsize[1]-1)
+    ##pair code k in [0,ntime*(ntime-1)) for ordered pair (k//(ntime-1), the k%(ntime-1)th of the other time points), without replacement in each block
+    paircode=torch.rand(niteration,ntime*(ntime-1)).topk(nblocksamp,dim=1)[1]
+    firstind=paircode//(ntime-1)
+    secondind=paircode%(ntime-1)
+    secondind=secondind+(secondind>=firstind).long()
+    blockstart=(torch.arange(0,niteration)*ntime).view(niteration,1)
+    firstind=(firstind+blockstart).view(-1)
+    secondind=(secondind+blockstart).view(-1)
+    timevec=data[:,-1]
+    swapflag=timevec[firstind]>timevec[secondind]##[small big]
+    smallind=torch.where(swapflag,secondind,firstind)
+    bigind=torch.where(swapflag,firstind,secondind)
+    newtime=timevec[bigind]-timevec[smallind]+float(args.mintime)
+    data[bigind.view(-1,1),ini_ind.view(1,-1)]=target[smallind,:]
+    data[bigind,-1]=newtime
     return data, target
 
-def main():
+def args_parser():
     # Training settings load-in through command line
     parser=argparse.ArgumentParser(description='PyTorch Example')
     for key in args_internal_dict.keys():
@@ -348,6 +397,10 @@ def main():
     for key in fix_para_dict.keys():
         parser=parse_func_wrap(parser,key,fix_para_dict)
     
+    return parser
+
+def main():
+    parser=args_parser()
     args=parser.parse_args()
     if args.seed is not None:
         random.seed(args.seed)
@@ -370,7 +423,20 @@ def main():
     ## arg_transf=copy.deepcopy(args)
     ## arg_transf.ngpus_per_node=ngpus_per_node
     ## mp.spawn(main_worker,nprocs=ngpus_per_node,args=(ngpus_per_node,args))
+    if args.distributed==1:
+        ##torchrun set RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR and MASTER_PORT
+        dist.init_process_group(backend=args.dist_backend,init_method="env://")
+        args.rank=dist.get_rank()
+        args.world_size=dist.get_world_size()
+        args.local_rank=int(os.environ.get("LOCAL_RANK",0))
+    else:
+        args.rank=0
+        args.world_size=1
+        args.local_rank=0
+    
     main_worker(args.gpu,ngpus_per_node,args)
+    if args.distributed==1:
+        dist.destroy_process_group()
 
 def main_worker(gpu,ngpus_per_node,args):
     global best_acc1
@@ -383,14 +449,34 @@ def main_worker(gpu,ngpus_per_node,args):
     ## args.rank=args.rank*ngpus_per_node+gpu
     ## dist.init_process_group(backend=args.dist_backend,init_method="env://",#args.dist_url,
     ## world_size=args.world_size,rank=args.rank)
+    datadict=data_load(args)
+    split=None
+    if args.resume!="":##the separation of the resumed run
+        split=run_artifact_load(os.path.join(os.path.dirname(os.path.abspath(args.resume)),"run_artifact.h5"))
     
-    ##read the matlab matrix as Xvar and ResponseVar
+    datawrap=data_separation(args,datadict,split=split)
+    del(datadict)
+    train_run(args,datawrap,ngpus_per_node)
+
+def data_load(args):
+    """
+    read the matlab matrix as Xvar and ResponseVar (only the dimension in lazy_load) and the block information
+    """
     inputfile=args.inputfile
-    f=h5py.File(inputdir+inputfile,'r')
-    data=f.get('inputstore')
-    Xvar=np.array(data).transpose()
-    data=f.get('outputstore')
-    ResponseVar=np.array(data).transpose()
+    inputpath=os.path.abspath(inputdir+inputfile)
+    f=h5py.File(inputpath,'r')
+    if args.lazy_load==0:
+        data=f.get('inputstore')
+        Xvar=np.array(data).transpose()
+        data=f.get('outputstore')
+        ResponseVar=np.array(data).transpose()
+        datashape=(Xvar.shape,ResponseVar.shape)
+    else:
+        ##only the dimension, the matrices are read in training
+        Xvar=None
+        ResponseVar=None
+        datashape=(f['inputstore'].shape[::-1],f['outputstore'].shape[::-1])
+    
     data=f.get('samplevec')
     samplevec=np.array(data)
     samplevec=np.squeeze(samplevec.astype(int)-1)##block index
@@ -401,24 +487,52 @@ def main_worker(gpu,ngpus_per_node,args):
     data=f.get('ntime')
     ntimetotal=int(np.array(data)[0][0])##time seq including [training part, extrapolation part]
     f.close()
+    datadict={"inputfile": (inputfile),
+        "inputpath": (inputpath),
+        "Xvar": (Xvar),
+        "ResponseVar": (ResponseVar),
+        "datashape": (datashape),
+        "samplevec": (samplevec),
+        "nthetaset": (nthetaset),
+        "ntimetotal": (ntimetotal)
+    }
+    return datadict
+
+def data_separation(args,datadict,out=None,split=None):
+    """
+    separation of train, validate and test set (by the python random state) and normalization by the training set statistics
+    set args.mintime. Return the data and index used in training
+        datadict: result of data_load
+        out: array of the size of Xvar to store the normalized input. Default None (Xvar is normalized in place)
+        split: run information (run_artifact_load) of a previous run, its test and validation index are used instead of a new separation. Default None
+    """
+    Xvar=datadict["Xvar"]
+    ResponseVar=datadict["ResponseVar"]
+    datashape=datadict["datashape"]
+    samplevec=datadict["samplevec"]
+    nthetaset=datadict["nthetaset"]
+    ntimetotal=datadict["ntimetotal"]
     ntime=args.timetrainlen
     # ResponseVarnorm=(ResponseVar-ResponseVar.mean(axis=0))/ResponseVar.std(axis=0)
-    ResponseVarnorm=ResponseVar## the response variable was originally scale by omega {scaling} but not centered. and no more normalization will be done
+    ## the response variable was originally scale by omega {scaling} but not centered. and no more normalization will be done
     ##separation of train and test set
-    nsample=(Xvar.shape)[0]
-    ntheta=(Xvar.shape)[1]
-    nspec=(ResponseVarnorm.shape)[1]
+    nsample=datashape[0][0]
     simusamplevec=np.unique(samplevec)
     separation=['train','validate','test']
     numsamptest_validate=math.floor((simusamplevec.__len__())*args.test_validate_ratio/2)
     sampleind=set(range(0,nsample))
     simusampeind=set(range(0,nthetaset))
-    ## a preset whole time range for test, validation (groups)
-    simusamplevec_test=random.sample(simusampeind,numsamptest_validate)
-    simusamplevec_validate=random.sample(simusampeind.difference(set(simusamplevec_test)),numsamptest_validate)
-    ##index of training, testing, and validation
-    testind=np.sort(np.where(np.isin(samplevec,simusamplevec_test)))[0]
-    validateind=np.sort(np.where(np.isin(samplevec,simusamplevec_validate)))[0]
+    if split is None:
+        ## a preset whole time range for test, validation (groups), sampled from the sorted groups (random.sample does not take a set since python 3.11)
+        simusamplevec_test=random.sample(sorted(simusampeind),numsamptest_validate)
+        simusamplevec_validate=random.sample(sorted(simusampeind.difference(set(simusamplevec_test))),numsamptest_validate)
+        ##index of training, testing, and validation
+        testind=np.sort(np.where(np.isin(samplevec,simusamplevec_test)))[0]
+        validateind=np.sort(np.where(np.isin(samplevec,simusamplevec_validate)))[0]
+    else:
+        testind=np.asarray(split["testind"])
+        validateind=np.asarray(split["validateind"])
+    
     testvalidte_ind_union=set(testind)
     testvalidte_ind_union=testvalidte_ind_union.union(set(validateind))
     trainind=np.sort(np.array(list(sampleind.difference(testvalidte_ind_union))))#index for training set
@@ -436,31 +550,33 @@ def main_worker(gpu,ngpus_per_node,args):
 
     ##train validate test "block" ind
     samplevec_separa={x: samplevec[time_in_ind[x]] for x in separation}
-    Xvar_separa={x: Xvar[list(ind_separa[x]),:] for x in separation}
-    Xvarnorm=np.empty_like(Xvar)
-    # Xvar_norm_separa={}
-    if args.normalize_flag is 'Y':
-        ##the normalization if exist should be after separation of training and testing data to prevent leaking
-        ##normalization (X-mean)/sd
-        ##normalization include time. Train and test model need to have at least same range or same mean&sd for time
-        del(Xvar)
-        for x in separation:
-            Xvartemp=Xvar_separa[x]
-            meanvec=Xvartemp.mean(axis=0)
-            stdvec=Xvartemp.std(axis=0)
-            for coli in range(0,len(meanvec)):
-                Xvartemp[:,coli]=(Xvartemp[:,coli]-meanvec[coli])/stdvec[coli]
-            
-            # Xvar_norm_separa[x]=copy.deepcopy(temp_norm_mat)
-            Xvarnorm[list(ind_separa[x]),:]=copy.deepcopy(Xvartemp)
-        
+    ##the normalization if exist should use the training set statistics only to prevent leaking, the same (X-mean)/sd is applied to all sets
+    ##normalization include time. The statistics are stored in the checkpoint and used for new data in inference
+    if args.lazy_load==1:
+        ##streamed column statistics, applied to each batch when it is read
+        colstat=h5_column_stat(datadict["inputpath"],'inputstore',ind_separa["train"])
+    else:
+        Xvartrain=Xvar[trainind,:]
+        colstat={"mean": Xvartrain.mean(axis=0), "std": Xvartrain.std(axis=0), "min": Xvar.min(axis=0)}
+        del(Xvartrain)
+    
+    if args.lazy_load==0 and out is None:
+        out=Xvar
+    
+    if args.normalize_flag=='Y':
+        normstat={"mean": colstat["mean"], "std": colstat["std"]}
+        args.mintime=(colstat["min"][-1]-normstat["mean"][-1])/normstat["std"][-1]
+        if args.lazy_load==0:
+            np.subtract(Xvar,normstat["mean"],out=out)
+            np.divide(out,normstat["std"],out=out)
     else:
-        # Xvar_norm_separa={x: Xvar_separa[x] for x in separation}
-        Xvarnorm=np.copy(Xvar)
-        del(Xvar)
+        normstat=None
+        args.mintime=colstat["min"][-1]
+        if args.lazy_load==0 and out is not Xvar:
+            out[...]=Xvar
     
     #samplevecXX repeat id vector, XXind index vector
-    inputwrap={"Xvarnorm": (Xvarnorm),
+    datawrap={"Xvarnorm": (out),
         "ResponseVar": (ResponseVar),
         "trainind": (trainind),
         "testind": (testind),
@@ -469,23 +585,93 @@ def main_worker(gpu,ngpus_per_node,args):
         "time_in_ind": (time_in_ind),
         "time_extr_ind": (time_extr_ind),
         "samplevec": (samplevec),
-        # "samplewholeselec": (samplewholeselec),
         "samplevec_separa": (samplevec_separa),
-        # "Xvarmean": (Xvarmean),## these two value: Xvarmean, Xvarstd can be used for "new" test data not used in the original normalization
-        # "Xvarstd": (Xvarstd),
-        "inputfile": (inputfile),
-        "ngpus_per_node": (ngpus_per_node),## number of gpus
-        "numsamptest_validate": (numsamptest_validate),#number of testing samples
+        "normstat": (normstat),
+        "timeind": (timeind),
+        "numsamptest_validate": (numsamptest_validate),
+        "datashape": (datashape),
+        "ntimetotal": (ntimetotal),
+        "inputfile": (datadict["inputfile"]),
+        "inputpath": (datadict["inputpath"])
+    }
+    return datawrap
+
+def train_run(args,datawrap,ngpus_per_node):
+    """
+    train the model on the separated data of data_separation, the run information and checkpoints are stored in the current folder
+    """
+    Xvarnorm=datawrap["Xvarnorm"]
+    ResponseVar=datawrap["ResponseVar"]
+    trainind=datawrap["trainind"]
+    testind=datawrap["testind"]
+    validateind=datawrap["validateind"]
+    ind_separa=datawrap["ind_separa"]
+    time_in_ind=datawrap["time_in_ind"]
+    time_extr_ind=datawrap["time_extr_ind"]
+    samplevec=datawrap["samplevec"]
+    samplevec_separa=datawrap["samplevec_separa"]
+    normstat=datawrap["normstat"]
+    timeind=datawrap["timeind"]
+    numsamptest_validate=datawrap["numsamptest_validate"]
+    inputfile=datawrap["inputfile"]
+    inputpath=datawrap["inputpath"]
+    ntime=args.timetrainlen
+    ntimetotal=datawrap["ntimetotal"]
+    nsample=datawrap["datashape"][0][0]
+    ntheta=datawrap["datashape"][0][1]
+    nspec=datawrap["datashape"][1][1]
+    loadsplit=['train']##only the training split is batched by the loaders, the evaluated splits are read by Evalset
+    #samplevecXX repeat id vector, XXind index vector
+    ##only index and statistics are stored, the data can be recovered from the input file (path and hash) by the index and normstat
+    runarray={"trainind": (trainind),
+        "testind": (testind),
+        "validateind": (validateind),
+        "ind_separa": (ind_separa),
+        "time_in_ind": (time_in_ind),
+        "time_extr_ind": (time_extr_ind),
+        "samplevec": (samplevec),
+        "samplevec_separa": (samplevec_separa),
+        "normstat": (normstat),## mean and sd of the training set, used for "new" data not used in training
         "timeind": (timeind)
     }
-    with open("pickle_inputwrap.dat","wb") as f1:
-        pickle.dump(inputwrap,f1,protocol=4)##protocol=4 if there is error: cannot serialize a bytes object larger than 4 GiB
+    if args.rank==0:##one copy of the run information (and checkpoints) in the run folder
+        runattr={"inputfile": (inputfile),
+            "inputpath": (inputpath),
+            "inputhash": (file_sha256(inputpath)),
+            "seed": (args.seed if args.seed is not None else -1),
+            "ngpus_per_node": (ngpus_per_node),## number of gpus
+            "world_size": (args.world_size),## number of processes
+            "numsamptest_validate": (numsamptest_validate)#number of testing samples
+        }
+        run_artifact_save("run_artifact.h5",runarray,runattr)
+    
+    del(runarray)
     
-    del(inputwrap)
+    if args.lazy_load==1:
+        Dataset={x: dataset_h5_block(inputpath,time_in_ind[x],normstat) for x in loadsplit}
+    else:
+        Xtensor={x: torch.Tensor(Xvarnorm[list(time_in_ind[x]),:]) for x in loadsplit}
+        Resptensor={x: torch.Tensor(ResponseVar[list(time_in_ind[x]),:]) for x in loadsplit}
+        Dataset={x: utils.TensorDataset(Xtensor[x],Resptensor[x]) for x in loadsplit}
+    
+    ##whole time series (training and extrapolation window) of the evaluated splits
+    evalsplit=['validate','test']
+    if args.lazy_load==1:
+        Evalset={x: dataset_h5_block(inputpath,ind_separa[x],normstat) for x in evalsplit}
+    else:
+        Evalset={x: utils.TensorDataset(torch.Tensor(Xvarnorm[list(ind_separa[x]),:]),torch.Tensor(ResponseVar[list(ind_separa[x]),:])) for x in evalsplit}
+    
+    evaltraj={x: samplevec[ind_separa[x]][::ntimetotal] for x in evalsplit}
+    blocks_separa=samplevec_separa
+    if args.rnn_struct==1 and args.sampler=="block" and args.lazy_load==0 and args.timeshift_transformp==0.0 and args.linearcomb_transformp==0.0:
+        ##rnn input reshaped once, each item is a whole time series
+        for x in loadsplit:
+            timevarinput,initialvec=rnn_input_reshape(Xtensor[x],ntheta,nspec,ntime)
+            Dataset[x]=dataset_rnn_seq(timevarinput,initialvec,Resptensor[x].view(-1,ntime,nspec))
+        
+        blocks_separa={x: np.arange(0,len(Dataset[x])) for x in loadsplit}
+        del(Xtensor)
     
-    Xtensor={x: torch.Tensor(Xvarnorm[list(time_in_ind[x]),:]) for x in separation}
-    Resptensor={x: torch.Tensor(ResponseVar[list(time_in_ind[x]),:]) for x in separation}
-    Dataset={x: utils.TensorDataset(Xtensor[x],Resptensor[x]) for x in separation}
     # train_sampler=torch.utils.data.distributed.DistributedSampler(traindataset)
     nblock=int(args.batch_size/ntime)
     # nblocktest=int(args.test_batch_size/ntime)
@@ -494,18 +680,47 @@ def main_worker(gpu,ngpus_per_node,args):
     #
     # testdataloader=utils.DataLoader(testdataset,batch_size=args.test_batch_size,
     #     shuffle=False,num_workers=args.workers,pin_memory=True,sampler=test_sampler)
-    if args.sampler=="block": # block sampler
-        sampler={x: batch_sampler_block(Dataset[x],samplevec_separa[x],nblock=nblock) for x in separation}
-        dataloader={x: utils.DataLoader(Dataset[x],num_workers=args.workers,pin_memory=True,batch_sampler=sampler[x]) for x in separation}
+    if args.gpu_use==1:
+        device=torch.device("cuda:"+str(args.local_rank))#cpu
+        if args.distributed==1:
+            torch.cuda.set_device(device)
+    else:
+        device=torch.device("cpu")
+    
+    if args.distributed==1:## whole blocks sharded across processes, individual sampling as blocks of one row
+        if args.sampler=="block":
+            blocks_dist=blocks_separa
+            nblock_dist=max(1,nblock//args.world_size)
+        elif args.sampler=="individual":
+            blocks_dist={x: np.arange(0,len(Dataset[x])) for x in loadsplit}
+            nblock_dist=max(1,args.batch_size//args.world_size)
+        sampler={x: batch_sampler_block_dist(Dataset[x],blocks_dist[x],nblock=nblock_dist,num_replicas=args.world_size,rank=args.rank,seed=args.seed if args.seed is not None else 0) for x in loadsplit}
+        if args.lazy_load==1:
+            dataloader={x: utils.DataLoader(Dataset[x],batch_size=None,sampler=sampler[x],num_workers=args.workers,pin_memory=True) for x in loadsplit}
+        elif args.fast_loader==1:
+            dataloader={x: batch_loader_tensor(Dataset[x],batch_sampler=sampler[x],device=device) for x in loadsplit}
+        else:
+            dataloader={x: utils.DataLoader(Dataset[x],num_workers=args.workers,pin_memory=True,batch_sampler=sampler[x]) for x in loadsplit}
+    elif args.lazy_load==1:# each batch of index is read by one call of the lazy data set
+        if args.sampler=="block":
+            sampler={x: batch_sampler_block(Dataset[x],blocks_separa[x],nblock=nblock) for x in loadsplit}
+        elif args.sampler=="individual":
+            sampler={x: utils.BatchSampler(utils.RandomSampler(Dataset[x]),args.batch_size,drop_last=False) for x in loadsplit}
+        dataloader={x: utils.DataLoader(Dataset[x],batch_size=None,sampler=sampler[x],num_workers=args.workers,pin_memory=True) for x in loadsplit}
+    elif args.fast_loader==1:# whole split tensors on device, one index per batch
+        if args.sampler=="block":
+            sampler={x: batch_sampler_block(Dataset[x],blocks_separa[x],nblock=nblock) for x in loadsplit}
+            dataloader={x: batch_loader_tensor(Dataset[x],batch_sampler=sampler[x],device=device) for x in loadsplit}
+        elif args.sampler=="individual":
+            dataloader={x: batch_loader_tensor(Dataset[x],batch_size=args.batch_size,shuffle=True,device=device) for x in loadsplit}
+    elif args.sampler=="block": # block sampler
+        sampler={x: batch_sampler_block(Dataset[x],blocks_separa[x],nblock=nblock) for x in loadsplit}
+        dataloader={x: utils.DataLoader(Dataset[x],num_workers=args.workers,pin_memory=True,batch_sampler=sampler[x]) for x in loadsplit}
     elif args.sampler=="individual": #individual random sampler
-        dataloader={x: utils.DataLoader(Dataset[x],batch_size=args.batch_size,shuffle=True,num_workers=args.workers,pin_memory=True) for x in separation}
+        dataloader={x: utils.DataLoader(Dataset[x],batch_size=args.batch_size,shuffle=True,num_workers=args.workers,pin_memory=True) for x in loadsplit}
 
-    args.mintime=np.min(Xvarnorm[:,-1])
     ninnersize=int(args.layersize_ratio*ntheta)
     ##store data
-    with open("pickle_dataloader.dat","wb") as f1:
-        pickle.dump(dataloader,f1,protocol=4)
-    
     dimdict={
         "nsample": (nsample,int),
         "ntheta": (ntheta,int),
@@ -515,17 +730,17 @@ def main_worker(gpu,ngpus_per_node,args):
     args.nsample=nsample
     args.ntheta=ntheta
     args.nspec=nspec
-    with open("pickle_dimdata.dat","wb") as f3:
-        pickle.dump(dimdict,f3,protocol=4)
+    if args.rank==0:
+        with open("pickle_dimdata.dat","wb") as f3:
+            pickle.dump(dimdict,f3,protocol=4)
     
     ##free up some space (not currently set)
     ##create model
-    if bool(re.search("[rR]es[Nn]et",args.net_struct)):
-        model=models.__dict__[args.net_struct](ninput=ntheta,num_response=nspec,p=args.p,ncellscale=args.layersize_ratio)
-    elif args.rnn_struct==1:
-        model=models.__dict__[args.net_struct](ntheta=ntheta,nspec=nspec,num_layer=args.num_layer,ncellscale=args.layersize_ratio,p=args.p)
-    else:
-        model=models.__dict__[args.net_struct](ninput=ntheta,num_response=nspec,nlayer=args.num_layer,p=args.p,ncellscale=args.layersize_ratio,batchnorm_flag=(args.batchnorm_flag is 'Y'))
+    model=build_model(args,ntheta,nspec)
+    if args.compile==1:##compiled in place (the checkpoint keys are the same as eager mode), tried on a small input on the training device
+        model.to(device)
+        model=models.compile_model(model,example_input=example_input(args,ntheta,nspec,ntime,device=device))
+    
     
     # model.eval()
     # if args.gpu is not None:
@@ -542,13 +757,12 @@ def main_worker(gpu,ngpus_per_node,args):
     # available GPUs if device_ids are not set
     
     # model=torch.nn.DataParallel(model).cuda()
-    model=torch.nn.DataParallel(model)
-    if args.gpu_use==1:
-        device=torch.device("cuda:0")#cpu
+    if args.distributed==1:##the parameters are broadcast from rank 0, state_dict keys start with 'module.' as in DataParallel
+        model.to(device)
+        model=torch.nn.parallel.DistributedDataParallel(model,device_ids=([args.local_rank] if device.type=="cuda" else None))
     else:
-        device=torch.device("cpu")
-    
-    model.to(device)
+        model=torch.nn.DataParallel(model)
+        model.to(device)
     if args.optimizer=="sgd":
         optimizer=optim.SGD(model.parameters(),lr=args.learning_rate,momentum=args.momentum)
     elif args.optimizer=="adam":
@@ -565,11 +779,49 @@ def main_worker(gpu,ngpus_per_node,args):
     else:
         scheduler=None
     
+    ##loss scaling of fp16 gradients, no operation for other precisions (unsupported precisions raise before training)
+    ampdtype=autocast_dtype(args,device)
+    scaler=torch.amp.GradScaler(device.type,enabled=ampdtype==torch.float16)
     cudnn.benchmark=True
+    start_epoch=1
+    if args.resume!="":##continue from the end of the epoch of the checkpoint
+        loaddic=torch.load(args.resume,map_location='cpu',weights_only=False)
+        if loaddic['arch']!=args.net_struct:
+            raise ValueError('the checkpoint '+args.resume+' is of '+loaddic['arch']+', not '+args.net_struct)
+        
+        model.load_state_dict(loaddic['state_dict'])
+        optimizer.load_state_dict(loaddic['optimizer'])
+        if scheduler is not None and loaddic.get('scheduler') is not None:
+            scheduler.load_state_dict(loaddic['scheduler'])
+        if loaddic.get('scaler'):
+            scaler.load_state_dict(loaddic['scaler'])
+        
+        best_msevalidate=loaddic['best_acc1']
+        best_train_mse=loaddic['best_acctr']
+        start_epoch=loaddic['epoch']+1
+        if args.rank==0:
+            print('resume from {} (epoch {})'.format(args.resume,loaddic['epoch']))
+    
+    ##checkpoints written by the process of rank 0 in a background thread
+    checkpoints=checkpoint_manager(keep_last=args.keep_checkpoint,save_interval=args.save_interval,async_write=(args.async_checkpoint==1),
+                                   scan_existing=(args.resume!="")) if args.rank==0 else None
+    ##metrics of the process of rank 0, a continued run drops the rows of epochs after the checkpoint (written before the interruption)
+    metrics=metrics_writer(args.metrics_file,mode=('a' if args.resume!="" else 'w'),last_epoch=start_epoch-1) if args.rank==0 and args.metrics_file!="" else None
+    summary_writer=eval_summary_writer(args.eval_summary_file,mode=('a' if args.resume!="" else 'w'),last_epoch=start_epoch-1) if args.rank==0 and args.eval_summary_file!="" else None
+    if args.resume!="":##random states of each process at the end of the epoch, the following epochs are the same as in the uninterrupted run
+        rngstate=loaddic['rng_state']
+        rng_state_set(rngstate[args.rank] if args.rank<len(rngstate) else rngstate[0])
+        del(loaddic)
+    
     ##model training
-    for epoch in range(1,args.epochs+1):
-        msetr=train(args,model,dataloader["train"],optimizer,epoch,device,ntime,scheduler)
-        msevalidate=test(args,model,dataloader["validate"],device,ntime)
+    for epoch in range(start_epoch,args.epochs+1):
+        if args.distributed==1:
+            for x in loadsplit:
+                sampler[x].set_epoch(epoch)
+        
+        msetr=train(args,model,dataloader["train"],optimizer,epoch,device,ntime,scheduler,metrics=metrics,scaler=scaler)
+        msevalidate,_=evaluate(args,model,Evalset["validate"],device,ntime,ntimetotal,metrics=metrics,phase='validate',epoch=epoch,
+                               summary_writer=summary_writer,traj=evaltraj["validate"])
         if scheduler is not None:
             if args.scheduler=='step':
                 scheduler.step()
@@ -584,18 +836,40 @@ def main_worker(gpu,ngpus_per_node,args):
         is_best_train=msetr<best_train_mse
         best_msevalidate=min(msevalidate,best_msevalidate)
         best_train_mse=min(msetr,best_train_mse)
-        save_checkpoint({
+        rngstate=[rng_state_get()]
+        if args.distributed==1:
+            rngstate=[None]*args.world_size
+            dist.all_gather_object(rngstate,rng_state_get())
+        
+        if args.rank!=0:
+            continue
+        
+        checkpoints.save({
             'epoch': epoch,
             'arch': args.net_struct,
             'state_dict': model.state_dict(),
             'best_acc1': best_msevalidate,
             'best_acctr': best_train_mse,
             'optimizer': optimizer.state_dict(),
+            'scaler': scaler.state_dict(),
+            'scheduler': (scheduler.state_dict() if scheduler is not None else None),
+            'rng_state': rngstate,## random states of each process
             'args_input': args,
-        },is_best,is_best_train)
+            'normstat': normstat,
+        },epoch,is_best=is_best,is_best_train=is_best_train,force=(epoch==args.epochs))
+    
+    if args.rank==0:
+        checkpoints.close()
+        print('\nFinal test MSE\n')
+    
+    acctest,_=evaluate(args,model,Evalset["test"],device,ntime,ntimetotal,metrics=metrics,phase='test',epoch=args.epochs,
+                       summary_writer=summary_writer,traj=evaltraj["test"])
+    if metrics is not None:
+        metrics.close()
+    if summary_writer is not None:
+        summary_writer.close()
     
-    print('\nFinal test MSE\n')
-    acctest=test(args,model,dataloader["test"],device,ntime)
+    return acctest
 
 if __name__ == '__main__':
     main()
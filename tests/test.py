@@ -12,6 +12,8 @@ import matplotlib.pyplot as plt
 import random
 import numpy as np
 import warnings
+import math
+import json
 
 import torch.optim as optim
 
@@ -29,10 +31,10 @@ sys.path.insert(0,prepath+'/output/project/')##use absolute path
 projresdir=projdir+"result/"
 projresdir_1=projresdir+"1/"
 projdatadir=projdir+"data/"
-codefilelist=['nnt_struc.py','plot_model_small.py','plot.mse.epoch.small.r','train_mlp_full_modified.py']
+codefilelist=['nnt_struc.py','plot_model_small.py','plot.mse.epoch.small.r','train_mlp_full_modified.py','linearodesimu.py','data_struc.py','nnt_predict.py','sweep_runner.py','metrics_log.py','nnt_quantize.py','checkpoint_manager.py','nnt_evaluate.py','nnt_benchmark.py']
 runinputlist='sparselinearode_new.small.stepwiseadd.mat'
-runoutputlist=['pickle_traindata.dat','pickle_testdata.dat','pickle_inputwrap.dat','pickle_dimdata.dat','model_best.resnetode.tar','model_best_train.resnetode.tar','checkpoint.resnetode.tar','testmodel.1.out']
-runcodelist=['train_mlp_full_modified.py','nnt_struc.py']
+runoutputlist=['pickle_traindata.dat','pickle_testdata.dat','run_artifact.h5','pickle_dimdata.dat','model_best.resnetode.tar','model_best_train.resnetode.tar','checkpoint.resnetode.tar','testmodel.1.out','metrics.csv','eval_summary.h5']
+runcodelist=['train_mlp_full_modified.py','nnt_struc.py','data_struc.py','nnt_predict.py','sweep_runner.py','metrics_log.py','nnt_quantize.py','checkpoint_manager.py','nnt_evaluate.py','nnt_benchmark.py']
 runcodetest='test.sh'
 # plotdata_py='plotsave.dat'
 plotdata_r='Rplot_store.RData'
@@ -181,31 +183,32 @@ class NNTODETest(unittest.TestCase):
         test value and dimension of the training script on a small run
         '''
         try:
-            #dimension of output and input
-            with open(projresdir_1+runoutputlist[2],"rb") as f1:
-                currstore=pickle.load(f1)
-            with open(test_input+runoutputlist[2],"rb") as f1:
-                prestore=pickle.load(f1)
-            print("Xvarnorm_size %s ResponseVar_size %s\n" % (currstore['Xvarnorm'].shape,currstore['ResponseVar'].shape,))
-            if currstore['Xvarnorm'].shape==prestore['Xvarnorm'].shape and currstore['ResponseVar'].shape==prestore['ResponseVar'].shape:
+            from data_struc import run_artifact_load
+            #dimension of the stored index
+            currstore=run_artifact_load(projresdir_1+runoutputlist[2])
+            prestore=run_artifact_load(test_input+runoutputlist[2])
+            print("samplevec_size %s trainind_size %s\n" % (currstore['samplevec'].shape,currstore['trainind'].shape,))
+            if currstore['samplevec'].shape==prestore['samplevec'].shape and currstore['trainind'].shape==prestore['trainind'].shape:
                 dimequal=True
             else:
                 dimequal=False
-            #value of stored data
-            inputwrap_true=True
+            #value of stored data (the input path depends on the run folder)
+            inputwrap_true=currstore['attrs']['inputhash']==prestore['attrs']['inputhash'] and currstore['attrs']['seed']==prestore['attrs']['seed']
             for key in currstore.keys():
-                boolarray=currstore[key]==prestore[key]
-                if type(boolarray)!=bool:
-                    boolarray=boolarray.all()
-                inputwrap_true=inputwrap_true and boolarray
+                if key=='attrs':
+                    continue
+                currdict=currstore[key] if isinstance(currstore[key],dict) else {key: currstore[key]}
+                predict=prestore[key] if isinstance(prestore[key],dict) else {key: prestore[key]}
+                for subkey in currdict.keys():
+                    inputwrap_true=inputwrap_true and np.array_equal(currdict[subkey],predict[subkey])
             with open(projresdir_1+runoutputlist[3],"rb") as f1:
                 currstore=pickle.load(f1)
             with open(test_input+runoutputlist[3],"rb") as f1:
                 prestore=pickle.load(f1)
             dimdict_true=currstore==prestore
             device=torch.device('cpu')
-            currstore=torch.load(projresdir_1+runoutputlist[6],map_location=device)
-            prestore=torch.load(test_input+runoutputlist[6],map_location=device)
+            currstore=torch.load(projresdir_1+runoutputlist[6],map_location=device,weights_only=False)
+            prestore=torch.load(test_input+runoutputlist[6],map_location=device,weights_only=False)
             ## as new keys will be added to args in future version
             currarg=currstore['args_input'].__dict__
             prearg=prestore['args_input'].__dict__
@@ -249,7 +252,7 @@ class NNTODETest(unittest.TestCase):
             blocks=np.array([0,0,1,1,2,2,3,3,4,4])
             nblocks=2
             exp_res=[[0,1,8,9],[4,5,6,7],[2,3]]
-            test_res=list(batch_sampler_block(datasource,blocks,nblock=nblocks))
+            test_res=[batch.tolist() for batch in batch_sampler_block(datasource,blocks,nblock=nblocks)]
             if test_res==exp_res:
                 self.assertTrue(True)
             else:
@@ -257,6 +260,131 @@ class NNTODETest(unittest.TestCase):
         except:
             self.assertTrue(False)
 
+    def test_sampler_block_len(self):
+        try:
+            from data_struc import batch_sampler_block
+            torch.manual_seed(1)
+            datasource=np.arange(0,9)
+            blocks=np.array([0,0,0,1,2,2,3,3,3])
+            sampler=batch_sampler_block(datasource,blocks,nblock=3)
+            test_res=[batch.tolist() for batch in sampler]
+            ##variable length blocks, each index exactly once, whole blocks in batch
+            allind=sorted(sum(test_res,[]))
+            blockwhole=all([len(batch)==np.isin(blocks,blocks[batch]).sum() for batch in test_res])
+            sampler_drop=batch_sampler_block(datasource,blocks,nblock=3,drop_last=True)
+            test_res_drop=list(sampler_drop)
+            if allind==list(range(0,9)) and blockwhole and len(sampler)==2 and len(test_res)==2 and len(sampler_drop)==1 and len(test_res_drop)==1:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_sampler_block_dist(self):
+        try:
+            from data_struc import batch_sampler_block_dist
+            datasource=np.arange(0,9)
+            blocks=np.array([0,0,0,1,2,2,3,3,3])
+            samplers=[batch_sampler_block_dist(datasource,blocks,nblock=1,num_replicas=3,rank=rank,seed=1) for rank in range(0,3)]
+            test_res=[[batch.tolist() for batch in sampler] for sampler in samplers]
+            ##4 blocks on 3 processes: padded to 2 blocks each, all blocks covered
+            allind=set(sum(sum(test_res,[]),[]))
+            lenequal=all([len(sampler)==2 and len(res)==2 for sampler, res in zip(samplers,test_res)])
+            for sampler in samplers:
+                sampler.set_epoch(1)
+            test_res_epoch=[[batch.tolist() for batch in sampler] for sampler in samplers]
+            if allind==set(range(0,9)) and lenequal and test_res_epoch!=test_res:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_batch_loader_tensor(self):
+        try:
+            import torch.utils.data as utils
+            from data_struc import batch_sampler_block, batch_loader_tensor
+            Xtensor=torch.randn(20,3)
+            Resptensor=torch.randn(20,2)
+            dataset=utils.TensorDataset(Xtensor,Resptensor)
+            blocks=np.repeat(np.arange(0,5),4)
+            torch.manual_seed(1)
+            blockbatch=[batch for batch in batch_sampler_block(dataset,blocks,nblock=2)]
+            torch.manual_seed(1)
+            loader=batch_loader_tensor(dataset,batch_sampler=batch_sampler_block(dataset,blocks,nblock=2),device=torch.device('cpu'))
+            blockequal=len(loader)==3
+            for batch, (data,target) in zip(blockbatch,loader):
+                blockequal=blockequal and torch.equal(data,Xtensor[batch]) and torch.equal(target,Resptensor[batch])
+            loader=batch_loader_tensor(dataset,batch_size=6,shuffle=True)
+            datalist=[data for data, target in loader]
+            indiequal=len(loader)==4 and [len(data) for data in datalist]==[6,6,6,2] and torch.equal(torch.sort(torch.cat(datalist)[:,0])[0],torch.sort(Xtensor[:,0])[0])
+            if blockequal and indiequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_trans_time_shift(self):
+        try:
+            import argparse
+            from train_mlp_full_modified import trans_time_shift
+            torch.manual_seed(1)
+            ntime=11
+            nblock=6
+            nspec=2
+            args=argparse.Namespace(timeshift_transformp=0.3,mintime=-1.0)
+            data=torch.randn(ntime*nblock,4+nspec+1)
+            data[:,-1]=torch.arange(0,ntime).float().repeat(nblock)
+            target=torch.randn(ntime*nblock,nspec)
+            datanew,targetnew=trans_time_shift(data.clone(),target.clone(),args,ntime)
+            changed=torch.nonzero((datanew!=data).any(1)).view(-1).tolist()
+            shiftequal=len(changed)>0 and len(changed)<=nblock*math.floor(ntime*0.3) and torch.equal(targetnew,target)
+            for row in changed:
+                ##the shifted row start from an earlier time point in the same block
+                smallrow=int(row-(datanew[row,-1]-args.mintime))
+                shiftequal=shiftequal and smallrow//ntime==row//ntime and smallrow<row
+                shiftequal=shiftequal and torch.equal(datanew[row,4:(4+nspec)],target[smallrow,:]) and torch.equal(datanew[row,0:4],data[row,0:4])
+            if shiftequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_trans_lin_comb(self):
+        try:
+            import argparse
+            from train_mlp_full_modified import trans_lin_comb
+            torch.manual_seed(1)
+            ntime=5
+            nblock=8
+            nspec=2
+            args=argparse.Namespace(linearcomb_transformp=0.5,ntheta=3+nspec+1,nspec=nspec)
+            data=torch.randn(ntime*nblock,3+nspec+1).double()
+            data[:,-1]=torch.arange(0,ntime).double().repeat(nblock)
+            target=torch.randn(ntime*nblock,nspec).double()
+            datanew,targetnew=trans_lin_comb(data.clone(),target.clone(),args,ntime)
+            changed=torch.nonzero((datanew!=data).any(1)).view(-1).tolist()
+            combequal=len(changed)>0 and len(changed)<=ntime*math.floor(nblock*0.5) and torch.equal(datanew[:,3:],data[:,3:])
+            for row in changed:
+                ##convex combination with another sample at the same time point
+                combfound=False
+                for rowa in torch.nonzero(data[:,-1]==data[row,-1]).view(-1).tolist():
+                    if rowa==row:
+                        continue
+                    a_ratio=(datanew[row,0]-data[row,0])/(data[rowa,0]-data[row,0])
+                    combdata=data[rowa,0:3]*a_ratio+data[row,0:3]*(1.0-a_ratio)
+                    combtarget=target[rowa,:]*a_ratio+target[row,:]*(1.0-a_ratio)
+                    combfound=combfound or (0<=a_ratio<=1 and torch.allclose(combdata,datanew[row,0:3]) and torch.allclose(combtarget,targetnew[row,:]))
+                combequal=combequal and combfound
+            if combequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
     def test_resnet2x(self):
         try:
             import nnt_struc as models
@@ -307,8 +435,8 @@ class NNTODETest(unittest.TestCase):
                 predata=datalist[struc_i]
                 os.system(commands[0]+struc+commands[1])
                 device=torch.device('cpu')
-                currstore=torch.load(rnncheckfold_run+runoutputlist[6],map_location=device)
-                prestore=torch.load(rnn_comp_data+predata,map_location=device)
+                currstore=torch.load(rnncheckfold_run+runoutputlist[6],map_location=device,weights_only=False)
+                prestore=torch.load(rnn_comp_data+predata,map_location=device,weights_only=False)
                 curr_state_dict=currstore['state_dict']
                 pre_state_dict=prestore['state_dict']
                 for layer in curr_state_dict.keys():
@@ -320,6 +448,722 @@ class NNTODETest(unittest.TestCase):
         except:
             self.assertTrue(False)
     
+    def test_linearodesimu(self):
+        try:
+            import h5py
+            from linearodesimu import simulate
+            simufile=[test_output+'simu_1.mat',test_output+'simu_2.mat']
+            simulate(simufile[0],nthetaset=10,timerang=(0.0,0.1),stepsize=0.001,seed=1,ndim=3,chunksize=4,workers=1)
+            simulate(simufile[1],nthetaset=10,timerang=(0.0,0.1),stepsize=0.001,seed=1,ndim=3,chunksize=4,workers=2)
+            f1=h5py.File(simufile[0],'r')
+            f2=h5py.File(simufile[1],'r')
+            ##same result with different number of processes
+            seedequal=all([np.array_equal(f1[key][()],f2[key][()]) for key in f1.keys()])
+            Xvar=np.array(f1.get('inputstore')).transpose()
+            ResponseVar=np.array(f1.get('outputstorepre')).transpose()
+            exisind=np.squeeze(np.array(f1.get('exisind')).astype(int)-1)
+            ntime=int(np.array(f1.get('ntime'))[0][0])
+            ntheta=len(exisind)
+            shapeequal=Xvar.shape==(10*ntime,ntheta*2+3*2+1) and ResponseVar.shape==(10*ntime,3*2) and f1['samplevec'].shape==(10*ntime,1)
+            ##dY/dt=HY by finite difference
+            hvec=Xvar[0,0:ntheta]+Xvar[0,ntheta:(ntheta*2)]*1j
+            hmat=np.zeros((3,3),dtype=complex)
+            hmat[exisind%3,exisind//3]=hvec
+            yvec=ResponseVar[0:ntime,0:3]+ResponseVar[0:ntime,3:6]*1j
+            yini=Xvar[0,(ntheta*2):(ntheta*2+3)]+Xvar[0,(ntheta*2+3):(ntheta*2+6)]*1j
+            inieuqal=np.allclose(yvec[0,:],yini)
+            dydt=(yvec[2:,:]-yvec[:-2,:])/0.002
+            odeequal=np.allclose(dydt,yvec[1:-1,:]@hmat.T,atol=1e-4)
+            f1.close()
+            f2.close()
+            if seedequal and shapeequal and inieuqal and odeequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_dataset_h5_block(self):
+        try:
+            import h5py
+            from data_struc import dataset_h5_block, h5_column_stat
+            f=h5py.File(test_input+runinputlist,'r')
+            Xvar=np.array(f.get('inputstore')).transpose()
+            ResponseVar=np.array(f.get('outputstore')).transpose()
+            f.close()
+            rowind=np.concatenate((np.arange(21,42),np.arange(105,126),np.arange(0,21)))
+            colstat=h5_column_stat(test_input+runinputlist,'inputstore',rowind,nreadrow=10)
+            statequal=np.allclose(colstat['mean'],Xvar[rowind,:].mean(axis=0)) and np.allclose(colstat['std'],Xvar[rowind,:].std(axis=0))
+            dataset=dataset_h5_block(test_input+runinputlist,rowind,colstat)
+            batchind=list(range(42,63))+list(range(0,21))
+            data,target=dataset[batchind]
+            Xnorm=(Xvar[rowind[batchind],:]-Xvar[rowind,:].mean(axis=0))/Xvar[rowind,:].std(axis=0)
+            dataequal=np.allclose(data.numpy(),Xnorm,atol=1e-6) and np.allclose(target.numpy(),ResponseVar[rowind[batchind],:],atol=1e-6)
+            rowequal=np.allclose(dataset[5][1].numpy(),ResponseVar[rowind[5],:],atol=1e-6)
+            if statequal and dataequal and rowequal and len(dataset)==len(rowind):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_rnn_input_reshape(self):
+        try:
+            from train_mlp_full_modified import rnn_input_reshape
+            from data_struc import dataset_rnn_seq
+            ntime=4
+            nspec=2
+            ntheta=3+nspec+1
+            data=torch.randn(ntime*3,ntheta)
+            data[:,-1]=torch.Tensor([0.0,0.5,1.5,3.0]).repeat(3)
+            target=torch.randn(ntime*3,nspec)
+            timevarinput,initialvec=rnn_input_reshape(data,ntheta,nspec,ntime)
+            shapeequal=timevarinput.shape==(3,ntime,3+1+1) and initialvec.shape==(3,nspec+1)
+            iniequal=torch.equal(initialvec[:,0:nspec],data[0::ntime,3:(3+nspec)]) and torch.equal(initialvec[:,-1],torch.zeros(3))
+            thetaequal=torch.equal(timevarinput[:,:,0:3].reshape(-1,3),data[:,0:3]) and torch.equal(timevarinput[:,:,3].reshape(-1),data[:,-1])
+            deltequal=torch.equal(timevarinput[1,:,-1],torch.Tensor([0.0,0.5,1.0,1.5]))
+            dataset=dataset_rnn_seq(timevarinput,initialvec,target.view(-1,ntime,nspec))
+            (timevarbatch,inibatch),targetbatch=dataset[torch.LongTensor([2,0])]
+            batchequal=torch.equal(targetbatch,torch.cat((target[8:12,:],target[0:4,:]))) and torch.equal(inibatch,initialvec[[2,0],:]) and len(dataset)==3
+            if shapeequal and iniequal and thetaequal and deltequal and batchequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_rnn_forward_seq(self):
+        try:
+            import nnt_struc as models
+            torch.manual_seed(1)
+            ntime=5
+            nspec=4
+            ntheta=11
+            x=torch.randn(3,ntime,ntheta-nspec+1)
+            initialvec=torch.randn(3,nspec+1)
+            testres=[]
+            for modelname in ['gru_rnn','gru_mlp_rnn','diffaddcell_rnn']:
+                model=models.__dict__[modelname](ntheta=ntheta,nspec=nspec,num_layer=1,ncellscale=1.0)
+                model.eval()
+                ##reference step by step loop
+                hn=model.inputlay(initialvec)
+                outs=[]
+                for seq in range(ntime):
+                    hn=model.rnncell(x[:,seq,:],hn)
+                    outs.append(model.outputlay(hn))
+                outref=torch.stack(outs,1).reshape(3*ntime,-1)
+                out=model(x,initialvec)
+                ##the state_dict can be loaded back
+                model.load_state_dict(model.state_dict())
+                testres.append(out.shape==(3*ntime,nspec) and torch.allclose(out,outref,atol=1e-5))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_nnt_predictor(self):
+        try:
+            import argparse
+            from nnt_predict import build_model, nnt_predictor
+            from data_struc import rnn_input_reshape
+            torch.manual_seed(1)
+            ntime=5
+            nspec=4
+            ntheta=11
+            ntraj=7
+            theta=torch.randn(ntraj,ntheta-nspec-1)
+            initialvec=torch.randn(ntraj,nspec)
+            timeseq=torch.arange(0,ntime)*0.1
+            rows=torch.cat((theta.repeat_interleave(ntime,0),initialvec.repeat_interleave(ntime,0),timeseq.repeat(ntraj).view(-1,1)),1)
+            normstat={"mean": rows.mean(0).numpy(), "std": rows.std(0).numpy()+1.0}
+            rowsnorm=(rows-torch.Tensor(normstat["mean"]))/torch.Tensor(normstat["std"])
+            testres=[]
+            for net_struct, rnn_struct in [('mlp_mod',0),('gru_rnn',1)]:
+                args=argparse.Namespace(net_struct=net_struct,rnn_struct=rnn_struct,num_layer=2,p=0.0,layersize_ratio=1.0,batchnorm_flag='Y',
+                                        ntheta=ntheta,nspec=nspec,timetrainlen=ntime,normalize_flag='Y')
+                model=torch.nn.DataParallel(build_model(args,ntheta,nspec))
+                model.eval()
+                with torch.no_grad():
+                    if rnn_struct==1:
+                        outref=model(*rnn_input_reshape(rowsnorm,ntheta,nspec,ntime))
+                    else:
+                        outref=model(rowsnorm)
+                ##batch of 2 trajectories to test the batching
+                predictor=nnt_predictor({'args_input': args,'state_dict': model.state_dict()},normstat=normstat,batch_size=2*ntime)
+                out=predictor.predict(theta,initialvec,timeseq)
+                outrows=predictor.predict_rows(rowsnorm,normalize=False)
+                testres.append(out.shape==(ntraj,ntime,nspec) and torch.allclose(out.view(-1,nspec),outref,atol=1e-5) and torch.allclose(outrows,outref,atol=1e-5))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_predictor_after_train(self):
+        try:
+            import argparse
+            from nnt_predict import build_model, nnt_predictor
+            from data_struc import rnn_input_reshape
+            torch.manual_seed(1)
+            ntime=5
+            nspec=4
+            ntheta=11
+            ntraj=6
+            theta=torch.randn(ntraj,ntheta-nspec-1)
+            initialvec=torch.randn(ntraj,nspec)
+            timeseq=torch.arange(0,ntime)*0.1
+            rows=torch.cat((theta.repeat_interleave(ntime,0),initialvec.repeat_interleave(ntime,0),timeseq.repeat(ntraj).view(-1,1)),1)
+            testres=[]
+            ##the TorchScript cells are run with autograd (training step) before the prediction in the same process
+            for net_struct in ['diffaddcell_rnn','gru_mlp_rnn']:
+                args=argparse.Namespace(net_struct=net_struct,rnn_struct=1,num_layer=2,p=0.0,layersize_ratio=1.0,batchnorm_flag='Y',
+                                        ntheta=ntheta,nspec=nspec,timetrainlen=ntime,normalize_flag='N')
+                model=build_model(args,ntheta,nspec)
+                optimizer=torch.optim.Adam(model.parameters(),lr=1e-3)
+                for _ in range(3):
+                    loss=torch.nn.functional.mse_loss(model(*rnn_input_reshape(rows,ntheta,nspec,ntime)),torch.randn(ntraj*ntime,nspec))
+                    optimizer.zero_grad()
+                    loss.backward()
+                    optimizer.step()
+                predictor=nnt_predictor({'args_input': args,'state_dict': model.state_dict()},batch_size=2*ntime)
+                out=predictor.predict(theta,initialvec,timeseq)
+                outrows=predictor.predict_rows(rows)
+                model.eval()
+                with torch.no_grad():
+                    outref=model(*rnn_input_reshape(rows,ntheta,nspec,ntime))
+                testres.append(out.shape==(ntraj,ntime,nspec) and torch.allclose(out.view(-1,nspec),outref,atol=1e-5) and torch.allclose(outrows,outref,atol=1e-5))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_run_artifact(self):
+        try:
+            from data_struc import run_artifact_save, run_artifact_load, file_sha256
+            filename=test_output+'run_artifact_test.h5'
+            ind_separa={"train": np.arange(0,8), "validate": np.arange(8,10), "test": np.arange(10,12)}
+            normstat={"mean": np.array([0.5,1.0]), "std": np.array([2.0,3.0])}
+            run_artifact_save(filename,{"ind_separa": ind_separa,"normstat": normstat,"samplevec": np.repeat(np.arange(0,4),3),"timeind": None},
+                              {"inputpath": test_input+runinputlist,"inputhash": file_sha256(test_input+runinputlist),"seed": 1})
+            store=run_artifact_load(filename,checkinput=True)
+            storemmap=run_artifact_load(filename,mmap=True)
+            indequal=all([np.array_equal(store["ind_separa"][x],ind_separa[x]) for x in ind_separa.keys()])
+            statequal=np.array_equal(storemmap["normstat"]["std"],normstat["std"]) and np.array_equal(storemmap["samplevec"],np.repeat(np.arange(0,4),3))
+            attrequal=store["attrs"]["seed"]==1 and "timeind" not in store.keys()
+            os.unlink(filename)
+            if indequal and statequal and attrequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_sweep_runner(self):
+        try:
+            import pandas as pd
+            import sweep_runner
+            from train_mlp_full_modified import args_parser
+            infortab=pd.read_csv(test_input+plotsourctab,sep="\t",header=0)
+            args=sweep_runner.row_args(infortab.iloc[0],args_parser().parse_args([]))
+            argequal=(args.net_struct=='resnet18_mlp' and args.layersize_ratio==4.0 and args.num_layer==18 and args.batch_size==2 and
+                      args.epochs==5 and args.seed==1 and args.optimizer=='adam' and args.normalize_flag=='Y' and args.rnn_struct==0)
+            rowequal=sweep_runner.parse_rows("1,3-5",10)==[1,3,4,5] and sweep_runner.parse_rows("",3)==[1,2,3]
+            ##arrays passed by shared memory, the array used twice is shared once
+            shmlist=[]
+            vec=np.arange(0,6)
+            sharedict=sweep_runner._share_dict({"a": vec,"b": {"c": vec*2.0},"d": vec,"e": 'str'},shmlist,{})
+            attachlist=[]
+            datawrap=sweep_runner._attach_dict(sharedict,attachlist)
+            shareequal=np.array_equal(datawrap["a"],vec) and np.array_equal(datawrap["b"]["c"],vec*2.0) and datawrap["e"]=='str' and len(shmlist)==2
+            del(datawrap)
+            for shm in attachlist:
+                shm.close()
+            for shm in shmlist:
+                shm.close()
+                shm.unlink()
+            if argequal and rowequal and shareequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_metrics_log(self):
+        try:
+            from metrics_log import metrics_writer, metrics_read, metrics_epoch
+            filelist=[test_output+'metrics_test_'+str(runi)+'.csv' for runi in range(2)]
+            for runi, filename in enumerate(filelist):
+                metrics=metrics_writer(filename)
+                for epoch in range(1,3):
+                    for batch in range(0,20,10):
+                        metrics.write(phase='train',epoch=epoch,batch=batch,loss=runi+epoch+batch,lr=0.01,nsample=10,samples_per_s=100.0,data_time=0.02,compute_time=0.08)
+                    metrics.write(phase='train_epoch',epoch=epoch,batch=20,loss=runi+epoch+5,lr=0.01,nsample=200,samples_per_s=100.0,data_time=0.4,compute_time=1.6)
+                    metrics.write(phase='validate',epoch=epoch,batch=2,loss=runi+epoch*2,lr='',nsample=20,samples_per_s=200.0,data_time=0.02,compute_time=0.08)
+                metrics.close()
+            ##appended rows keep one header
+            metrics=metrics_writer(filelist[1],mode='a')
+            metrics.write(phase='test',epoch=2,batch=2,loss=1.0)
+            metrics.close()
+            tab=metrics_read({'a': filelist[0],'b': filelist[1]})
+            epochtab=metrics_epoch(tab)
+            shapeequal=tab.shape[0]==17 and epochtab.shape[0]==4 and list(epochtab['names'])==['a','a','b','b']
+            valequal=(list(epochtab['train'])==[1,2,2,3] and list(epochtab['train_mean'])==[6,7,7,8] and
+                      list(epochtab['validate'])==[2,4,3,5] and np.allclose(epochtab['compute_time'],1.6))
+            for filename in filelist:
+                os.unlink(filename)
+            if shapeequal and valequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_precision_parity(self):
+        try:
+            import argparse
+            from train_mlp_full_modified import autocast_dtype
+            from nnt_predict import build_model
+            from data_struc import rnn_input_reshape
+            torch.manual_seed(1)
+            device=torch.device('cpu')
+            ntime=5
+            nspec=4
+            ntheta=11
+            data=torch.rand(3*ntime,ntheta)
+            target=torch.rand(3*ntime,nspec)
+            ampdtype=autocast_dtype(argparse.Namespace(precision='bf16'),device)
+            testres=[ampdtype==torch.bfloat16 and autocast_dtype(argparse.Namespace(precision='fp32'),device) is None]
+            try:
+                autocast_dtype(argparse.Namespace(precision='fp16'),device)
+                testres.append(False)
+            except ValueError:
+                testres.append(True)
+            for modelname in ['resnet18_mlp','mlp_mod','gru_rnn','diffaddcell_rnn']:
+                rnn_struct=int(modelname.endswith('_rnn'))
+                modelargs=argparse.Namespace(net_struct=modelname,rnn_struct=rnn_struct,num_layer=(1 if rnn_struct==1 else 4),layersize_ratio=1.0,p=0.0,batchnorm_flag='Y')
+                model=build_model(modelargs,ntheta,nspec)
+                modelinput=rnn_input_reshape(data,ntheta,nspec,ntime) if rnn_struct==1 else (data,)
+                model.eval()
+                with torch.no_grad():
+                    loss32=torch.nn.functional.mse_loss(model(*modelinput),target).item()
+                    with torch.autocast(device_type=device.type,dtype=ampdtype):
+                        output=model(*modelinput)
+                    loss16=torch.nn.functional.mse_loss(output.float(),target).item()
+                testres.append(abs(loss16-loss32)<0.05*loss32)
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_export_model(self):
+        try:
+            import argparse
+            import nnt_struc as models
+            from nnt_predict import build_model, example_input, nnt_predictor, export_model, load_exported
+            torch.manual_seed(1)
+            ntheta=11
+            nspec=4
+            rows=torch.randn(9,ntheta)
+            normstat={"mean": rows.mean(0).numpy(), "std": rows.std(0).numpy()+1.0}
+            args=argparse.Namespace(net_struct='resnet18_mlp',rnn_struct=0,num_layer=0,p=0.0,layersize_ratio=1.0,batchnorm_flag='Y',
+                                    ntheta=ntheta,nspec=nspec,timetrainlen=3,normalize_flag='Y')
+            model=build_model(args,ntheta,nspec)
+            checkpoint={'args_input': args,'state_dict': model.state_dict(),'normstat': normstat}
+            outref=nnt_predictor(checkpoint).predict_rows(rows)
+            testres=[]
+            for method in ['script','export']:
+                filename=test_output+'export_test.'+method+'.pt2'
+                export_model(checkpoint,filename,method=method)
+                with torch.no_grad():
+                    out=load_exported(filename)(rows)
+                testres.append(torch.allclose(out,outref,atol=1e-5))
+                os.unlink(filename)
+            ##compiled in place, same keys of state_dict, the trial run on the example input keeps the buffers
+            compiled=models.compile_model(build_model(args,ntheta,nspec),example_input=example_input(args,ntheta,nspec))
+            testres.append(list(compiled.state_dict().keys())==list(model.state_dict().keys()))
+            testres.append(all([torch.equal(value,model.state_dict()[key]) for key, value in compiled.state_dict().items() if 'running' in key]))
+            compiled.eval()
+            with torch.no_grad():
+                testres.append(compiled(rows).shape==(rows.shape[0],nspec))
+            ##the model is returned in eager mode with a warning if the trial run fails, and still runs
+            with warnings.catch_warnings(record=True) as warnlist:
+                warnings.simplefilter('always')
+                failed=models.compile_model(model,example_input=(torch.zeros(2,ntheta+1),))
+            testres.append(failed is model and any(['can not be compiled' in str(warn.message) for warn in warnlist]))
+            model.eval()
+            with torch.no_grad():
+                testres.append(torch.allclose(failed((rows-torch.Tensor(normstat["mean"]))/torch.Tensor(normstat["std"])),outref,atol=1e-5))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_fuse_for_inference(self):
+        try:
+            import nnt_struc as models
+            torch.manual_seed(1)
+            x=torch.randn(64,11)*2.0+1.0
+            testres=[]
+            for modelname, kwargs in [('resnet18_mlp',{}),('resnet50_mlp',{}),('mlp_mod',{'nlayer': 4}),('mlp_mod',{'nlayer': 4,'batchnorm_flag': False})]:
+                model=models.__dict__[modelname](ninput=11,num_response=4,ncellscale=2.0,p=0.2,**kwargs)
+                ##non trivial running statistics and affine parameters
+                model.train()
+                with torch.no_grad():
+                    model(x)
+                    for m in model.modules():
+                        if isinstance(m,torch.nn.BatchNorm1d):
+                            m.weight.uniform_(0.5,1.5)
+                            m.bias.normal_()
+                model.eval()
+                fused=models.fuse_for_inference(torch.nn.DataParallel(model))
+                nbn=len([m for m in fused.modules() if isinstance(m,(torch.nn.BatchNorm1d,torch.nn.Dropout))])
+                with torch.no_grad():
+                    testres.append(nbn==0 and torch.allclose(fused(x),model(x),rtol=1e-4,atol=1e-4) and not fused.training)
+            try:
+                models.fuse_for_inference(models.gru_rnn(ntheta=11,nspec=4,num_layer=1))
+                testres.append(False)
+            except ValueError:
+                testres.append(True)
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_quantize_model(self):
+        try:
+            import argparse
+            from nnt_predict import build_model, nnt_predictor, load_exported
+            from nnt_quantize import quantize_model, quantize_report
+            torch.manual_seed(1)
+            ntheta=11
+            nspec=4
+            rows=torch.rand(200,ntheta)
+            normstat={"mean": rows.mean(0).numpy(), "std": rows.std(0).numpy()}
+            args=argparse.Namespace(net_struct='resnet18_mlp',rnn_struct=0,num_layer=0,p=0.0,layersize_ratio=1.0,batchnorm_flag='Y',
+                                    ntheta=ntheta,nspec=nspec,timetrainlen=5,normalize_flag='Y')
+            checkpoint={'args_input': args,'state_dict': build_model(args,ntheta,nspec).state_dict(),'normstat': normstat}
+            predictor=nnt_predictor(checkpoint,fuse=True)
+            outref=predictor.predict_rows(rows)
+            testres=[]
+            for mode in ['dynamic','static']:
+                quantmodel=quantize_model(predictor,mode=mode,calib_rows=rows)
+                filename=test_output+'quantize_test.'+mode+'.pt'
+                torch.jit.save(torch.jit.script(quantmodel),filename)
+                with torch.no_grad():
+                    out=load_exported(filename)(rows)
+                os.unlink(filename)
+                report=quantize_report(predictor,quantmodel,rows,outref,nrep=1)
+                testres.append(out.shape==outref.shape and torch.norm(out-outref)<0.2*torch.norm(outref) and report["mse_float"]<1e-8 and report["speedup"]>0)
+            ##the float predictor is not changed by quantization
+            testres.append(torch.allclose(predictor.predict_rows(rows),outref))
+            try:
+                quantize_model(nnt_predictor(checkpoint),mode='dynamic')
+                testres.append(False)
+            except ValueError:
+                testres.append(True)
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_checkpoint_manager(self):
+        try:
+            from checkpoint_manager import checkpoint_manager
+            ckptdir=test_output+'checkpoint_test/'
+            os.makedirs(ckptdir,exist_ok=True)
+            manager=checkpoint_manager(filename=ckptdir+'checkpoint.resnetode.tar',best_filename=ckptdir+'model_best.resnetode.tar',
+                                       best_train_filename=ckptdir+'model_best_train.resnetode.tar',keep_last=2,save_interval=2)
+            weight=torch.zeros(3)
+            written=[]
+            for epoch in range(1,7):
+                weight+=1.0##changed in place after each save, the written snapshot keeps the value of the epoch
+                written.append(manager.save({'epoch': epoch,'state_dict': {'weight': weight}},epoch,is_best=(epoch==3),is_best_train=(epoch==4),force=(epoch==6)))
+            manager.close()
+            loadepoch={x: torch.load(ckptdir+x,weights_only=False) for x in ['checkpoint.resnetode.tar','model_best.resnetode.tar','model_best_train.resnetode.tar']}
+            fileequal=sorted([f for f in os.listdir(ckptdir) if 'epoch' in f])==['checkpoint.resnetode.epoch4.tar','checkpoint.resnetode.epoch6.tar']
+            epochequal=[loadepoch[x]['epoch'] for x in loadepoch.keys()]==[6,3,4] and torch.equal(loadepoch['model_best.resnetode.tar']['state_dict']['weight'],torch.full((3,),3.0))
+            linkequal=os.path.samefile(ckptdir+'checkpoint.resnetode.tar',ckptdir+'checkpoint.resnetode.epoch6.tar')
+            if written==[False,True,True,True,False,True] and fileequal and epochequal and linkequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_resume_state(self):
+        try:
+            import h5py
+            from train_mlp_full_modified import rng_state_get, rng_state_set, data_separation, args_parser
+            from data_struc import run_artifact_load
+            ##random states restored
+            rngstate=rng_state_get()
+            draw1=(random.random(),np.random.rand(),torch.rand(1).item())
+            rng_state_set(rngstate)
+            draw2=(random.random(),np.random.rand(),torch.rand(1).item())
+            ##separation of a previous run
+            split=run_artifact_load(test_input+'run_artifact.h5')
+            with h5py.File(test_input+runinputlist,'r') as f:
+                Xvar=np.array(f.get('inputstore')).transpose()
+                ResponseVar=np.array(f.get('outputstore')).transpose()
+                samplevec=np.squeeze(np.array(f.get('samplevec')).astype(int)-1)
+                nthetaset=int(np.array(f.get('nthetaset'))[0][0])
+                ntimetotal=int(np.array(f.get('ntime'))[0][0])
+            datadict={"inputfile": runinputlist,"inputpath": test_input+runinputlist,"Xvar": Xvar,"ResponseVar": ResponseVar,
+                      "datashape": (Xvar.shape,ResponseVar.shape),"samplevec": samplevec,"nthetaset": nthetaset,"ntimetotal": ntimetotal}
+            args=args_parser().parse_args(['--timetrainlen','21'])
+            datawrap=data_separation(args,datadict,split=split)
+            splitequal=all([np.array_equal(datawrap["ind_separa"][x],split["ind_separa"][x]) for x in ['train','validate','test']])
+            statequal=np.allclose(datawrap["normstat"]["mean"],split["normstat"]["mean"]) and np.allclose(datawrap["normstat"]["std"],split["normstat"]["std"])
+            if draw1==draw2 and splitequal and statequal:
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_resume_run(self):
+        try:
+            import pandas as pd
+            from nnt_evaluate import eval_summary_load
+            resumedir=test_output+'resume_test/'
+            os.makedirs(resumedir+'data/',exist_ok=True)
+            os.makedirs(resumedir+'code/',exist_ok=True)
+            shutil.copyfile(test_input+runinputlist,resumedir+'data/'+runinputlist)
+            for codefile in runcodelist:
+                shutil.copyfile(sourcodedir+codefile,resumedir+'code/'+codefile)
+            os.chdir(resumedir+'code/')
+            command='python3 train_mlp_full_modified.py --batch-size 42 --test-batch-size 42 --learning-rate 0.01 --seed 1 --net-struct resnet18_mlp --layersize-ratio 1 --optimizer adam --num-layer 2 --timetrainlen 21 --gpu-use 0 --inputfile '+runinputlist+' --keep-checkpoint 2 '
+            ##uninterrupted run
+            os.system(command+'--epochs 5 > output 2>&1')
+            metricsfull=pd.read_csv('metrics.csv')
+            for filename in glob.glob('checkpoint.resnetode.epoch*.tar'):
+                os.unlink(filename)
+            ##a run interrupted after the checkpoint of epoch 4 and continued from the checkpoint of epoch 3, the rows of epoch 4 are written again
+            os.system(command+'--epochs 4 > output 2>&1')
+            os.system(command+'--epochs 5 --resume checkpoint.resnetode.epoch3.tar > output 2>&1')
+            metricsres=pd.read_csv('metrics.csv')
+            evalsummary=eval_summary_load('eval_summary.h5')
+            epochfiles=sorted([f for f in os.listdir('.') if re.match(r'checkpoint\.resnetode\.epoch\d+\.tar$',f)])
+            os.chdir(prepath)
+            validfull=metricsfull[metricsfull['phase']=='validate']
+            validres=metricsres[metricsres['phase']=='validate']
+            testres=[validres['epoch'].tolist()==[1,2,3,4,5] and np.allclose(validres['loss'].values,validfull['loss'].values)]
+            testres.append(metricsres[metricsres['phase']=='test']['epoch'].tolist()==[5])
+            testres.append(evalsummary['validate']['epoch'].tolist()==[1,2,3,4,5] and evalsummary['test']['epoch'].tolist()==[5])
+            ##the epoch checkpoints before the restart are pruned by --keep-checkpoint
+            testres.append(epochfiles==['checkpoint.resnetode.epoch4.tar','checkpoint.resnetode.epoch5.tar'])
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            os.chdir(prepath)
+            self.assertTrue(False)
+
+    def test_residue_stat(self):
+        try:
+            import argparse
+            import h5py
+            from nnt_predict import build_model, nnt_predictor
+            from nnt_evaluate import predict_residue, group_stat, residue_time_stat
+            from data_struc import dataset_h5_block
+            torch.manual_seed(1)
+            with h5py.File(test_input+runinputlist,'r') as f:
+                Xvar=np.array(f.get('inputstore')).transpose()
+                ResponseVar=np.array(f.get('outputstore')).transpose()
+            ntheta=Xvar.shape[1]
+            nspec=ResponseVar.shape[1]
+            args=argparse.Namespace(net_struct='resnet18_mlp',rnn_struct=0,num_layer=0,p=0.0,layersize_ratio=1.0,batchnorm_flag='Y',
+                                    ntheta=ntheta,nspec=nspec,timetrainlen=21,normalize_flag='N')
+            checkpoint={'args_input': args,'state_dict': build_model(args,ntheta,nspec).state_dict()}
+            predictor=nnt_predictor(checkpoint)
+            ##residue of batches equal to the residue of the whole data set, in memory or read from the file
+            residueref=ResponseVar-predictor.predict_rows(Xvar).numpy()
+            residue,timevec=predict_residue(predictor,Xvar,ResponseVar,nrowbatch=50)
+            residueh5,timeh5=predict_residue(predictor,dataset_h5_block(test_input+runinputlist,np.arange(0,Xvar.shape[0])),nrowbatch=64)
+            testres=[np.allclose(residue,residueref,atol=1e-4),np.allclose(residueh5,residue),np.array_equal(timeh5,timevec)]
+            ##grouped statistics equal to the loop over time points
+            stat=residue_time_stat(predictor,Xvar,ResponseVar)
+            for indmean, timepoint in enumerate(np.unique(timevec)):
+                ind=np.where(timevec==timepoint)[0]
+                testres.append(np.allclose(stat["mean"][indmean],residue[ind].mean(0),atol=1e-5))
+                testres.append(np.allclose(stat["rms"][indmean],np.sqrt((residue[ind].astype(np.float64)**2).mean(0)),atol=1e-5))
+                testres.append(np.allclose(stat["quantile"][:,indmean],np.quantile(residue[ind],(0.05,0.5,0.95),axis=0),atol=1e-5))
+            ##groups of different sizes
+            groups=np.array([2,0,1,2,2,0])
+            values=np.arange(6.0)
+            stat2=group_stat(values,groups,quantiles=(0.5,))
+            testres.append(np.array_equal(stat2["group"],[0,1,2]) and np.array_equal(stat2["count"],[2,1,3]))
+            testres.append(np.allclose(stat2["mean"][:,0],[3.0,2.0,7.0/3]) and np.allclose(stat2["quantile"][0,:,0],[3.0,2.0,3.0]))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_eval_accumulator(self):
+        try:
+            from nnt_evaluate import trajectory_batches, eval_accumulator, eval_summary_writer, eval_summary_load
+            torch.manual_seed(1)
+            ntraj=7
+            ntimetotal=6
+            ntime=4
+            nspec=3
+            output=torch.randn(ntraj*ntimetotal,nspec)
+            target=torch.randn(ntraj*ntimetotal,nspec)
+            err=((output-target).double()**2).view(ntraj,ntimetotal,nspec).numpy()
+            ##batches of 3 time series (the last one is short), sharded over 2 processes and summed
+            accumlist=[eval_accumulator(ntraj,ntimetotal,nspec,ntime=ntime) for rank in range(0,2)]
+            rowseen=[]
+            for rank in range(0,2):
+                for trajind, rowind in trajectory_batches(ntraj,ntimetotal,3,rank=rank,num_replicas=2):
+                    accumlist[rank].update(output[rowind],target[rowind],trajind)
+                    rowseen.append(rowind)
+            accum=accumlist[0]
+            accum.sse+=accumlist[1].sse
+            accum.sse_traj+=accumlist[1].sse_traj
+            accum.ntrajseen+=accumlist[1].ntrajseen
+            summary=accum.summary()
+            testres=[np.array_equal(np.sort(torch.cat(rowseen).numpy()),np.arange(0,ntraj*ntimetotal))]
+            testres.append(np.isclose(summary["mse"],err[:,:ntime].mean()) and np.isclose(summary["loss"],err[:,:ntime].mean()*ntime))
+            testres.append(np.allclose(summary["mse_spec"],err[:,:ntime].mean((0,1))) and np.allclose(summary["mse_time"],err.mean((0,2))))
+            testres.append(np.allclose(summary["mse_traj"],err[:,:ntime].mean((1,2))) and np.allclose(summary["mse_extr_traj"],err[:,ntime:].mean((1,2))))
+            testres.append(np.isclose(summary["mse_extr"],err[:,ntime:].mean()) and np.allclose(summary["mse_extr_spec"],err[:,ntime:].mean((0,1))))
+            ##no extrapolation window
+            accum2=eval_accumulator(ntraj,ntimetotal,nspec)
+            accum2.update(output,target,torch.arange(0,ntraj))
+            summary2=accum2.summary()
+            testres.append(np.isclose(summary2["mse"],err.mean()) and np.isnan(summary2["mse_extr"]))
+            ##summary of two epochs stored and read
+            filename=test_output+'eval_summary_test.h5'
+            writer=eval_summary_writer(filename)
+            writer.write('validate',1,summary,traj=np.arange(0,ntraj))
+            writer.write('validate',2,summary2,traj=np.arange(0,ntraj))
+            writer.close()
+            store=eval_summary_load(filename)["validate"]
+            os.unlink(filename)
+            testres.append(np.array_equal(store["epoch"],[1,2]) and store["mse_time"].shape==(2,ntimetotal) and store["mse_traj"].shape==(2,ntraj))
+            testres.append(np.allclose(store["mse_spec"][0],summary["mse_spec"],rtol=1e-6))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_extrapolate(self):
+        try:
+            import argparse
+            from nnt_predict import build_model, nnt_predictor
+            torch.manual_seed(1)
+            ntheta=11
+            nspec=4
+            ntime=5
+            theta=torch.rand(13,ntheta-1-nspec)
+            initialvec=torch.rand(13,nspec)
+            timeseq=torch.arange(0,9)*0.5
+            testres=[]
+            for net_struct, rnn_struct in [('resnet18_mlp',0),('gru_rnn',1),('diffaddcell_rnn',1)]:
+                args=argparse.Namespace(net_struct=net_struct,rnn_struct=rnn_struct,num_layer=2,p=0.0,layersize_ratio=1.0,batchnorm_flag='Y',
+                                        ntheta=ntheta,nspec=nspec,timetrainlen=ntime,normalize_flag='N')
+                checkpoint={'args_input': args,'state_dict': build_model(args,ntheta,nspec).state_dict()}
+                predictor=nnt_predictor(checkpoint,batch_size=40)
+                outref=predictor.predict(theta,initialvec,timeseq)
+                output=predictor.extrapolate(theta,initialvec,timeseq,ntime=ntime)
+                testres.append(output.shape==(13,9,nspec) and torch.allclose(output[:,:ntime],outref[:,:ntime],rtol=1e-4,atol=1e-4))
+                if rnn_struct==1:##the continued hidden state is the same as the whole time series
+                    testres.append(torch.allclose(output,outref,rtol=1e-4,atol=1e-4))
+                else:##each point is predicted from the previous prediction, one time step after t_0
+                    prevout=outref[:,ntime-1]
+                    for timek in range(ntime,9):
+                        prevout=predictor.predict(theta,prevout,timeseq[timek:(timek+1)]-timeseq[timek-1]+timeseq[0])[:,0]
+                        testres.append(torch.allclose(output[:,timek],prevout,rtol=1e-4,atol=1e-3))
+                    horizonout=predictor.extrapolate(theta,initialvec,timeseq,ntime=ntime,horizonvec=initialvec)
+                    testres.append(torch.allclose(horizonout[:,ntime],predictor.predict(theta,initialvec,timeseq[1:2])[:,0],rtol=1e-4,atol=1e-4))
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_reference_solve(self):
+        try:
+            import h5py
+            from linearodesimu import simulate, read_pattern, reference_solve, theta_to_hmat
+            simufile=test_output+'simu_ref.mat'
+            simulate(simufile,nthetaset=12,timerang=(0.0,2.0),stepsize=0.1,seed=1,ndim=3,chunksize=5,workers=1)
+            with h5py.File(simufile,'r') as f:
+                Xvar=np.array(f.get('inputstore')).transpose()
+                ResponseVar=np.array(f.get('outputstore')).transpose()
+                ResponseVarpre=np.array(f.get('outputstorepre')).transpose()
+                parastore=np.array(f.get('parastore')).transpose()
+                ntime=int(np.array(f.get('ntime'))[0][0])
+            exisind,ndim=read_pattern(simufile)
+            os.unlink(simufile)
+            ##the stored data are reproduced from the input rows
+            testres=[ndim==3 and np.array_equal(reference_solve(Xvar,exisind,ndim,ntime),ResponseVar)]
+            testres.append(np.allclose(reference_solve(Xvar,exisind,ndim,ntime,method="expm",chunksize=5),ResponseVar,atol=1e-10))
+            testres.append(np.allclose(reference_solve(Xvar,exisind,ndim,ntime,scale=False),ResponseVarpre))
+            hmat=theta_to_hmat(Xvar[0:1,:],exisind,ndim)
+            testres.append(np.count_nonzero(hmat)==len(exisind))
+            ##new time grid of each trajectory with the scaling of the stored data
+            Xvarnew=Xvar.reshape(12,ntime,-1)[:,0:5,:].copy()
+            Xvarnew[:,:,-1]=np.sort(np.random.rand(12,5)*3.0,axis=1)
+            Xvarnew=Xvarnew.reshape(12*5,-1)
+            outeig=reference_solve(Xvarnew,exisind,ndim,5,parastore=parastore)
+            outexpm=reference_solve(Xvarnew,exisind,ndim,5,method="expm",parastore=parastore)
+            testres.append(outeig.shape==(60,ndim*2) and np.allclose(outeig,outexpm,atol=1e-10))
+            ##the matlab file has no sparse pattern
+            try:
+                read_pattern(test_input+runinputlist)
+                testres.append(False)
+            except ValueError:
+                testres.append(True)
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
+    def test_benchmark(self):
+        try:
+            from nnt_benchmark import model_names, benchmark_grid, benchmark_compare
+            names=['resnet10_mlp','mlp_mod','gru_rnn']
+            res=benchmark_grid(names,ninput=(11,),ncellscale=(1.0,2.0),batch_size=(42,),threads=(1,),phase=('train','inference'),
+                               verbose=False,ntime=21,warmup=1,repeat=1)
+            results=res["results"]
+            testres=[all([name in model_names for name in names+['wide_resnet101_2_mlp','diffaddcell_rnn']]) and 'ResNet_mlp' not in model_names]
+            testres.append(len(results)==3*2*2 and all([row["samples_per_s"]>0 and "error" not in row for row in results]))
+            ##result file of the benchmark compared with itself
+            filename=test_output+'benchmark_test.json'
+            with open(filename,'w') as f1:
+                json.dump(res,f1)
+            comptab=benchmark_compare(filename,res)
+            os.unlink(filename)
+            testres.append(comptab.shape[0]==len(results) and np.allclose(comptab["ratio"],1.0) and res["meta"]["cpu_count"]==os.cpu_count())
+            if all(testres):
+                self.assertTrue(True)
+            else:
+                self.assertTrue(False)
+        except:
+            self.assertTrue(False)
+
     def test_clean(self):
         try:
             for filename in os.listdir(test_output):